@@ -3,7 +3,7 @@
 {
     "name": "Delivery Yun Express",
     "summary": "Delivery Carrier implementation for Yun Express API",
-    "version": "16.0.1.1.2",
+    "version": "16.0.1.2.0",
     "category": "Delivery",
     "website": "https://github.com/NexaMerchant/delivery_yunexpress",
     "author": "Steve",
@@ -12,9 +12,13 @@
     "depends": ["delivery_package_number", "delivery_state", "delivery_price_method", "sale_order_batch"],
     "data": [
         "security/ir.model.access.csv",
+        "data/ir_cron_data.xml",
+        "data/yunexpress_channel_data.xml",
         "wizards/yunexpress_manifest_wizard_views.xml",
         "wizards/yunexpress_pickup_wizard.xml",
         "views/delivery_yunexpress_view.xml",
         "views/stock_picking_views.xml",
+        "views/yunexpress_channel_views.xml",
+        "views/yunexpress_shipment_views.xml",
     ],
 }
\ No newline at end of file
@@ -0,0 +1,88 @@
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+import json
+import logging
+
+from odoo import http
+from odoo.http import Response, content_disposition, request
+
+from ..models.yunexpress_request import verify_push_signature
+
+_logger = logging.getLogger(__name__)
+
+
+class YunExpressController(http.Controller):
+    @http.route(
+        "/yunexpress/tracking/<int:carrier_id>",
+        type="http",
+        auth="public",
+        methods=["POST"],
+        csrf=False,
+        save_session=False,
+    )
+    def tracking_push(self, carrier_id, **kwargs):
+        """Receive Yun Express tracking pushes. The events are just queued with
+        a single insert, so bursts are absorbed without holding the worker.
+        A cron applies them in batches.
+
+        The body is a GetTrackAllInfo `Item` or a list of them and it's signed
+        with the account secret in the `X-YunExpress-Signature` header.
+        """
+        carrier = request.env["delivery.carrier"].sudo().browse(carrier_id).exists()
+        if (
+            not carrier
+            or carrier.delivery_type != "yunexpress"
+            or not carrier.yunexpress_tracking_push
+        ):
+            return Response(status=404)
+        body = request.httprequest.get_data()
+        signature = request.httprequest.headers.get("X-YunExpress-Signature", "")
+        if not verify_push_signature(carrier.yunexpress_api_secret, body, signature):
+            _logger.warning("Wrong tracking push signature for carrier %s", carrier_id)
+            return Response(status=403)
+        try:
+            items = json.loads(body)
+        except ValueError:
+            return Response(status=400)
+        if isinstance(items, dict):
+            items = [items]
+        events = [
+            {
+                "carrier_id": carrier.id,
+                "tracking_ref": item.get("WaybillNumber") or item.get("WayBillNumber"),
+                "payload": json.dumps(item),
+            }
+            for item in items
+            if isinstance(item, dict)
+            and (item.get("WaybillNumber") or item.get("WayBillNumber"))
+        ]
+        request.env["yunexpress.tracking.event"].sudo().create(events)
+        return Response(
+            json.dumps({"Code": "0000", "Count": len(events)}),
+            content_type="application/json",
+        )
+
+    @http.route("/yunexpress/labels", type="http", auth="user")
+    def print_labels(self, picking_ids="", **kwargs):
+        """Merged labels of the given pickings, streamed without being stored.
+        They come from the label cache filled by the print action.
+        """
+        try:
+            ids = [int(x) for x in picking_ids.split(",") if x]
+        except ValueError:
+            return request.not_found()
+        pickings = request.env["stock.picking"].browse(ids).exists()
+        pickings.check_access_rights("read")
+        pickings.check_access_rule("read")
+        content = pickings.filtered(
+            lambda x: x.delivery_type == "yunexpress" and x.carrier_tracking_ref
+        )._yunexpress_merged_labels()
+        if not content:
+            return request.not_found()
+        return request.make_response(
+            content,
+            headers=[
+                ("Content-Type", "application/pdf"),
+                ("Content-Length", len(content)),
+                ("Content-Disposition", content_disposition("Yun Express labels.pdf")),
+            ],
+        )
@@ -0,0 +1,44 @@
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+from odoo import SUPERUSER_ID, api
+
+from odoo.addons.delivery_yunexpress.models.yunexpress_master_data import (
+    YUNEXPRESS_CHANNELS,
+)
+
+
+def migrate(cr, version):
+    """Link the carriers to the channel records of their former codes"""
+    cr.execute(
+        """
+        SELECT column_name FROM information_schema.columns
+        WHERE table_name = 'delivery_carrier'
+            AND column_name = 'yunexpress_channel_legacy'
+        """
+    )
+    if not cr.fetchone():
+        return
+    env = api.Environment(cr, SUPERUSER_ID, {})
+    Channel = env["yunexpress.channel"].with_context(active_test=False)
+    names = dict(YUNEXPRESS_CHANNELS)
+    cr.execute(
+        """
+        SELECT id, yunexpress_channel_legacy FROM delivery_carrier
+        WHERE yunexpress_channel_legacy IS NOT NULL
+        """
+    )
+    for carrier_id, code in cr.fetchall():
+        channel = Channel.search([("code", "=", code)], limit=1)
+        if not channel:
+            name = names.get(code, code)
+            channel = Channel.create(
+                {
+                    "code": code,
+                    "name": name,
+                    "goods_type": Channel._goods_type_from_name(name),
+                }
+            )
+        cr.execute(
+            "UPDATE delivery_carrier SET yunexpress_channel = %s WHERE id = %s",
+            (channel.id, carrier_id),
+        )
+    cr.execute("ALTER TABLE delivery_carrier DROP COLUMN yunexpress_channel_legacy")
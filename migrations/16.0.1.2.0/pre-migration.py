@@ -0,0 +1,19 @@
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+
+
+def migrate(cr, version):
+    """Keep the channel codes. The field becomes a many2one."""
+    cr.execute(
+        """
+        SELECT data_type FROM information_schema.columns
+        WHERE table_name = 'delivery_carrier' AND column_name = 'yunexpress_channel'
+        """
+    )
+    row = cr.fetchone()
+    if row and row[0] != "integer":
+        cr.execute(
+            """
+            ALTER TABLE delivery_carrier
+            RENAME COLUMN yunexpress_channel TO yunexpress_channel_legacy
+            """
+        )
@@ -1,2 +1,8 @@
 from . import delivery_carrier
 from . import stock_picking
+from . import yunexpress_tracking_event
+from . import yunexpress_service
+from . import yunexpress_channel
+from . import yunexpress_shipment
+from . import yunexpress_rate_limit
+from . import yunexpress_label
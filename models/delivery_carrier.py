@@ -1,19 +1,71 @@
-from odoo import _, api, fields, models
+from odoo import SUPERUSER_ID, _, api, fields, models
 from odoo.exceptions import UserError
+from odoo.tools import split_every
+from odoo.tools.pdf import PdfFileReader, PdfFileWriter, merge_pdf
+import psycopg2
+from psycopg2.extras import execute_values
 import logging
 from odoo.tools.config import config
 from odoo import http
-import requests
-import base64
+import io
+from datetime import timedelta
+from concurrent.futures import ThreadPoolExecutor
 
 _logger = logging.getLogger(__name__)
 
 from .yunexpress_master_data import (
-    YUNEXPRESS_CHANNELS,
+    YUNEXPRESS_DELIVERY_STATES_STATIC,
+    YUNEXPRESS_FINAL_DELIVERY_STATES,
 )
 
-from .yunexpress_request import YUNExpressRequest
+from .yunexpress_async_request import (
+    YUNEXPRESS_ASYNC_CONCURRENCY,
+    YUNExpressAsyncRequest,
+    aiohttp,
+    run_batch,
+)
+from .yunexpress_rate_limit import PgTokenBucket
+from .yunexpress_request import (
+    YUNEXPRESS_TRACKING_NUMBER_CHUNK,
+    YUNExpressRequest,
+    get_breaker,
+)
+
+# Cached clients by (database, carrier id) in this worker. Entries are
+# (fingerprint, YUNExpressRequest) and they're rebuilt when the fingerprint
+# (write date and credentials) differs.
+_yun_clients = {}
+# Carrier fields the cached client depends on
+YUNEXPRESS_CLIENT_FIELDS = {
+    "yunexpress_api_cid",
+    "yunexpress_api_secret",
+    "prod_environment",
+    "debug_logging",
+}
+# Share of the successful API calls logged, tunable with the
+# `yunexpress_log_sample_rate` server option. Failed calls are always logged.
+YUNEXPRESS_LOG_SAMPLE_RATE = 1.0
 
+# Labels printed in every sheet for each document model
+YUNEXPRESS_LABELS_PER_SHEET = {"SINGLE": 1, "MULTI1": 1, "MULTI3": 3, "MULTI4": 4}
+# Orders per Label/Print call. Being a multiple of every sheet size, a sheet is
+# never split between two documents when they're merged. The first call
+# takes the document offset out of it.
+YUNEXPRESS_LABEL_PRINT_CHUNK = 48
+# Concurrent label downloads. Tunable with `yunexpress_download_workers`
+YUNEXPRESS_DOWNLOAD_WORKERS = 8
+# Concurrent cancellations. Tunable with `yunexpress_cancel_workers`
+YUNEXPRESS_CANCEL_WORKERS = 8
+# Concurrent GetTrackAllInfo calls. Tunable with `yunexpress_tracking_workers`
+YUNEXPRESS_TRACKING_WORKERS = 8
+# Pickings synchronized (and committed) at once by the tracking cron
+YUNEXPRESS_TRACKING_CHUNK = 500
+# Tracking poll intervals in hours
+YUNEXPRESS_POLL_MIN_HOURS = 2
+YUNEXPRESS_POLL_MAX_HOURS = 48
+YUNEXPRESS_POLL_PENDING_HOURS = 6
+YUNEXPRESS_POLL_INCIDENCE_HOURS = 4
+YUNEXPRESS_POLL_DUE_HOURS = 6
 
 
 class DeliveryCarrier(models.Model):
@@ -32,9 +84,16 @@ class DeliveryCarrier(models.Model):
         help="Yun Express API Secret. This is the password used to connect to the API.",
     )
 
-    yunexpress_channel = fields.Selection(
-        selection=YUNEXPRESS_CHANNELS,
+    yunexpress_channel = fields.Many2one(
+        comodel_name="yunexpress.channel",
         string="Channel",
+        ondelete="restrict",
+    )
+
+    yunexpress_shipping_type = fields.Selection(
+        selection="_selection_yunexpress_shipping_type",
+        string="Service",
+        help="Services allowed for the account, as cached from Yun Express.",
     )
 
     yunexpress_document_model_code = fields.Selection(
@@ -53,6 +112,64 @@ class DeliveryCarrier(models.Model):
         string="Document format",
     )
     yunexpress_document_offset = fields.Integer(string="Document Offset")
+    yunexpress_transit_days = fields.Integer(
+        string="Transit days",
+        default=10,
+        help="Typical days from dispatch to delivery for this channel. Tracking "
+        "is checked more often as parcels approach it.",
+    )
+    yunexpress_tracking_push = fields.Boolean(
+        string="Tracking push",
+        help="Yun Express pushes the tracking events to this database, so the "
+        "tracking states are barely polled.",
+    )
+    yunexpress_tracking_push_url = fields.Char(
+        string="Tracking push URL",
+        compute="_compute_yunexpress_tracking_push_url",
+    )
+    yunexpress_breaker_state = fields.Selection(
+        selection=[
+            ("closed", "Available"),
+            ("open", "Unavailable"),
+            ("half_open", "Probing"),
+        ],
+        string="API status",
+        compute="_compute_yunexpress_breaker",
+        help="Circuit breaker state of the account in this server worker",
+    )
+    yunexpress_retry_count = fields.Integer(
+        string="API retries", compute="_compute_yunexpress_breaker"
+    )
+    yunexpress_last_error = fields.Char(
+        string="Last API error", compute="_compute_yunexpress_breaker"
+    )
+    yunexpress_async_dispatch = fields.Boolean(
+        string="Send in background",
+        help="Validated pickings are queued and sent to Yun Express by background "
+        "workers. The user is notified when the labels are ready.",
+    )
+    yunexpress_send_batch_size = fields.Integer(
+        string="Orders per request",
+        default=10,
+        help="Number of pickings submitted in every CreateOrder call when several "
+        "pickings are validated at once.",
+    )
+
+    def _compute_yunexpress_breaker(self):
+        for carrier in self:
+            stats = get_breaker(
+                carrier._yunexpress_api_cid(), carrier.prod_environment
+            ).stats()
+            carrier.yunexpress_breaker_state = stats["state"]
+            carrier.yunexpress_retry_count = stats["retries"]
+            carrier.yunexpress_last_error = stats["last_error"]
+
+    def _compute_yunexpress_tracking_push_url(self):
+        base_url = self.env["ir.config_parameter"].sudo().get_param("web.base.url")
+        for carrier in self:
+            carrier.yunexpress_tracking_push_url = "{}/yunexpress/tracking/{}".format(
+                base_url, carrier.id
+            )
 
     @api.onchange("delivery_type")
     def _onchange_delivery_type_yun(self):
@@ -60,42 +177,133 @@ class DeliveryCarrier(models.Model):
         if self.delivery_type == "yunexpress":
             self.price_method = "base_on_rule"
 
+    def _yunexpress_api_cid(self):
+        """API Client ID of the carrier, or the server one if it has none
+
+        :return str: API Client ID
+        """
+        self.ensure_one()
+        return self.yunexpress_api_cid or config.get("yun_api_cid")
+
     def _yun_request(self):
-        """Get YUN Request object
+        """Get YUN Request object. Clients are cached per worker and carrier, so
+        the credentials, token and pooled session are resolved only once. The
+        cache entry is discarded as soon as the carrier changes.
 
         :return YUNExpressRequest: Yun Express Request object
         """
-        _logger.debug("yunexpress_api_cid: %s", self.yunexpress_api_cid)
-        if not self.yunexpress_api_cid:
-            _logger.warning("yunexpress_api_cid is False, please check configuration.")
-        record_values = self.read()[0]
-        _logger.debug("yunexpress_api_secret: %s", record_values["yunexpress_api_secret"])
-        if self.yunexpress_api_secret is False:
-            # read the value from the configuration
-            _logger.warning("yunexpress_api_secret is False, please check configuration.")
-            self.yunexpress_api_secret = config.get(
-                "yun_api_secret", self.yunexpress_api_secret
+        self.ensure_one()
+        api_cid = self._yunexpress_api_cid()
+        api_secret = self.yunexpress_api_secret or config.get("yun_api_secret")
+        fingerprint = (
+            self.write_date,
+            api_cid,
+            api_secret,
+            self.prod_environment,
+            self.debug_logging,
+            config.get("yunexpress_api_url"),
+        )
+        key = (self.env.cr.dbname, self.id)
+        cached = _yun_clients.get(key)
+        if cached and cached[0] == fingerprint:
+            return cached[1]
+        if not api_cid or not api_secret:
+            _logger.warning(
+                "Yun Express credentials missing for carrier %s, please check "
+                "configuration.",
+                self.id,
             )
-        if self.yunexpress_api_cid is False:
-            self.yunexpress_api_cid = config.get(
-                "yun_api_cid", self.yunexpress_api_cid
+        pool_options = {
+            option: int(config[key])
+            for option, key in (
+                ("pool_connections", "yunexpress_pool_connections"),
+                ("pool_maxsize", "yunexpress_pool_maxsize"),
             )
-        
+            if config.get(key)
+        }
+        yun_request = YUNExpressRequest(
+            api_cid=api_cid,
+            api_secret=api_secret,
+            prod=self.prod_environment,
+            rate_limiter=PgTokenBucket(self.env.cr.dbname, api_cid),
+            record_exchanges=self.debug_logging,
+            log_sample_rate=float(
+                config.get("yunexpress_log_sample_rate") or YUNEXPRESS_LOG_SAMPLE_RATE
+            ),
+            api_url=config.get("yunexpress_api_url"),
+            **pool_options,
+        )
+        _yun_clients[key] = (fingerprint, yun_request)
+        return yun_request
+
+    def _yun_async_request(self):
+        """Get the asynchronous YUN client, for the calls fanned out by the
+        hundreds. Its pool lives in the event loop of a batch, so it isn't
+        cached.
 
-        return YUNExpressRequest(
-            api_cid=self.yunexpress_api_cid,
-            api_secret=self.yunexpress_api_secret,
+        :return YUNExpressAsyncRequest: Client or None when aiohttp isn't
+            available
+        """
+        self.ensure_one()
+        if aiohttp is None:
+            return None
+        return YUNExpressAsyncRequest(
+            api_cid=self._yunexpress_api_cid(),
+            api_secret=self.yunexpress_api_secret or config.get("yun_api_secret"),
             prod=self.prod_environment,
+            concurrency=int(
+                config.get("yunexpress_async_concurrency")
+                or YUNEXPRESS_ASYNC_CONCURRENCY
+            ),
+            rate_limiter=PgTokenBucket(self.env.cr.dbname, self._yunexpress_api_cid()),
+            record_exchanges=self.debug_logging,
+            log_sample_rate=float(
+                config.get("yunexpress_log_sample_rate") or YUNEXPRESS_LOG_SAMPLE_RATE
+            ),
+            api_url=config.get("yunexpress_api_url"),
         )
 
+    def write(self, vals):
+        if YUNEXPRESS_CLIENT_FIELDS.intersection(vals):
+            for carrier in self:
+                _yun_clients.pop((self.env.cr.dbname, carrier.id), None)
+        return super().write(vals)
+
     @api.model
     def _yun_log_request(self, yun_request):
-        """When debug is active requests/responses will be logged in ir.logging
+        """When debug is active requests/responses will be logged in ir.logging.
+        The exchanges buffered by the client are written at once in their own
+        transaction, so they're kept even if the operation is rolled back.
 
         :param yun_request yun_request: Yun Express request object
         """
-        self.log_xml(yun_request.yun_last_request, "yun_request")
-        self.log_xml(yun_request.yun_last_response, "ctt_response")
+        exchanges = yun_request.pop_exchanges()
+        if not exchanges:
+            return
+        dbname = self.env.cr.dbname
+        vals_list = [
+            {
+                "name": "delivery.carrier",
+                "type": "server",
+                "dbname": dbname,
+                "level": "DEBUG",
+                "message": "{}\n\n{}".format(
+                    exchange.format_request(), exchange.format_response()
+                ),
+                "path": "yunexpress",
+                "func": exchange.endpoint,
+                "line": "1",
+            }
+            for exchange in exchanges
+        ]
+        if self.env.registry.in_test_mode():
+            self.env["ir.logging"].sudo().create(vals_list)
+            return
+        try:
+            with self.env.registry.cursor() as cr:
+                api.Environment(cr, SUPERUSER_ID, {})["ir.logging"].create(vals_list)
+        except psycopg2.Error:
+            _logger.warning("Yun Express exchanges couldn't be recorded")
 
     def _yun_check_error(self, error):
         """Common error checking. We stop the program when an error is returned.
@@ -103,9 +311,6 @@ class DeliveryCarrier(models.Model):
         :param list error: List of tuples in the form of (code, description)
         :raises UserError: Prompt the error to the user
         """
-        print(error)
-        return
-
         if not error:
             return
         error_msg = ""
@@ -121,59 +326,194 @@ class DeliveryCarrier(models.Model):
     def _yunexpress_format_tracking(self, tracking):
         """Helper to forma tracking history strings
 
-        :param OrderedDict tracking: YUN tracking values
+        :param TrackingEvent tracking: YUN tracking event
         :return str: Tracking line
         """
-        status = "{} - [{}] {}".format(
-            fields.Datetime.to_string(tracking["StatusDateTime"]),
-            tracking["StatusCode"],
-            tracking["StatusDescription"],
+        status = "{} - {}".format(tracking.date.replace("T", " "), tracking.content)
+        if tracking.location:
+            status += " ({})".format(tracking.location)
+        return status
+
+    @api.model
+    def _selection_yunexpress_shipping_type(self):
+        """Every service cached for the Yun Express accounts"""
+        services = self.env["yunexpress.service"].sudo().search_read(
+            [], ["code", "name"], order="code"
         )
-        if tracking["IncidentCode"]:
-            status += " ({}) - {}".format(
-                tracking["IncidentCode"], tracking["IncidentDescription"]
+        return list({s["code"]: (s["code"], s["name"]) for s in services}.values())
+
+    def _yunexpress_services(self):
+        """Cached services allowed for the carrier account
+
+        :return recordset: `yunexpress.service` records
+        """
+        self.ensure_one()
+        return (
+            self.env["yunexpress.service"]
+            .sudo()
+            .search(
+                [
+                    ("api_cid", "=", self._yunexpress_api_cid()),
+                    ("prod_environment", "=", self.prod_environment),
+                ]
             )
-        return status
+        )
+
+    def _yunexpress_refresh_services(self):
+        """Refresh the cached services for the carriers accounts"""
+        Service = self.env["yunexpress.service"].sudo()
+        accounts = {}
+        for carrier in self.filtered(lambda x: x._yunexpress_api_cid()):
+            accounts.setdefault(
+                (carrier._yunexpress_api_cid(), carrier.prod_environment), carrier
+            )
+        for (api_cid, prod), carrier in accounts.items():
+            yun_request = carrier._yun_request()
+            try:
+                error, service_types = yun_request.get_service_types()
+            finally:
+                carrier._yun_log_request(yun_request)
+            carrier._yun_check_error(error)
+            Service.search(
+                [("api_cid", "=", api_cid), ("prod_environment", "=", prod)]
+            ).unlink()
+            Service.create(
+                [
+                    {
+                        "api_cid": api_cid,
+                        "prod_environment": prod,
+                        "code": code,
+                        "name": name,
+                    }
+                    for code, name in service_types
+                ]
+            )
+
+    @api.model
+    def _cron_yunexpress_refresh_services(self):
+        """Refresh the accounts which services cache expired"""
+        ttl = int(
+            self.env["ir.config_parameter"]
+            .sudo()
+            .get_param("delivery_yunexpress.service_ttl_hours", 24)
+        )
+        carriers = self.search([("delivery_type", "=", "yunexpress")])
+        fresh = self.env["yunexpress.service"].sudo().search(
+            [("write_date", ">", fields.Datetime.now() - timedelta(hours=ttl))]
+        )
+        fresh_accounts = {(s.api_cid, s.prod_environment) for s in fresh}
+        for carrier in carriers:
+            account = (carrier._yunexpress_api_cid(), carrier.prod_environment)
+            if account in fresh_accounts:
+                continue
+            fresh_accounts.add(account)
+            # An account failing shouldn't stop the others
+            try:
+                carrier._yunexpress_refresh_services()
+            except Exception as e:
+                _logger.warning(
+                    "Yun Express services of %s couldn't be refreshed: %s",
+                    carrier.name,
+                    e,
+                )
+
+    def action_yunexpress_sync_channels(self):
+        """Synchronize the shipping channels of the carriers accounts"""
+        self._yunexpress_sync_channels()
+
+    def _yunexpress_sync_channels(self, country_codes=None):
+        """Synchronize the shipping channels from the shipping methods API.
+        The country coverage is gathered for the given countries, with one
+        call per country running concurrently.
+
+        :param list country_codes: Destination country codes to check
+        """
+        accounts = {}
+        for carrier in self.filtered(lambda x: x._yunexpress_api_cid()):
+            accounts.setdefault(
+                (carrier._yunexpress_api_cid(), carrier.prod_environment), carrier
+            )
+        # The channels of every account are synchronized at once, those none
+        # of them returns are retired
+        methods = []
+        coverage = {}
+        for carrier in accounts.values():
+            yun_request = carrier._yun_request()
+            try:
+                methods += yun_request.get_shipping_methods()
+                if country_codes:
+                    results = self._yunexpress_concurrent_map(
+                        yun_request.get_shipping_methods,
+                        list(country_codes),
+                        int(
+                            config.get("yunexpress_tracking_workers")
+                            or YUNEXPRESS_TRACKING_WORKERS
+                        ),
+                    )
+                    for country_code, country_methods in zip(country_codes, results):
+                        coverage.setdefault(country_code, set()).update(
+                            m.get("Code") for m in country_methods
+                        )
+            finally:
+                carrier._yun_log_request(yun_request)
+        if accounts:
+            self.env["yunexpress.channel"].sudo()._sync(methods, coverage)
+
+    @api.model
+    def _cron_yunexpress_sync_channels(self):
+        """Synchronize the channels and their coverage for the countries we
+        ship to"""
+        carriers = self.search([("delivery_type", "=", "yunexpress")])
+        self.env.cr.execute(
+            """
+            SELECT DISTINCT rc.code
+            FROM stock_picking sp
+            JOIN res_partner rp ON rp.id = sp.partner_id
+            JOIN res_country rc ON rc.id = rp.country_id
+            WHERE sp.carrier_id IN %s
+            """,
+            (tuple(carriers.ids) or (0,),),
+        )
+        country_codes = [row[0] for row in self.env.cr.fetchall()]
+        carriers._yunexpress_sync_channels(country_codes)
 
     @api.onchange("yunexpress_shipping_type")
     def _onchange_yunexpress_shipping_type(self):
-        """Control service validity according to credentials
+        """Control service validity according to credentials. The services
+        come from the local cache, so we never wait for the API here.
 
         :raises UserError: We list the available services for given credentials
         """
         if not self.yunexpress_shipping_type:
             return
+        services = self._yunexpress_services()
         # Avoid checking if credentianls aren't setup or are invalid
-        yun_request = self._yun_request()
-        error, service_types = yun_request.get_service_types()
-        self._yun_log_request(yun_request)
-        self._yun_check_error(error)
-        type_codes, type_descriptions = zip(*service_types)
-        if self.yunexpress_shipping_type not in type_codes:
+        if not services:
+            return
+        if self.yunexpress_shipping_type not in services.mapped("code"):
             service_name = dict(
                 self._fields["yunexpress_shipping_type"]._description_selection(
                     self.env
                 )
-            )[self.yunexpress_shipping_type]
+            ).get(self.yunexpress_shipping_type, self.yunexpress_shipping_type)
             raise UserError(
                 _(
                     "This Yun Express service (%(service_name)s) isn't allowed for "
                     "this account configuration. Please choose one of the followings\n"
                     "%(type_descriptions)s",
                     service_name=service_name,
-                    type_descriptions=type_descriptions,
+                    type_descriptions=", ".join(services.mapped("name")),
                 )
             )
 
     def action_yun_validate_user(self):
-        """Maps to API's ValidateUser method
+        """Maps to API's ValidateUser method. The services cache of the account
+        is refreshed on the way.
 
         :raises UserError: If the user credentials aren't valid
         """
         self.ensure_one()
-        yun_request = self._yun_request()
-        error = yun_request.validate_user()
-        self._yun_log_request(yun_request)
+        self._yunexpress_refresh_services()
 
     def _prepare_yunexpress_shipping(self, picking):
         """Convert picking values for Yun Express API
@@ -182,130 +522,183 @@ class DeliveryCarrier(models.Model):
         :return dict: Values prepared for the YUN connector
         """
         self.ensure_one()
-        # A picking can be delivered from any warehouse
-        sender_partner = picking.company_id.partner_id
-        if picking.picking_type_id:
-            sender_partner = (
-                picking.picking_type_id.warehouse_id.partner_id
-                or picking.company_id.partner_id
-            )
-        recipient = picking.partner_id
-        recipient_entity = picking.partner_id.commercial_partner_id
-        weight = picking.shipping_weight
-        weight = 1.0
-        reference = picking.name
-        if picking.sale_id:
-            reference = "{}-{}".format(picking.sale_id.name, reference)
+        return next(self._yunexpress_shipping_payloads(picking))[1]
 
-        # https://yunexpress-uc-down.oss-cn-shenzhen.aliyuncs.com/YT-PRO/UCV2/%E4%BA%91%E9%80%94%E7%89%A9%E6%B5%81API%E6%8E%A5%E5%8F%A3%E5%BC%80%E5%8F%91%E8%A7%84%E8%8C%83OMS-20250207.pdf
+    @api.model
+    def _yunexpress_customs_profiles(self, products):
+        """Customs declaration of every product, read at once
 
-        Parcels = []
-        # Get the product name and quantity from the picking
-        for move in picking.move_ids:
-            # get the product name and quantity from the picking
-            # get the product declared_name_cn and declared_name_en, declared_price
-            # if the move.product_id.declared_price is 0.0 and product type is service, skip the product
-            if move.product_id.declared_price == 0.0 and move.product_id.type == "service":
+        :param recordset products: `product.product` recordset
+        :return dict: {product id: parcel values or None when the product isn't
+            declared}
+        """
+        profiles = {}
+        for product in products.read(
+            ["declared_price", "declared_name_en", "declared_name_cn", "type"],
+            load=None,
+        ):
+            # Services without a declared price aren't shipped
+            if product["declared_price"] == 0.0 and product["type"] == "service":
+                profiles[product["id"]] = None
                 continue
-            Parcels.append(
-                {
-                    "Ename": move.product_id.declared_name_en,
-                    "CName": move.product_id.declared_name_cn,
-                    "UnitPrice": move.product_id.declared_price,
-                    "CurrencyCode": picking.company_id.currency_id.name,
-                    "UnitWeight": weight,
-                    "Quantity": 1,
-                }
-            )
+            profiles[product["id"]] = {
+                "Ename": product["declared_name_en"],
+                "CName": product["declared_name_cn"],
+                "UnitPrice": product["declared_price"],
+            }
+        return profiles
 
-        # labelContent
-        labelcontent = {
-            "fileType": "PDF",
-            "labelType": "label10x15",
-            "pickList": 1
-        }
+    def _yunexpress_shipping_payloads(self, pickings):
+        """Convert many pickings values for Yun Express API. Every model
+        involved is read once for the whole recordset, so the number of
+        queries doesn't grow with the pickings or their moves.
 
-        vatCode = None;
-        iossCode = None;
-
-        # if recipient.country_id.code == "UK":
-        vatCode = config.get("yunexpress_eu_vat_code", vatCode)
-        
-        #if recipient.country_id.code == "DE":
-        # europe need to set the vatcode and ioss code
-        # vatCode = config.get("yunexpress_eu_vat_code", vatCode)
-        # iossCode = config.get("yunexpress_eu_ioss_code", iossCode)
-        # else:
-        # vatCode = config.get("yunexpress_eu_vat_code", vatCode)
-        # iossCode = config.get("yunexpress_eu_ioss_code", iossCode)
-        iossCode = config.get("yunexpress_eu_ioss_code", iossCode)
-
-        Receiver = {
-            "CountryCode": recipient.country_id.code,
-            "FirstName": recipient.name or recipient_entity.name,
-            "LastName": recipient_entity.name,
-            "Street": recipient.street,
-            "City": recipient.city,
-            "Zip": recipient.zip,
-            "Phone": str(recipient.phone or recipient_entity.phone or ""),
-            "Email": str(recipient.email or recipient_entity.email or ""),
+        :param recordset pickings: `stock.picking` recordset
+        :return generator: tuples of (picking, values prepared for the YUN
+            connector) in the pickings order
+        """
+        self.ensure_one()
+        # https://yunexpress-uc-down.oss-cn-shenzhen.aliyuncs.com/YT-PRO/UCV2/%E4%BA%91%E9%80%94%E7%89%A9%E6%B5%81API%E6%8E%A5%E5%8F%A3%E5%BC%80%E5%8F%91%E8%A7%84%E8%8C%83OMS-20250207.pdf
+        pickings_data = pickings.read(
+            ["name", "partner_id", "sale_id", "company_id", "move_ids"], load=None
+        )
+        moves = {
+            move["id"]: move["product_id"]
+            for move in self.env["stock.move"]
+            .browse([m for data in pickings_data for m in data["move_ids"]])
+            .read(["product_id"], load=None)
         }
-        
-        sourceCode = reference.replace("/", "-")
-
-        return {
-            "ShippingMethodCode": self.yunexpress_channel,
-            "CustomerOrderNumber": sourceCode,
-            "PackageCount": 1,
-            "Weight": weight,
-            "Receiver": Receiver,
-            "Parcels": Parcels
+        profiles = self._yunexpress_customs_profiles(
+            self.env["product.product"].browse(set(moves.values()))
+        )
+        sale_names = {
+            sale["id"]: sale["name"]
+            for sale in self.env["sale.order"]
+            .browse({data["sale_id"] for data in pickings_data if data["sale_id"]})
+            .read(["name"], load=None)
         }
+        currencies = {
+            company.id: company.currency_id.name
+            for company in self.env["res.company"].browse(
+                {data["company_id"] for data in pickings_data}
+            )
+        }
+        partners = self.env["res.partner"].browse(
+            {data["partner_id"] for data in pickings_data if data["partner_id"]}
+        )
+        partner_fields = [
+            "name",
+            "street",
+            "city",
+            "zip",
+            "phone",
+            "email",
+            "country_id",
+            "commercial_partner_id",
+        ]
+        partners_data = {p["id"]: p for p in partners.read(partner_fields, load=None)}
+        entities = self.env["res.partner"].browse(
+            {p["commercial_partner_id"] for p in partners_data.values()}
+            - set(partners_data)
+        )
+        partners_data.update(
+            {p["id"]: p for p in entities.read(partner_fields, load=None)}
+        )
+        countries = {
+            country["id"]: country["code"]
+            for country in self.env["res.country"]
+            .browse({p["country_id"] for p in partners_data.values() if p["country_id"]})
+            .read(["code"], load=None)
+        }
+        empty_partner = dict.fromkeys(partner_fields, False)
+        # No weight is declared for the time being
+        weight = 1.0
+        for picking, data in zip(pickings, pickings_data):
+            recipient = partners_data.get(data["partner_id"], empty_partner)
+            recipient_entity = partners_data.get(
+                recipient["commercial_partner_id"], recipient
+            )
+            reference = data["name"]
+            if data["sale_id"]:
+                reference = "{}-{}".format(sale_names[data["sale_id"]], reference)
+            currency = currencies[data["company_id"]]
+            parcels = []
+            for move_id in data["move_ids"]:
+                profile = profiles.get(moves[move_id])
+                if profile is None:
+                    continue
+                parcels.append(
+                    dict(
+                        profile,
+                        CurrencyCode=currency,
+                        UnitWeight=weight,
+                        Quantity=1,
+                    )
+                )
+            receiver = {
+                "CountryCode": countries.get(recipient["country_id"], False),
+                "FirstName": recipient["name"] or recipient_entity["name"],
+                "LastName": recipient_entity["name"],
+                "Street": recipient["street"],
+                "City": recipient["city"],
+                "Zip": recipient["zip"],
+                "Phone": str(recipient["phone"] or recipient_entity["phone"] or ""),
+                "Email": str(recipient["email"] or recipient_entity["email"] or ""),
+            }
+            yield picking, {
+                "ShippingMethodCode": self.yunexpress_channel.code,
+                "CustomerOrderNumber": reference.replace("/", "-"),
+                "PackageCount": 1,
+                "Weight": weight,
+                "Receiver": receiver,
+                "Parcels": parcels,
+            }
+
+    def _yunexpress_create_orders(self, yun_request, prepared):
+        """Submit the shippings to CreateOrder in chunks of the configured
+        batch size and map the resulting items back to their orders. Every
+        created order is checkpointed in the shipment ledger.
 
-        # return {
-        #     "ShippingMethodCode": self.yunexpress_channel,
-        #     "nItemType": 1,  # Optional
-        #     "cAddrFrom": "MYSHOP",
-        #     "iItem": 1,  # Optional
-        #     # order number
-        #     "CustomerOrderNumber": reference,
-        #     # order receiver country code
-        #     "cDes": recipient.country_id.code,
-        #     # order receiver name
-        #     "cReceiver": recipient.name or recipient_entity.name,
-        #     # order receiver company name
-        #     "cRunit": recipient_entity.name,
-        #     # order receiver address
-        #     "cRAddr": recipient.street,
-        #     # order receiver city
-        #     "cRCity": recipient.city,
-        #     # order receiver province
-        #     "cRProvince": recipient.state_id.name,
-        #     # order receiver postal code
-        #     "cRPostcode": recipient.zip,
-        #     # order receiver country name
-        #     "cRCountry": recipient.country_id.name,
-        #     # order receiver phone number
-        #     "cRPhone": str(recipient.phone or recipient_entity.phone or ''),
-        #     # order receiver mobile number
-        #     "cRSms": str(recipient.mobile or recipient_entity.mobile or ''),
-        #     # order receiver email address
-        #     "cRPhone": str(recipient.phone or recipient_entity.phone or ''),
-        #     # order package weight
-        #     "fWeight": 1,  # Weight in grams
-        #     # order memo
-        #     "cMemo": None,  # Optional
-        #     # order reserve
-        #     "cReserve": None,  # Optional
-        #     # order vat code
-        #     "vatCode": vatCode,  # Optional
-        #     # order ioss code
-        #     "iossCode": iossCode,  # Optional
-        #     # order sender name
-        #     "cSender": sender_partner.name,
-        #     "labelContent": labelcontent,  # Optional
-        #     "GoodsList": goodslist
-        # }
+        :param YUNExpressRequest yun_request: Yun Express request object
+        :param list prepared: Tuples of (picking, values prepared for the API)
+        :raises UserError: When any of the orders couldn't be created
+        :return dict: `OrderResult` by CustomerOrderNumber
+        """
+        batch_size = max(self.yunexpress_send_batch_size, 1)
+        items = {}
+        for chunk in split_every(batch_size, prepared):
+            try:
+                chunk_items = yun_request.create_orders([vals for _p, vals in chunk])
+            finally:
+                self._yun_log_request(yun_request)
+            items.update(chunk_items)
+            self.env["yunexpress.shipment"]._checkpoint(
+                {
+                    vals["CustomerOrderNumber"]: {
+                        "carrier_id": self.id,
+                        "stage": "created",
+                        "api_cid": yun_request.api_cid,
+                        "ship_date": fields.Datetime.now(),
+                        "waybill_number": chunk_items[
+                            vals["CustomerOrderNumber"]
+                        ].waybill_number,
+                    }
+                    for _picking, vals in chunk
+                    if vals["CustomerOrderNumber"] in chunk_items
+                    and chunk_items[vals["CustomerOrderNumber"]].waybill_number
+                }
+            )
+        error_msg = ""
+        for _picking, vals in prepared:
+            order = items.get(vals["CustomerOrderNumber"])
+            if not order or not order.waybill_number:
+                error_msg += "{} - {}\n".format(
+                    vals["CustomerOrderNumber"],
+                    order and order.remark or _("No response"),
+                )
+        if error_msg:
+            raise UserError(_("Yun Express Error:\n\n%s") % error_msg)
+        return items
 
     def yunexpress_send_shipping(self, pickings):
         """Yun Express wildcard method called when a picking is confirmed
@@ -314,95 +707,301 @@ class DeliveryCarrier(models.Model):
         :raises UserError: On any API error
         :return dict: With tracking number and delivery price (always 0)
         """
-        print("yunexpress_send_shipping")
+        # Already sent by the background dispatch, see `stock.picking`
+        sent = self.env.context.get("yunexpress_sent") or {}
+        if pickings and all(picking.id in sent for picking in pickings):
+            return [sent[picking.id] for picking in pickings]
         yun_request = self._yun_request()
-        print("yunexpress_send_shipping yun_request")
-        print(self.yunexpress_api_cid)
-        print("yunexpress_send_shipping yun_request")
-        result = []
         for picking in pickings:
-
             # Check if the picking is already shipped
             if picking.state == "done" and picking.carrier_tracking_ref:
                 raise UserError(_("This picking is already shipped."))
-            
+
             # check if the picking has a tracking number and the same carrier
             if picking.carrier_tracking_ref and picking.carrier_id == self:
                 raise UserError(_("This picking already has a tracking number."))
-
-            vals = self._prepare_yunexpress_shipping(picking)
-
-            print(vals)
-        
-            try:
-                error, documents, tracking = yun_request.manifest_shipping(pickings=picking,shipping_values=vals)
-                self._yun_check_error(error)
-            except Exception as e:
-                raise (e)
-            finally:
-                self._yun_log_request(yun_request)
-
+        prepared = list(self._yunexpress_shipping_payloads(pickings))
+        uncovered = self.env["yunexpress.channel"]._uncovered_countries(
+            self.yunexpress_channel.code,
+            {vals["Receiver"]["CountryCode"] for _picking, vals in prepared},
+        )
+        if uncovered:
+            raise UserError(
+                _("The channel %(channel)s doesn't ship to %(countries)s:\n%(names)s")
+                % {
+                    "channel": self.yunexpress_channel.display_name,
+                    "countries": ", ".join(sorted(uncovered)),
+                    "names": "\n".join(
+                        picking.name
+                        for picking, vals in prepared
+                        if vals["Receiver"]["CountryCode"] in uncovered
+                    ),
+                }
+            )
+        Shipment = self.env["yunexpress.shipment"]
+        # Orders are submitted in batches, the labels are gathered afterwards.
+        # The stages already done according to the ledger aren't repeated.
+        stages = Shipment._get_stages(
+            [vals["CustomerOrderNumber"] for _picking, vals in prepared]
+        )
+        to_create = [
+            (picking, vals)
+            for picking, vals in prepared
+            if vals["CustomerOrderNumber"] not in stages
+        ]
+        if to_create:
+            items = self._yunexpress_create_orders(yun_request, to_create)
+            for _picking, vals in to_create:
+                stages[vals["CustomerOrderNumber"]] = {
+                    "stage": "created",
+                    "waybill_number": items[vals["CustomerOrderNumber"]].waybill_number,
+                    "label_url": False,
+                    "label_position": 0,
+                    "label_count": 0,
+                    "label_checksum": False,
+                }
+        stages = {
+            picking.id: dict(
+                stages[vals["CustomerOrderNumber"]], name=vals["CustomerOrderNumber"]
+            )
+            for picking, vals in prepared
+        }
+        result = []
+        for picking, vals in prepared:
+            tracking = stages[picking.id]["waybill_number"]
             vals.update({"tracking_number": tracking, "exact_price": 0})
             vals.update({"carrier_tracking_ref": tracking})
             # save the tracking number to carrier_tracking_ref field
             picking.carrier_tracking_ref = tracking
-
-            # save the tracking number to carrier_tracking_ref field
-            picking.carrier_tracking_ref = tracking
-            picking.update({"carrier_tracking_ref": tracking})
-
-            # Download the PDF document from the URL
-            response = requests.get(documents)
-            if response.status_code != 200:
-                raise Exception("Error in request")
-            pdf_content = response.content
-            
-            attachment = self.env['ir.attachment'].create({
-                'name': tracking + '.pdf',
-                'datas': base64.b64encode(pdf_content),
-                'db_datas': base64.b64encode(pdf_content),
-                'res_model': 'stock.picking',  # Attach to the stock.picking
-                'res_id': picking.id,  # Attach to the current picking
-                'type': 'binary',
-                'mimetype': 'application/pdf',
-                'url': documents,
-            })
-
-
-            # The default shipping method doesn't allow to configure the label
-            # format, so once we get the tracking, we ask for it again.
-            #documents = self.yunexpress_get_label(tracking)
-            # We post an extra message in the chatter with the barcode and the
-            # label because there's clean way to override the one sent by core.
-            body = _("Yun Shipping Documents")
-            picking.message_post(body=body, attachments=attachment)
-            # the documents is a url, we need to redirect to the url to print the label
-
-            # update the sale order picking state to "sent"
-            # if picking.sale_id and picking.sale_id.state == "sale":
-            #     picking.sale_id.state = "sent"
-            # updte the sale order delivery date to now
-            picking.sale_id.shipping_time = fields.Datetime.now()
-
+            # The ledger is written aside, so the picking holds the link
+            picking.yunexpress_order_number = vals["CustomerOrderNumber"]
             result.append(vals)
+        # Labels stored in a previous attempt which is still there
+        attachments = {}
+        stored = [
+            (picking.id, stages[picking.id]["label_checksum"])
+            for picking in pickings
+            if stages[picking.id]["stage"] == "stored"
+        ]
+        if stored:
+            for attachment in self.env["ir.attachment"].search(
+                [
+                    ("res_model", "=", "stock.picking"),
+                    ("res_id", "in", [picking_id for picking_id, _c in stored]),
+                    ("checksum", "in", [checksum for _p, checksum in stored]),
+                ]
+            ):
+                if (attachment.res_id, attachment.checksum) in stored:
+                    attachments[attachment.res_id] = attachment
+        labels = {}
+        # Label urls we already got are downloaded again
+        resumed = Shipment._label_documents(
+            pickings.filtered(lambda x: x.id not in attachments), stages
+        )
+        if resumed:
+            try:
+                labels.update(self._yunexpress_fetch_labels(yun_request, resumed)[0])
+            except Exception:
+                _logger.info("Stored Yun Express label urls failed, printing again")
+        # Labels are downloaded concurrently. Once we have them all, the
+        # attachments are created at once.
+        pending = pickings.filtered(
+            lambda x: x.id not in attachments and x.id not in labels
+        )
+        documents, errors = self._yunexpress_print_labels(yun_request, pending)
+        Shipment._checkpoint(
+            {
+                stages[picking.id]["name"]: {
+                    "stage": "labeled",
+                    "label_url": url,
+                    "label_position": position,
+                    "label_count": len(slots),
+                }
+                for url, slots in documents
+                for position, picking in enumerate(slots)
+                if picking
+            }
+        )
+        labels.update(self._yunexpress_fetch_labels(yun_request, documents)[0])
+        error_msg = ""
+        for picking in pickings:
+            if picking.id not in labels and picking.id not in attachments:
+                error_msg += "{} - {}\n".format(
+                    picking.carrier_tracking_ref,
+                    errors.get(picking.id) or _("No label"),
+                )
+        if error_msg:
+            raise UserError(_("Yun Express Error:\n\n%s") % error_msg)
+        new_pickings = pickings.filtered(lambda x: x.id not in attachments)
+        new_attachments = self._yunexpress_store_labels(
+            [(picking,) + labels[picking.id] for picking in new_pickings]
+        )
+        for picking, attachment in zip(new_pickings, new_attachments):
+            attachments[picking.id] = attachment
+        self._yunexpress_cache_labels(new_pickings, new_attachments, labels)
+        Shipment._checkpoint(
+            {
+                stages[picking.id]["name"]: {
+                    "stage": "stored",
+                    "label_checksum": attachments[picking.id].checksum,
+                }
+                for picking in new_pickings
+            }
+        )
+        # We post an extra message in the chatter with the barcode and the
+        # label because there's clean way to override the one sent by core.
+        body = _("Yun Shipping Documents")
+        for picking in new_pickings:
+            picking.message_post(body=body, attachment_ids=attachments[picking.id].ids)
+        # updte the sale order delivery date to now
+        pickings.sale_id.write({"shipping_time": fields.Datetime.now()})
         return result
 
     def yunexpress_cancel_shipment(self, pickings):
-        """Cancel the expedition
+        """Cancel the expedition. The shippings which couldn't be cancelled
+        are reported in their chatter and keep their tracking ref, see
+        `yunexpress_cancel_shipments`.
 
         :param recordset: pickings `stock.picking` recordset
+        :raises UserError: When none of them could be cancelled
         :returns boolean: True if success
         """
+        report = self.yunexpress_cancel_shipments(pickings)
+        failed = pickings.filtered(lambda x: report.get(x.id))
+        for picking in failed:
+            picking.message_post(
+                body=_("Shipment %(ref)s couldn't be cancelled: %(errors)s")
+                % {
+                    "ref": picking.carrier_tracking_ref,
+                    "errors": "; ".join(
+                        "{} - {}".format(*error) for error in report[picking.id]
+                    ),
+                }
+            )
+        if failed and len(failed) == len(report):
+            self._yun_check_error(
+                [
+                    (picking.carrier_tracking_ref, "{} - {}".format(code, msg))
+                    for picking in failed
+                    for code, msg in report[picking.id]
+                ]
+            )
+        return True
+
+    def yunexpress_cancel_shipments(self, pickings):
+        """Cancel many shippings at once. The cancellations run concurrently
+        and a failing one doesn't stop the others: the tracking refs of the
+        cancelled pickings are cleared in a single write and the failing ones
+        are kept.
+
+        :param recordset pickings: `stock.picking` recordset
+        :return dict: {picking id: errors}, empty errors for the cancelled ones
+        """
+        pickings = pickings.filtered("carrier_tracking_ref")
+        report = self._yunexpress_cancel_requests(pickings)
+        cancelled = pickings.filtered(lambda x: not report[x.id])
+        if not cancelled:
+            return report
+        self._yunexpress_cancelled(cancelled)
+        for picking in cancelled:
+            picking.message_post(
+                body=_("Shipment %s cancelled") % picking.carrier_tracking_ref
+            )
+        cancelled.write(
+            {
+                "carrier_tracking_ref": False,
+                "yunexpress_label_state": False,
+                "yunexpress_dispatch_error": False,
+            }
+        )
+        return report
+
+    def _yunexpress_cancel_requests(self, pickings):
+        """Request the cancellations in a bounded pool of threads, throttled by
+        the account rate limiter. Only the network is handled in the threads.
+
+        :param recordset pickings: `stock.picking` recordset with tracking refs
+        :return dict: {picking id: errors}
+        """
+        self.ensure_one()
         yun_request = self._yun_request()
-        for picking in pickings.filtered("carrier_tracking_ref"):
+
+        def cancel(tracking_ref):
             try:
-                error = yun_request.cancel_shipping(picking.carrier_tracking_ref)
-                self._yun_check_error(error)
+                return yun_request.cancel_shipping(tracking_ref)
             except Exception as e:
-                raise (e)
-            finally:
-                self._yun_log_request(yun_request)
-        return True
+                return [("-", str(e))]
+
+        try:
+            responses = self._yunexpress_concurrent_map(
+                cancel,
+                pickings.mapped("carrier_tracking_ref"),
+                int(config.get("yunexpress_cancel_workers") or YUNEXPRESS_CANCEL_WORKERS),
+            )
+        finally:
+            self._yun_log_request(yun_request)
+        return dict(zip(pickings.ids, responses))
+
+    def _yunexpress_cancelled(self, pickings):
+        """Record the cancellation in the shipment ledger, which outlives the
+        current transaction as the orders are gone in Yun Express anyway, and
+        forget the cached labels.
+
+        :param recordset pickings: `stock.picking` recordset
+        """
+        self.env["yunexpress.shipment"]._checkpoint(
+            {
+                picking.yunexpress_order_number: {
+                    "carrier_id": picking.carrier_id.id,
+                    "stage": "cancelled",
+                }
+                for picking in pickings
+                if picking.yunexpress_order_number
+            }
+        )
+        self.env["yunexpress.label"]._invalidate(pickings)
+
+    def yunexpress_get_tracking_numbers(self, shipping_codes):
+        """Get the tracking numbers of many orders. The codes are requested in
+        chunks and the chunks run concurrently, throttled by the account rate
+        limiter. A failing chunk doesn't stop the others.
+
+        :param list shipping_codes: Customer order numbers
+        :return dict: {code: (errors, `TrackingNumberResult` or None)}
+        """
+        self.ensure_one()
+        codes = list(dict.fromkeys(filter(None, shipping_codes)))
+        chunks = list(split_every(YUNEXPRESS_TRACKING_NUMBER_CHUNK, codes, list))
+        yun_request = self._yun_request()
+
+        def request(chunk):
+            try:
+                return yun_request.get_tracking_numbers(chunk)
+            except Exception as e:
+                return [("-", str(e))], {}
+
+        try:
+            responses = self._yunexpress_concurrent_map(
+                request,
+                chunks,
+                int(
+                    config.get("yunexpress_tracking_workers")
+                    or YUNEXPRESS_TRACKING_WORKERS
+                ),
+            )
+        finally:
+            self._yun_log_request(yun_request)
+        results = {}
+        for chunk, (errors, items) in zip(chunks, responses):
+            # Codes can be waybill numbers as well
+            waybills = {item.waybill_number: item for item in items.values()}
+            for code in chunk:
+                item = items.get(code) or waybills.get(code)
+                if item and item.tracking_number:
+                    results[code] = ([], item)
+                else:
+                    results[code] = (errors or [("-", _("No tracking number"))], item)
+        return results
 
     def yunexpress_get_label(self, reference):
         """Generate label for picking
@@ -417,45 +1016,588 @@ class DeliveryCarrier(models.Model):
         self.ensure_one()
         yun_request = self._yun_request()
         try:
-            error, label = yun_request.get_documents_multi(
+            documents = yun_request.get_documents_multi(
                 reference,
                 model_code=self.yunexpress_document_model_code,
                 kind_code=self.yunexpress_document_format,
                 offset=self.yunexpress_document_offset,
             )
-            self._yun_check_error(error)
+        finally:
+            self._yun_log_request(yun_request)
+        if not documents or not documents[0].url:
+            return False
+        return (reference + ".pdf", yun_request.download(documents[0].url))
+
+    def _yunexpress_split_label(self, content, count):
+        """Split a Label/Print document holding several labels into a
+        document per label
+
+        :param bytes content: PDF document as returned by Yun Express
+        :param int count: Label slots of the document, those skipped by the
+            document offset included
+        :return list: PDF contents in the same order or False when the pages
+            can't be matched with the labels
+        """
+        per_sheet = YUNEXPRESS_LABELS_PER_SHEET.get(
+            self.yunexpress_document_model_code, 1
+        )
+        try:
+            reader = PdfFileReader(io.BytesIO(content), strict=False)
+            pages = reader.getNumPages()
         except Exception as e:
-            raise (e)
+            _logger.warning("Yun Express label document can't be read: %s", e)
+            return False
+        if per_sheet > 1:
+            # Sheet layouts: the label sheet is the document of every label on it
+            if pages != -(-count // per_sheet):
+                return False
+            page_ranges = [(i // per_sheet, i // per_sheet + 1) for i in range(count)]
+        else:
+            if not pages or pages % count:
+                return False
+            step = pages // count
+            page_ranges = [(i * step, (i + 1) * step) for i in range(count)]
+        documents = []
+        for first, last in page_ranges:
+            writer = PdfFileWriter()
+            for page in range(first, last):
+                writer.addPage(reader.getPage(page))
+            stream = io.BytesIO()
+            writer.write(stream)
+            documents.append(stream.getvalue())
+        return documents
+
+    @api.model
+    def _yunexpress_store_labels(self, labels):
+        """Store the labels keyed by their content hash. A label already
+        attached to its picking is reused, so reprints and duplicated
+        shippings don't produce new copies. New labels are written once as raw
+        content, which lands in the filestore (deduplicated by checksum).
+
+        :param list labels: tuples of (picking, file_name, file_content)
+        :return recordset: `ir.attachment` records in the same order
+        """
+        Attachment = self.env["ir.attachment"]
+        checksums = [Attachment._compute_checksum(content) for _p, _n, content in labels]
+        existing = {
+            (attachment.res_id, attachment.checksum): attachment
+            for attachment in Attachment.search(
+                [
+                    ("res_model", "=", "stock.picking"),
+                    ("res_id", "in", [picking.id for picking, _n, _c in labels]),
+                    ("checksum", "in", checksums),
+                ]
+            )
+        }
+        to_create = []
+        for (picking, name, content), checksum in zip(labels, checksums):
+            if (picking.id, checksum) not in existing:
+                to_create.append(
+                    {
+                        "name": name,
+                        "raw": content,
+                        "res_model": "stock.picking",
+                        "res_id": picking.id,
+                        "type": "binary",
+                        "mimetype": "application/pdf",
+                    }
+                )
+        created = iter(Attachment.create(to_create))
+        attachment_ids = []
+        for (picking, _name, _content), checksum in zip(labels, checksums):
+            key = (picking.id, checksum)
+            if key not in existing:
+                existing[key] = next(created)
+            attachment_ids.append(existing[key].id)
+        return Attachment.browse(attachment_ids)
+
+    def _yunexpress_cache_labels(self, pickings, attachments, labels):
+        """Keep the stored labels for reprints
+
+        :param recordset pickings: `stock.picking` recordset
+        :param recordset attachments: Their `ir.attachment` in the same order
+        :param dict labels: {picking id: (file_name, file_content)}
+        """
+        self.ensure_one()
+        self.env["yunexpress.label"]._register(
+            [
+                (
+                    picking,
+                    self.yunexpress_document_model_code,
+                    self.yunexpress_document_format,
+                    attachment,
+                    labels[picking.id][1],
+                )
+                for picking, attachment in zip(pickings, attachments)
+            ]
+        )
+
+    @api.model
+    def _yunexpress_download_documents(self, yun_request, urls):
+        """Download the given documents in a bounded pool of threads. Only the
+        network is handled in the threads: no ORM access there.
+
+        :param YUNExpressRequest yun_request: Yun Express request object
+        :param list urls: Documents urls
+        :return list: Documents contents in the same order
+        """
+        return self._yunexpress_concurrent_map(
+            yun_request.download,
+            urls,
+            int(config.get("yunexpress_download_workers") or YUNEXPRESS_DOWNLOAD_WORKERS),
+        )
+
+    @api.model
+    def _yunexpress_concurrent_map(self, func, args, max_workers):
+        """Map the API calls over the arguments in a bounded pool of threads.
+        The pooled session is shared, so the connections are reused.
+
+        :param callable func: Function doing only network work (no ORM)
+        :param list args: Arguments for every call
+        :param int max_workers: Maximum concurrent calls
+        :return list: Results in the same order
+        """
+        if len(args) < 2 or max_workers < 2:
+            return [func(arg) for arg in args]
+        with ThreadPoolExecutor(max_workers=min(len(args), max_workers)) as executor:
+            return list(executor.map(func, args))
+
+    def _yunexpress_print_labels(self, yun_request, pickings):
+        """Request the labels to Label/Print in chunks
+
+        :param YUNExpressRequest yun_request: Yun Express request object
+        :param recordset pickings: `stock.picking` recordset
+        :return tuple: tuple containing:
+            list: documents as tuples of (url, slots) where the slots are the
+                pickings in the document order, False for the skipped ones
+            dict: errors by picking id
+        """
+        documents, errors = [], {}
+        # Only the first sheet starts part-way through. Its chunk is shorter,
+        # so the following ones still start on a sheet of their own.
+        per_sheet = YUNEXPRESS_LABELS_PER_SHEET.get(
+            self.yunexpress_document_model_code, 1
+        )
+        offset = self.yunexpress_document_offset % per_sheet if per_sheet > 1 else 0
+        chunks = []
+        if offset:
+            chunks.append(pickings[: YUNEXPRESS_LABEL_PRINT_CHUNK - offset])
+            pickings = pickings[YUNEXPRESS_LABEL_PRINT_CHUNK - offset :]
+        chunks += split_every(
+            YUNEXPRESS_LABEL_PRINT_CHUNK, pickings.ids, pickings.browse
+        )
+        for chunk in chunks:
+            pickings_by_ref = {p.carrier_tracking_ref: p for p in chunk}
+            try:
+                results = yun_request.get_documents_multi(
+                    list(pickings_by_ref),
+                    model_code=self.yunexpress_document_model_code,
+                    kind_code=self.yunexpress_document_format,
+                    offset=offset,
+                )
+            finally:
+                self._yun_log_request(yun_request)
+            # The slots skipped by the offset hold no picking
+            skipped = [False] * offset
+            offset = 0
+            for result in results:
+                if not result.infos:
+                    # The document holds the whole chunk
+                    documents.append((result.url, skipped + list(chunk)))
+                    continue
+                printed = []
+                for info in result.infos:
+                    picking = pickings_by_ref.get(
+                        info.waybill_number
+                    ) or pickings_by_ref.get(info.order_number)
+                    if not picking:
+                        continue
+                    if info.error:
+                        errors[picking.id] = info.error
+                        continue
+                    printed.append(picking)
+                if printed and result.url:
+                    documents.append((result.url, skipped + printed))
+        return documents, errors
+
+    def _yunexpress_fetch_labels(self, yun_request, documents):
+        """Download the label documents concurrently and split them in a label
+        per picking
+
+        :param YUNExpressRequest yun_request: Yun Express request object
+        :param list documents: tuples of (url, slots) where the slots are the
+            pickings in the document order. Labels of other pickings are False.
+        :return tuple: tuple containing:
+            dict: {picking id: (file_name, file_content)}
+            list: documents contents
+        """
+        labels = {}
+        contents = self._yunexpress_download_documents(
+            yun_request, [url for url, _slots in documents]
+        )
+        unsplit = []
+        for (_url, slots), content in zip(documents, contents):
+            if len(slots) == 1:
+                split = [content]
+            else:
+                split = self._yunexpress_split_label(content, len(slots))
+            # Giving the whole document to every picking would print the
+            # wrong labels
+            if not split or len(split) != len(slots):
+                unsplit += [picking for picking in slots if picking]
+                continue
+            for picking, label in zip(slots, split):
+                if picking:
+                    labels[picking.id] = (picking.carrier_tracking_ref + ".pdf", label)
+        if unsplit:
+            labels.update(self._yunexpress_single_labels(yun_request, unsplit))
+        return labels, contents
+
+    def _yunexpress_single_labels(self, yun_request, pickings):
+        """Request a document per picking, for the labels which couldn't be
+        split from a shared document. The calls run concurrently.
+
+        :param YUNExpressRequest yun_request: Yun Express request object
+        :param list pickings: `stock.picking` records
+        :return dict: {picking id: (file_name, file_content)} of the labels
+            obtained
+        """
+
+        def single_label(tracking_ref):
+            try:
+                results = yun_request.get_documents_multi(
+                    tracking_ref,
+                    model_code=self.yunexpress_document_model_code,
+                    kind_code=self.yunexpress_document_format,
+                    offset=self.yunexpress_document_offset,
+                )
+                url = next((result.url for result in results if result.url), None)
+                return url and yun_request.download(url)
+            except Exception as e:
+                _logger.warning("Yun Express label of %s failed: %s", tracking_ref, e)
+                return None
+
+        try:
+            contents = self._yunexpress_concurrent_map(
+                single_label,
+                [picking.carrier_tracking_ref for picking in pickings],
+                int(
+                    config.get("yunexpress_download_workers")
+                    or YUNEXPRESS_DOWNLOAD_WORKERS
+                ),
+            )
         finally:
             self._yun_log_request(yun_request)
-        if not label:
+        return {
+            picking.id: (picking.carrier_tracking_ref + ".pdf", content)
+            for picking, content in zip(pickings, contents)
+            if content
+        }
+
+    def yunexpress_get_labels(self, pickings):
+        """Gather the labels of many pickings at once. They're requested in
+        chunks, so a few calls are enough for a whole dispatch.
+
+        :param recordset pickings: `stock.picking` recordset
+        :return dict: with keys:
+            labels: {picking id: (file_name, file_content)}
+            merged: (file_name, file_content) with every label ready to be
+                printed in a single job, or False if there are no labels
+            errors: {picking id: error description}
+        """
+        self.ensure_one()
+        pickings = pickings.filtered("carrier_tracking_ref")
+        yun_request = self._yun_request()
+        documents, errors = self._yunexpress_print_labels(yun_request, pickings)
+        labels, contents = self._yunexpress_fetch_labels(yun_request, documents)
+        merged = False
+        if contents:
+            merged = (
+                "yunexpress-labels-{}.pdf".format(
+                    fields.Datetime.now().strftime("%Y%m%d%H%M%S")
+                ),
+                merge_pdf(contents) if len(contents) > 1 else contents[0],
+            )
+        return {"labels": labels, "merged": merged, "errors": errors}
+
+    @api.model
+    def _yunexpress_tracking_values(self, info):
+        """Picking tracking values from a GetTrackAllInfo item
+
+        :param TrackingInfo info: Tracking status and events
+        :return dict: Values for the picking or an empty dict when there's no
+            tracking information yet
+        """
+        trackings = info.events
+        if not trackings:
+            return {}
+        return {
+            "tracking_state_history": "\n".join(
+                [self._yunexpress_format_tracking(tracking) for tracking in trackings]
+            ),
+            "tracking_state": self._yunexpress_format_tracking(trackings[-1]),
+            "delivery_state": YUNEXPRESS_DELIVERY_STATES_STATIC.get(
+                info.package_state, "incidence"
+            ),
+            "yunexpress_package_state": info.package_state,
+            "yunexpress_last_event_date": self._yunexpress_parse_date(
+                trackings[-1].date
+            ),
+        }
+
+    @api.model
+    def _yunexpress_parse_date(self, value):
+        """Yun Express dates come as 'YYYY-MM-DDTHH:MM:SS[.fff]'
+
+        :param str value: API date
+        :return datetime: Parsed date or False
+        """
+        try:
+            return fields.Datetime.to_datetime(value.replace("T", " ")[:19])
+        except (AttributeError, ValueError):
             return False
-        return label
 
-    def yunexpress_tracking_state_update(self, picking):
-        """Wildcard method for Yun Express tracking followup
+    def _yunexpress_next_check(self, picking, package_state, last_event_date):
+        """Adaptive tracking poll schedule. Parcels waiting to be collected or
+        with delivery incidences are checked often, parcels in transit are
+        checked less the longer they stay quiet (i.e.: in customs) but more
+        when they approach the expected delivery date.
 
-        :param recod picking: `stock.picking` record
+        :param record picking: `stock.picking` record
+        :param int package_state: Last Yun Express PackageState
+        :param datetime last_event_date: Last tracking event date
+        :return datetime: Next check date or False when the parcel is done
+        """
+        if (
+            YUNEXPRESS_DELIVERY_STATES_STATIC.get(package_state)
+            in YUNEXPRESS_FINAL_DELIVERY_STATES
+        ):
+            return False
+        now = fields.Datetime.now()
+        if self.yunexpress_tracking_push:
+            # Pushed events keep it updated, polling is just a safety net
+            hours = YUNEXPRESS_POLL_MAX_HOURS
+        elif package_state in (None, 0, 1):
+            hours = YUNEXPRESS_POLL_PENDING_HOURS
+        elif package_state == 6:
+            hours = YUNEXPRESS_POLL_INCIDENCE_HOURS
+        else:
+            idle_hours = (now - (last_event_date or now)).total_seconds() / 3600
+            hours = min(
+                max(idle_hours / 4, YUNEXPRESS_POLL_MIN_HOURS),
+                YUNEXPRESS_POLL_MAX_HOURS,
+            )
+            transit_days = (
+                self.yunexpress_channel.transit_days
+                or self.yunexpress_transit_days
+                or 10
+            )
+            expected = (picking.date_done or now) + timedelta(days=transit_days)
+            if now >= expected - timedelta(days=transit_days * 0.3):
+                hours = min(hours, YUNEXPRESS_POLL_DUE_HOURS)
+        return now + timedelta(hours=hours)
+
+    def yunexpress_sync_trackings(self, pickings):
+        """Update the tracking states of many pickings at once. The tracking
+        calls run concurrently (the API takes a single number per call), all
+        of them at once with the asynchronous client when aiohttp is
+        available and there are more calls than threads, and only the
+        pickings which state changed are written, in a set-based update.
+
+        :param recordset pickings: `stock.picking` recordset
+        :return recordset: `stock.picking` updated records
         """
         self.ensure_one()
-        if not picking.carrier_tracking_ref:
-            return
+        pickings = pickings.filtered("carrier_tracking_ref")
+        if not pickings:
+            return pickings
+        tracking_refs = pickings.mapped("carrier_tracking_ref")
+        workers = int(
+            config.get("yunexpress_tracking_workers") or YUNEXPRESS_TRACKING_WORKERS
+        )
+        # With aiohttp, the whole sweep is in flight at once. Fewer calls than
+        # the threads available don't need an event loop.
+        yun_request = len(tracking_refs) > workers and self._yun_async_request()
+        if yun_request:
+
+            def calls(client):
+                return [client.get_tracking(ref) for ref in tracking_refs]
+
+            try:
+                responses = [
+                    ([("-", str(response))], None)
+                    if isinstance(response, Exception)
+                    else response
+                    for response in run_batch(yun_request, calls)
+                ]
+            finally:
+                self._yun_log_request(yun_request)
+            return self._yunexpress_update_trackings(pickings, responses)
         yun_request = self._yun_request()
         try:
-            error, trackings = yun_request.get_tracking(picking.carrier_tracking_ref)
-            self._yun_check_error(error)
-        except Exception as e:
-            raise (e)
+            responses = self._yunexpress_concurrent_map(
+                yun_request.get_tracking, tracking_refs, workers
+            )
         finally:
             self._yun_log_request(yun_request)
-        picking.tracking_state_history = "\n".join(
-            [self._yunexpress_format_tracking(tracking) for tracking in trackings]
+        return self._yunexpress_update_trackings(pickings, responses)
+
+    def _yunexpress_update_trackings(self, pickings, responses):
+        """Write the tracking responses of the pickings
+
+        :param recordset pickings: `stock.picking` recordset
+        :param list responses: (errors, `TrackingInfo`) in the pickings order
+        :return recordset: `stock.picking` updated records
+        """
+        values = {}
+        for picking, (errors, info) in zip(pickings, responses):
+            if errors:
+                _logger.warning(
+                    "Wrong tracking response for %s: %s",
+                    picking.carrier_tracking_ref,
+                    errors,
+                )
+                continue
+            values[picking.id] = self._yunexpress_tracking_values(info)
+        return self._yunexpress_write_trackings(pickings, values)
+
+    def _yunexpress_write_trackings(self, pickings, values):
+        """Set-based write of the tracking values. Every picking is
+        rescheduled, but only the ones which tracking changed are written.
+
+        :param recordset pickings: `stock.picking` recordset
+        :param dict values: Tracking values by picking id
+        :return recordset: `stock.picking` updated records
+        """
+        text_values = []
+        schedule_values = []
+        pickings_by_state = {}
+        for picking in pickings:
+            vals = values.get(picking.id) or {}
+            changed = vals and vals["tracking_state_history"] != (
+                picking.tracking_state_history or ""
+            )
+            package_state = vals.get(
+                "yunexpress_package_state", picking.yunexpress_package_state
+            )
+            last_event_date = vals.get("yunexpress_last_event_date") or (
+                picking.yunexpress_last_event_date
+            )
+            schedule_values.append(
+                (
+                    picking.id,
+                    self._yunexpress_next_check(picking, package_state, last_event_date)
+                    or None,
+                    package_state,
+                    last_event_date or None,
+                )
+            )
+            if not changed:
+                continue
+            text_values.append(
+                (picking.id, vals["tracking_state"], vals["tracking_state_history"])
+            )
+            if vals["delivery_state"] != picking.delivery_state:
+                pickings_by_state.setdefault(vals["delivery_state"], []).append(
+                    picking.id
+                )
+        self.env["stock.picking"].flush_model(
+            [
+                "tracking_state",
+                "tracking_state_history",
+                "yunexpress_next_check",
+                "yunexpress_package_state",
+                "yunexpress_last_event_date",
+            ]
+        )
+        # Every polled picking gets its next check, even when nothing changed
+        execute_values(
+            self.env.cr._obj,
+            """
+            UPDATE stock_picking AS sp
+            SET yunexpress_next_check = v.next_check::timestamp,
+                yunexpress_package_state = v.package_state::integer,
+                yunexpress_last_event_date = v.last_event_date::timestamp
+            FROM (VALUES %s) AS v(id, next_check, package_state, last_event_date)
+            WHERE sp.id = v.id
+            """,
+            schedule_values,
+        )
+        pickings.invalidate_recordset(
+            [
+                "yunexpress_next_check",
+                "yunexpress_package_state",
+                "yunexpress_last_event_date",
+            ]
+        )
+        if not text_values:
+            return pickings.browse()
+        execute_values(
+            self.env.cr._obj,
+            """
+            UPDATE stock_picking AS sp
+            SET tracking_state = v.tracking_state,
+                tracking_state_history = v.tracking_state_history,
+                write_uid = %s,
+                write_date = (now() at time zone 'UTC')
+            FROM (VALUES %%s) AS v(id, tracking_state, tracking_state_history)
+            WHERE sp.id = v.id
+            """
+            % self.env.uid,
+            text_values,
         )
-        current_tracking = trackings.pop()
-        picking.tracking_state = self._yunexpress_format_tracking(current_tracking)
-        picking.delivery_state = YUNEXPRESS_DELIVERY_STATES_STATIC.get(
-            current_tracking["StatusCode"], "incidence"
+        updated = pickings.browse([picking_id for picking_id, _s, _h in text_values])
+        updated.invalidate_recordset(
+            ["tracking_state", "tracking_state_history", "write_uid", "write_date"]
         )
+        # The delivery state goes through the ORM, one write per state
+        for delivery_state, picking_ids in pickings_by_state.items():
+            pickings.browse(picking_ids).write({"delivery_state": delivery_state})
+        return updated
+
+    def yunexpress_tracking_state_update(self, picking):
+        """Wildcard method for Yun Express tracking followup. Pickings which
+        next check isn't due yet are skipped, as the tracking schedule says
+        nothing new is expected.
+
+        :param recod picking: `stock.picking` record
+        """
+        self.ensure_one()
+        now = fields.Datetime.now()
+        self.yunexpress_sync_trackings(
+            picking.filtered(
+                lambda x: not x.yunexpress_next_check or x.yunexpress_next_check <= now
+            )
+        )
+
+    @api.model
+    def _cron_yunexpress_tracking_sync(self, limit=None):
+        """Synchronize the tracking states of the Yun Express shippings still
+        in transit which next check is due. Pickings are processed and
+        committed in chunks.
+
+        :param int limit: Maximum pickings to process in this run
+        """
+        pickings = self.env["stock.picking"].search(
+            [
+                ("delivery_type", "=", "yunexpress"),
+                ("carrier_tracking_ref", "!=", False),
+                ("state", "=", "done"),
+                ("delivery_state", "not in", YUNEXPRESS_FINAL_DELIVERY_STATES),
+                "|",
+                ("yunexpress_next_check", "=", False),
+                ("yunexpress_next_check", "<=", fields.Datetime.now()),
+            ],
+            limit=limit,
+            order="yunexpress_next_check, id",
+        )
+        for chunk in split_every(YUNEXPRESS_TRACKING_CHUNK, pickings.ids, pickings.browse):
+            for carrier in chunk.carrier_id:
+                carrier.yunexpress_sync_trackings(
+                    chunk.filtered(lambda x: x.carrier_id == carrier)
+                )
+            if not self.env.registry.in_test_mode():
+                self.env.cr.commit()  # pylint: disable=invalid-commit
 
     def yunexpress_get_tracking_link(self, picking):
         """Wildcard method for Yun Express tracking link.
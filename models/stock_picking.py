@@ -1,14 +1,264 @@
 # Copyright 2022 Tecnativa - David Vidal
 # License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
 
-from odoo import _, models
+import hashlib
+import logging
+import threading
+
+from odoo import _, api, fields, models
+from odoo.exceptions import UserError
+from odoo.tools.config import config
+from odoo.tools.pdf import merge_pdf
+
+_logger = logging.getLogger(__name__)
+
+# Pickings claimed at once by a dispatch worker
+YUNEXPRESS_DISPATCH_BATCH = 50
+# Dispatch workers. Tunable with `yunexpress_dispatch_workers`
+YUNEXPRESS_DISPATCH_WORKERS = 4
 
 
 class StockPicking(models.Model):
     _inherit = "stock.picking"
 
+    yunexpress_next_check = fields.Datetime(
+        string="Next tracking check",
+        index=True,
+        copy=False,
+        readonly=True,
+    )
+    yunexpress_package_state = fields.Integer(
+        string="Yun Express package state", copy=False, readonly=True
+    )
+    yunexpress_last_event_date = fields.Datetime(
+        string="Last tracking event", copy=False, readonly=True
+    )
+    yunexpress_label_state = fields.Selection(
+        selection=[
+            ("pending", "Label pending"),
+            ("ready", "Label ready"),
+            ("failed", "Label failed"),
+        ],
+        string="Yun Express label",
+        copy=False,
+        readonly=True,
+        index=True,
+    )
+    yunexpress_dispatch_error = fields.Text(copy=False, readonly=True)
+    yunexpress_order_number = fields.Char(
+        string="Yun Express order number", copy=False, readonly=True, index=True
+    )
+    yunexpress_dispatch_user_id = fields.Many2one(
+        comodel_name="res.users", copy=False, readonly=True
+    )
+
+    def send_to_shipper(self):
+        """Queue the shipping when the carrier sends in background"""
+        self.ensure_one()
+        if (
+            self.delivery_type == "yunexpress"
+            and self.carrier_id.yunexpress_async_dispatch
+            and "yunexpress_sent" not in self.env.context
+        ):
+            self._yunexpress_enqueue()
+            return
+        return super().send_to_shipper()
+
+    def cancel_shipment(self):
+        """The core clears every tracking ref once the carrier is done, the
+        Yun Express shippings which couldn't be cancelled keep theirs
+        """
+        pickings = self.filtered(
+            lambda x: x.delivery_type == "yunexpress" and x.carrier_tracking_ref
+        )
+        res = super(StockPicking, self - pickings).cancel_shipment()
+        if pickings:
+            return pickings.action_yunexpress_cancel_shipments()
+        return res
+
+    def _yunexpress_enqueue(self):
+        self.write(
+            {
+                "yunexpress_label_state": "pending",
+                "yunexpress_dispatch_error": False,
+                "yunexpress_dispatch_user_id": self.env.uid,
+            }
+        )
+        self.env.ref("delivery_yunexpress.ir_cron_yunexpress_dispatch")._trigger()
+
+    def action_yunexpress_retry_dispatch(self):
+        """Queue the failed shippings again"""
+        self.filtered(
+            lambda x: x.yunexpress_label_state == "failed"
+        )._yunexpress_enqueue()
+
+    @api.model
+    def _cron_yunexpress_dispatch(self):
+        """Send the queued shippings with a pool of workers. Every worker has
+        its own cursor and claims batches of pickings which nobody else holds.
+        """
+        workers = int(
+            config.get("yunexpress_dispatch_workers") or YUNEXPRESS_DISPATCH_WORKERS
+        )
+        if workers < 2 or self.env.registry.in_test_mode():
+            while self._yunexpress_dispatch_batch():
+                continue
+            return
+        registry, uid, context = self.env.registry, self.env.uid, self.env.context
+
+        def work():
+            while True:
+                try:
+                    with registry.cursor() as cr:
+                        env = api.Environment(cr, uid, context)
+                        if not env["stock.picking"]._yunexpress_dispatch_batch():
+                            return
+                except Exception:
+                    _logger.exception("Yun Express dispatch worker failed")
+                    return
+
+        threads = [
+            threading.Thread(target=work, name="yunexpress_dispatch_%s" % i)
+            for i in range(workers)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    @api.model
+    def _yunexpress_dispatch_batch(self):
+        """Claim a batch of queued pickings and send them. The claim doesn't
+        lock the keys, so the rows referencing the pickings can still be
+        written meanwhile from other transactions.
+
+        :return bool: Whether there was something to send
+        """
+        self.env.cr.execute(
+            """
+            SELECT id FROM stock_picking
+            WHERE yunexpress_label_state = 'pending'
+            ORDER BY carrier_id, id
+            LIMIT %s
+            FOR NO KEY UPDATE SKIP LOCKED
+            """,
+            (YUNEXPRESS_DISPATCH_BATCH,),
+        )
+        pickings = self.browse([row[0] for row in self.env.cr.fetchall()])
+        if not pickings:
+            return False
+        for carrier in pickings.carrier_id:
+            pickings.filtered(lambda x: x.carrier_id == carrier)._yunexpress_dispatch()
+        pickings._yunexpress_notify_dispatch()
+        return True
+
+    def _yunexpress_dispatch(self):
+        """Send the pickings in a single batch. When the batch fails, every
+        picking is tried on its own so only the faulty ones fail. The shipment
+        ledger avoids repeating the calls already done.
+        """
+        try:
+            with self.env.cr.savepoint():
+                results = self.carrier_id.yunexpress_send_shipping(self)
+                sent = {picking.id: vals for picking, vals in zip(self, results)}
+                # Core bookkeeping (price, tracking message...) for every picking
+                for picking in self.with_context(yunexpress_sent=sent):
+                    picking.send_to_shipper()
+                self.write(
+                    {"yunexpress_label_state": "ready", "yunexpress_dispatch_error": False}
+                )
+        except Exception as e:
+            if len(self) > 1:
+                for picking in self:
+                    picking._yunexpress_dispatch()
+                return
+            _logger.warning("Yun Express dispatch of %s failed: %s", self.name, e)
+            self.write(
+                {"yunexpress_label_state": "failed", "yunexpress_dispatch_error": str(e)}
+            )
+
+    def _yunexpress_notify_dispatch(self):
+        """Tell the users who validated the pickings how their labels went"""
+        for user in self.yunexpress_dispatch_user_id:
+            pickings = self.filtered(lambda x: x.yunexpress_dispatch_user_id == user)
+            failed = pickings.filtered(lambda x: x.yunexpress_label_state == "failed")
+            message = _("%(ready)s Yun Express labels ready.") % {
+                "ready": len(pickings - failed)
+            }
+            if failed:
+                message += " " + _("Failed: %(names)s") % {
+                    "names": ", ".join(failed.mapped("name"))
+                }
+            self.env["bus.bus"]._sendone(
+                user.partner_id,
+                "simple_notification",
+                {
+                    "type": "warning" if failed else "success",
+                    "title": _("Yun Express"),
+                    "message": message,
+                    "sticky": bool(failed),
+                },
+            )
+
+    def _yunexpress_label_key(self):
+        """Labels don't change for a tracking ref, document model and format
+
+        :return tuple: Label cache key
+        """
+        self.ensure_one()
+        return (
+            self.carrier_tracking_ref,
+            self.carrier_id.yunexpress_document_model_code,
+            self.carrier_id.yunexpress_document_format,
+        )
+
+    def _yunexpress_fetch_labels(self):
+        """Get the labels from Yun Express, in bulk for every carrier, and keep
+        them for reprints
+
+        :return dict: {picking id: (`ir.attachment` record, (file_name,
+            file_content))}
+        """
+        fetched = {}
+        for carrier in self.carrier_id:
+            pickings = self.filtered(lambda x: x.carrier_id == carrier)
+            labels = carrier.yunexpress_get_labels(pickings)["labels"]
+            pickings = pickings.filtered(lambda x: x.id in labels)
+            if not pickings:
+                continue
+            # The stored label is referenced again when it didn't change
+            attachments = carrier._yunexpress_store_labels(
+                [(picking,) + labels[picking.id] for picking in pickings]
+            )
+            carrier._yunexpress_cache_labels(pickings, attachments, labels)
+            for picking, attachment in zip(pickings, attachments):
+                fetched[picking.id] = (attachment, labels[picking.id])
+        return fetched
+
+    def _yunexpress_labels(self):
+        """Labels of the pickings. Reprints come from the label cache, only
+        the missing ones are requested to Yun Express.
+
+        :return dict: {picking id: (file_name, file_content)}
+        """
+        pickings = self.filtered(
+            lambda x: x.delivery_type == "yunexpress" and x.carrier_tracking_ref
+        )
+        keys = {picking.id: picking._yunexpress_label_key() for picking in pickings}
+        cached = self.env["yunexpress.label"]._get_labels(keys.values())
+        labels = {
+            picking_id: cached[key] for picking_id, key in keys.items() if key in cached
+        }
+        missing = pickings.filtered(lambda x: x.id not in labels)
+        if missing:
+            fetched = missing._yunexpress_fetch_labels()
+            for picking_id, (_attachment, label) in fetched.items():
+                labels[picking_id] = label
+        return labels
+
     def yunexpress_get_label(self):
-        """Get label for current picking
+        """Get label for current picking. Reprints are served from the label
+        cache without calling the API.
 
         :return tuple: (filename, filecontent)
         """
@@ -16,9 +266,101 @@ class StockPicking(models.Model):
         tracking_ref = self.carrier_tracking_ref
         if self.delivery_type != "yunexpress" or not tracking_ref:
             return
-        label = self.carrier_id.yunexpress_get_label(tracking_ref)
+        key = self._yunexpress_label_key()
+        label = self.env["yunexpress.label"]._get_labels([key]).get(key)
+        if label:
+            return label
+        fetched = self._yunexpress_fetch_labels()
+        if self.id not in fetched:
+            return
+        attachment, label = fetched[self.id]
         self.message_post(
             body=(_("Yun Express label for %s") % tracking_ref),
-            attachments=label,
+            attachment_ids=attachment.ids,
         )
         return label
+
+    def action_yunexpress_refresh_label(self):
+        """Forget the cached labels, the next print gets them from Yun Express"""
+        self.env["yunexpress.label"]._invalidate(self)
+
+    def _yunexpress_merged_labels(self):
+        """Labels of the pickings merged in a single document. Pickings on
+        the same label sheet share their page.
+
+        :return bytes: PDF content or False when there are no labels
+        """
+        labels = self._yunexpress_labels()
+        contents, printed = [], set()
+        for picking in self:
+            if picking.id not in labels:
+                continue
+            content = labels[picking.id][1]
+            checksum = hashlib.sha1(content).hexdigest()
+            if checksum not in printed:
+                printed.add(checksum)
+                contents.append(content)
+        if not contents:
+            return False
+        return merge_pdf(contents) if len(contents) > 1 else contents[0]
+
+    def action_yunexpress_print_labels(self):
+        """Print the labels of the selected pickings in a single document. The
+        labels are gathered here, so the document is streamed from the label
+        cache without storing it.
+
+        :return dict: Action to download the merged labels
+        """
+        pickings = self.filtered(
+            lambda x: x.delivery_type == "yunexpress" and x.carrier_tracking_ref
+        )
+        if not pickings._yunexpress_labels():
+            raise UserError(_("There are no Yun Express labels to print."))
+        return {
+            "type": "ir.actions.act_url",
+            "url": "/yunexpress/labels?picking_ids={}".format(
+                ",".join(map(str, pickings.ids))
+            ),
+            "target": "self",
+        }
+
+    def action_yunexpress_cancel_shipments(self):
+        """Cancel the shippings of the selected pickings at once. The ones
+        which couldn't be cancelled are reported and keep their tracking ref.
+
+        :return dict: Notification with the result
+        """
+        pickings = self.filtered(
+            lambda x: x.delivery_type == "yunexpress" and x.carrier_tracking_ref
+        )
+        if not pickings:
+            raise UserError(_("There are no Yun Express shippings to cancel."))
+        report = {}
+        for carrier in pickings.carrier_id:
+            report.update(
+                carrier.yunexpress_cancel_shipments(
+                    pickings.filtered(lambda x: x.carrier_id == carrier)
+                )
+            )
+        failed = pickings.filtered(lambda x: report.get(x.id))
+        message = _("%(cancelled)s Yun Express shippings cancelled.") % {
+            "cancelled": len(pickings - failed)
+        }
+        if failed:
+            message += "\n" + "\n".join(
+                "{}: {}".format(
+                    picking.name,
+                    "; ".join("{} - {}".format(*error) for error in report[picking.id]),
+                )
+                for picking in failed
+            )
+        return {
+            "type": "ir.actions.client",
+            "tag": "display_notification",
+            "params": {
+                "type": "warning" if failed else "success",
+                "title": _("Yun Express"),
+                "message": message,
+                "sticky": bool(failed),
+            },
+        }
@@ -0,0 +1,383 @@
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+"""Asynchronous Yun Express client for calls fanned out by the hundreds, i.e.:
+tracking sweeps or label refreshes. It mirrors the blocking client methods,
+results and retry policies, sharing its circuit breakers, and keeps its own
+connection pool with a limit of requests in flight.
+
+Odoo code isn't asynchronous, so the calls are run in a batch:
+
+    client = YUNExpressAsyncRequest(api_cid, api_secret)
+    results = run_batch(client, lambda c: [c.get_tracking(code) for code in codes])
+"""
+import asyncio
+import base64
+import hashlib
+import logging
+import random
+import time
+from collections import deque
+
+from .yunexpress_request import (
+    YUNEXPRESS_API_URL,
+    YUNEXPRESS_BACKOFF_BASE,
+    YUNEXPRESS_BACKOFF_MAX,
+    YUNEXPRESS_EXCHANGES_BUFFER,
+    YUNEXPRESS_RETRY_DEFAULT,
+    YUNEXPRESS_RETRY_POLICIES,
+    YUNEXPRESS_RETRY_STATUSES,
+    YUNEXPRESS_TIMEOUT,
+    YUNExpressRequest,
+    get_breaker,
+)
+from .yunexpress_response import (
+    ApiResponse,
+    LabelResult,
+    OrderDetail,
+    OrderResult,
+    TrackingInfo,
+    TrackingNumberResult,
+)
+
+_logger = logging.getLogger(__name__)
+
+try:
+    import aiohttp
+except (ImportError, IOError) as err:
+    _logger.debug(err)
+    aiohttp = None
+
+# Requests in flight at once per client. Tunable with the
+# `yunexpress_async_concurrency` server option.
+YUNEXPRESS_ASYNC_CONCURRENCY = 200
+
+
+class AsyncResponse:
+    """Body of an aiohttp response, already read. It has the attributes of a
+    `requests` response the callers rely on.
+    """
+
+    __slots__ = ("status_code", "content")
+
+    def __init__(self, status_code, content):
+        self.status_code = status_code
+        self.content = content
+
+    @property
+    def text(self):
+        return self.content.decode("utf-8", "replace")
+
+
+class YUNExpressAsyncRequest:
+    """Asynchronous interface to the Yun Express REST API. The connection pool
+    lives in the event loop, so the client is used inside `async with` (which
+    `run_batch` does).
+    """
+
+    def __init__(
+        self,
+        api_cid,
+        api_secret,
+        prod=False,
+        concurrency=YUNEXPRESS_ASYNC_CONCURRENCY,
+        timeout=YUNEXPRESS_TIMEOUT,
+        rate_limiter=None,
+        record_exchanges=False,
+        log_sample_rate=1.0,
+        api_url=None,
+    ):
+        if aiohttp is None:
+            raise ImportError("The asynchronous Yun Express client needs aiohttp")
+        self.api_cid = api_cid
+        self.api_secret = api_secret
+        self.api_token = base64.b64encode(
+            (api_cid + "&" + api_secret).encode("utf-8")
+        ).decode("utf-8")
+        # Blocking `acquire(endpoint)`, run in a thread
+        self.rate_limiter = rate_limiter
+        self.record_exchanges = record_exchanges
+        self.log_sample_rate = log_sample_rate
+        self.exchanges = deque(maxlen=YUNEXPRESS_EXCHANGES_BUFFER)
+        self.url = api_url or (
+            YUNEXPRESS_API_URL["prod"] if prod else YUNEXPRESS_API_URL["test"]
+        )
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.breaker = get_breaker(api_cid, prod)
+        self.session = None
+        self._semaphore = None
+        self._limiter_lock = None
+
+    async def __aenter__(self):
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.concurrency, ttl_dns_cache=300),
+            timeout=aiohttp.ClientTimeout(
+                sock_connect=self.timeout[0], sock_read=self.timeout[1]
+            ),
+            headers={
+                "Content-Type": "application/json;charset=UTF-8",
+                "Accept": "application/json",
+            },
+        )
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        # Tokens are taken one at a time, so a batch holds a single database
+        # connection of the rate limiter
+        self._limiter_lock = asyncio.Lock()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.session.close()
+        self.session = None
+
+    # Same logging as the blocking client
+    _log_exchange = YUNExpressRequest._log_exchange
+    pop_exchanges = YUNExpressRequest.pop_exchanges
+
+    async def _call(self, endpoint, method, url, authorized=True, **kwargs):
+        """Call the API with the retry policy of the endpoint, accounted in the
+        circuit breaker of the account like the blocking client does
+
+        :param str endpoint: Endpoint name of the retry policy
+        :param str method: HTTP method
+        :param str url: Request url
+        :param bool authorized: Send our credentials. Documents are served
+            from other hosts which mustn't get them.
+        :raises YUNExpressUnavailable: When the circuit is open
+        :return AsyncResponse: Last response
+        """
+        if authorized:
+            kwargs["headers"] = dict(
+                kwargs.get("headers") or {}, Authorization="Basic " + self.api_token
+            )
+        started = time.time()
+        try:
+            response = await self._call_with_retries(endpoint, method, url, **kwargs)
+        except Exception as e:
+            self._log_exchange(endpoint, method, url, kwargs, started, None, e)
+            raise
+        self._log_exchange(endpoint, method, url, kwargs, started, response)
+        return response
+
+    async def _call_with_retries(self, endpoint, method, url, **kwargs):
+        attempts, retry = YUNEXPRESS_RETRY_POLICIES.get(
+            endpoint, YUNEXPRESS_RETRY_DEFAULT
+        )
+        self.breaker.before_call()
+        loop = asyncio.get_running_loop()
+        settled = False
+        try:
+            for attempt in range(attempts):
+                if attempt:
+                    self.breaker.retry()
+                    await asyncio.sleep(
+                        random.uniform(
+                            0,
+                            min(
+                                YUNEXPRESS_BACKOFF_MAX,
+                                YUNEXPRESS_BACKOFF_BASE * 2**attempt,
+                            ),
+                        )
+                    )
+                if self.rate_limiter:
+                    async with self._limiter_lock:
+                        await loop.run_in_executor(
+                            None, self.rate_limiter.acquire, endpoint
+                        )
+                try:
+                    async with self._semaphore:
+                        async with self.session.request(
+                            method, url, **kwargs
+                        ) as result:
+                            response = AsyncResponse(
+                                result.status, await result.read()
+                            )
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    error = "{}: {}".format(endpoint, str(e) or type(e).__name__)
+                    if not retry or attempt == attempts - 1:
+                        settled = True
+                        self.breaker.failure(error)
+                        raise
+                    _logger.warning(
+                        "Yun Express %s failed, retrying: %s", endpoint, error
+                    )
+                    continue
+                if response.status_code not in YUNEXPRESS_RETRY_STATUSES:
+                    settled = True
+                    self.breaker.success()
+                    return response
+                error = "{}: HTTP {}".format(endpoint, response.status_code)
+                if not retry or attempt == attempts - 1:
+                    break
+                _logger.warning("Yun Express %s failed, retrying: %s", endpoint, error)
+            settled = True
+            self.breaker.failure(error)
+            return response
+        finally:
+            # Cancelled or failed on our side: don't leave a probe pending
+            if not settled:
+                self.breaker.release()
+
+    # API Methods. See `YUNExpressRequest` for their contracts.
+
+    async def create_orders(self, shipping_values_list):
+        url = self.url + "/api/WayBill/CreateOrder"
+        response = await self._call(
+            "CreateOrder", "POST", url, json=shipping_values_list
+        )
+        if response.status_code != 200:
+            raise Exception("Error in request")
+        orders = [
+            OrderResult.from_item(
+                item,
+                index < len(shipping_values_list)
+                and shipping_values_list[index]["CustomerOrderNumber"],
+            )
+            for index, item in enumerate(ApiResponse.from_response(response).item or [])
+        ]
+        duplicates = [order for order in orders if order.is_duplicate]
+        details = await asyncio.gather(
+            *(self.get_order_details(order.order_number) for order in duplicates)
+        )
+        for order, (_errors, detail) in zip(duplicates, details):
+            if detail and detail.waybill_number:
+                order.waybill_number = detail.waybill_number
+                order.tracking_number = detail.tracking_number
+                order.duplicated = True
+        return {order.order_number: order for order in orders}
+
+    async def get_order_details(self, shipping_code):
+        url = self.url + "/api/WayBill/GetOrder"
+        response = ApiResponse.from_response(
+            await self._call(
+                "GetOrder", "POST", url, json={"OrderNumber": shipping_code}
+            )
+        )
+        if not response.ok or not response.item:
+            return response.errors() or [("-", "No order")], None
+        return [], OrderDetail.from_item(response.item)
+
+    async def get_tracking(self, shipping_code):
+        url = self.url + "/api/Tracking/GetTrackAllInfo"
+        response = ApiResponse.from_response(
+            await self._call(
+                "GetTrackAllInfo", "POST", url, json={"OrderNumber": shipping_code}
+            )
+        )
+        return response.errors(), TrackingInfo.from_item(response.item)
+
+    async def get_documents_multi(
+        self,
+        shipping_codes,
+        document_code="LASER_MAIN_ES",
+        model_code="SINGLE",
+        kind_code="PDF",
+        offset=0,
+    ):
+        url = self.url + "/api/Label/Print"
+        if isinstance(shipping_codes, str):
+            shipping_codes = [shipping_codes]
+        params = {
+            "DocumentCode": document_code,
+            "ModelCode": model_code,
+            "KindCode": kind_code,
+            "Offset": offset,
+        }
+        response = ApiResponse.from_response(
+            await self._call(
+                "Label/Print", "POST", url, params=params, json=list(shipping_codes)
+            )
+        )
+        if response.status != 200:
+            raise Exception("Error in request")
+        if not response.ok:
+            raise Exception("Error in response {} - {}".format(*response.errors()[0]))
+        return [LabelResult.from_item(item) for item in response.item or []]
+
+    async def download(self, url):
+        response = await self._call("download", "GET", url, authorized=False)
+        if response.status_code != 200:
+            raise Exception("Error in request")
+        return response.content
+
+    async def get_tracking_numbers(self, shipping_codes):
+        url = self.url + "/api/Waybill/GetTrackingNumber"
+        response = ApiResponse.from_response(
+            await self._call(
+                "GetTrackingNumber",
+                "GET",
+                url,
+                params={"CustomerOrderNumber": ",".join(shipping_codes)},
+            )
+        )
+        items = response.item or []
+        if isinstance(items, dict):
+            items = [items]
+        results = {}
+        for item in items:
+            result = TrackingNumberResult.from_item(item)
+            results[result.order_number] = result
+        return response.errors(), results
+
+    async def get_shipping_methods(self, country_code=None):
+        url = self.url + "/api/Common/GetShippingMethods"
+        response = ApiResponse.from_response(
+            await self._call(
+                "GetShippingMethods",
+                "GET",
+                url,
+                params={"CountryCode": country_code} if country_code else None,
+            )
+        )
+        if response.status != 200:
+            raise Exception("Error in request")
+        return response.data.get("Items") or []
+
+    async def get_service_types(self):
+        timestamp = str(int(time.time() * 1000))
+        data = {
+            "RequestName": "EmsKindList",
+            "icID": self.api_cid,
+            "TimeStamp": timestamp,
+            "MD5": hashlib.md5(
+                (self.api_cid + timestamp + self.api_secret).encode("utf-8")
+            )
+            .hexdigest()
+            .lower(),
+        }
+        response = ApiResponse.from_response(
+            await self._call(
+                "EmsKindList",
+                "POST",
+                self.url + "/cgi-bin/EmsData.dll?DoApi",
+                json=data,
+            )
+        )
+        services = [
+            (service.get("oName"), service.get("cName") or service.get("oName"))
+            for service in response.data.get("List") or []
+            if service.get("oName")
+        ]
+        errors = response.errors()
+        if not errors and not services:
+            errors = [("-", "No services")]
+        return errors, services
+
+
+def run_batch(client, calls, return_exceptions=True):
+    """Run a batch of API calls in an event loop of its own and wait for them.
+    It's meant for blocking code, like the crons.
+
+    :param YUNExpressAsyncRequest client: Asynchronous client
+    :param callable calls: Gets the opened client and returns the awaitables
+        to run, i.e.: `lambda c: [c.get_tracking(code) for code in codes]`
+    :param bool return_exceptions: Failed calls give their exception instead
+        of failing the batch
+    :return list: Results in the calls order
+    """
+
+    async def batch():
+        async with client:
+            return await asyncio.gather(
+                *calls(client), return_exceptions=return_exceptions
+            )
+
+    return asyncio.run(batch())
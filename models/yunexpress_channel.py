@@ -0,0 +1,160 @@
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+from odoo import api, fields, models, tools
+
+
+class YunExpressChannel(models.Model):
+    _name = "yunexpress.channel"
+    _description = "Yun Express shipping channel"
+    _order = "code"
+
+    code = fields.Char(required=True, index=True)
+    name = fields.Char(required=True, translate=True)
+    active = fields.Boolean(default=True)
+    country_ids = fields.Many2many(
+        comodel_name="res.country",
+        string="Countries",
+        help="Destination countries covered by the channel",
+    )
+    goods_type = fields.Selection(
+        selection=[("general", "General goods"), ("battery", "Battery")],
+        default="general",
+        required=True,
+        index=True,
+    )
+    transit_days = fields.Integer(
+        help="Typical days from dispatch to delivery with this channel",
+    )
+
+    _sql_constraints = [
+        ("code_uniq", "unique(code)", "The channel code must be unique"),
+    ]
+
+    @api.model
+    def _goods_type_from_name(self, name):
+        """Yun Express tells battery channels apart by their name (带电)"""
+        return "battery" if "带电" in (name or "") else "general"
+
+    @tools.ormcache()
+    def _get_channel_map(self):
+        """In-memory map of the active channels
+
+        :return dict: {code: (id, goods_type, frozenset of country codes)}
+        """
+        self.env.cr.execute(
+            """
+            SELECT ch.id, ch.code, ch.goods_type, array_agg(rc.code)
+            FROM yunexpress_channel ch
+            LEFT JOIN res_country_yunexpress_channel_rel rel
+                ON rel.yunexpress_channel_id = ch.id
+            LEFT JOIN res_country rc ON rc.id = rel.res_country_id
+            WHERE ch.active
+            GROUP BY ch.id
+            """
+        )
+        return {
+            code: (channel_id, goods_type, frozenset(filter(None, countries)))
+            for channel_id, code, goods_type, countries in self.env.cr.fetchall()
+        }
+
+    @api.model
+    def _uncovered_countries(self, code, country_codes):
+        """Destinations the channel is known not to cover: those which some
+        other active channel covers according to the synchronized coverage.
+        The countries whose coverage wasn't gathered aren't checked.
+
+        :param str code: Channel code of the delivery method
+        :param iterable country_codes: Destination country ISO codes
+        :return set: Country codes out of the channel coverage
+        """
+        channel_map = self._get_channel_map()
+        channel = channel_map.get(code)
+        if not channel or not channel[2]:
+            return set()
+        known = set().union(*(countries for _i, _g, countries in channel_map.values()))
+        return {
+            country_code
+            for country_code in country_codes
+            if country_code in known and country_code not in channel[2]
+        }
+
+    # The synchronization clears the caches once when it's done
+    @api.model_create_multi
+    def create(self, vals_list):
+        if not self.env.context.get("yunexpress_channel_sync"):
+            self.clear_caches()
+        return super().create(vals_list)
+
+    def write(self, vals):
+        if not self.env.context.get("yunexpress_channel_sync"):
+            self.clear_caches()
+        return super().write(vals)
+
+    def unlink(self):
+        self.clear_caches()
+        return super().unlink()
+
+    @api.model
+    def _sync(self, methods, coverage=None):
+        """Bulk synchronization of the channels from the shipping methods API
+
+        :param list methods: GetShippingMethods items
+        :param dict coverage: {country code: set of channel codes} for the
+            countries which coverage was gathered
+        """
+        Channel = self.with_context(active_test=False, yunexpress_channel_sync=True)
+        codes = {m.get("Code") for m in methods} - {None, ""}
+        channels = {
+            channel.code: channel
+            for channel in Channel.search([("code", "in", list(codes))])
+        }
+        # The channels the API doesn't return anymore are retired
+        retired = Channel.browse()
+        if codes:
+            retired = Channel.search(
+                [("active", "=", True), ("code", "not in", list(codes))]
+            )
+        to_create = []
+        vals_by_channel = {}
+        for method in methods:
+            code = method.get("Code")
+            if not code:
+                continue
+            name = method.get("CName") or method.get("EName") or code
+            channel = channels.get(code)
+            if not channel:
+                to_create.append(
+                    {
+                        "code": code,
+                        "name": name,
+                        "goods_type": self._goods_type_from_name(name),
+                    }
+                )
+            else:
+                vals = {}
+                if channel.name != name:
+                    vals["name"] = name
+                if not channel.active:
+                    vals["active"] = True
+                if vals:
+                    vals_by_channel[channel] = vals
+        if to_create:
+            for channel in Channel.create(to_create):
+                channels[channel.code] = channel
+        if coverage:
+            countries = self.env["res.country"].search(
+                [("code", "in", list(coverage))]
+            )
+            for code, channel in channels.items():
+                commands = []
+                for country in countries:
+                    covered = code in coverage[country.code]
+                    if covered != (country in channel.country_ids):
+                        commands.append((4 if covered else 3, country.id))
+                if commands:
+                    vals_by_channel.setdefault(channel, {})["country_ids"] = commands
+        for channel, vals in vals_by_channel.items():
+            channel.write(vals)
+        if retired:
+            retired.write({"active": False})
+        if to_create or vals_by_channel or retired:
+            self.clear_caches()
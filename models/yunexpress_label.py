@@ -0,0 +1,152 @@
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+import threading
+from collections import OrderedDict
+
+from odoo import api, fields, models
+from odoo.tools.config import config
+
+# Bytes of label contents kept in memory by every worker. Tunable with the
+# `yunexpress_label_cache_bytes` server option.
+YUNEXPRESS_LABEL_CACHE_BYTES = 64 * 1024 * 1024
+
+
+class LabelContents:
+    """Least recently used label contents by checksum, within a size budget.
+    Being keyed by content, entries are never stale: they're just evicted.
+    """
+
+    def __init__(self, budget):
+        self.budget = budget
+        self.size = 0
+        self._contents = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, checksum):
+        with self._lock:
+            content = self._contents.get(checksum)
+            if content is not None:
+                self._contents.move_to_end(checksum)
+            return content
+
+    def put(self, checksum, content):
+        if len(content) > self.budget:
+            return
+        with self._lock:
+            if checksum in self._contents:
+                self._contents.move_to_end(checksum)
+                return
+            self._contents[checksum] = content
+            self.size += len(content)
+            while self.size > self.budget:
+                _checksum, evicted = self._contents.popitem(last=False)
+                self.size -= len(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._contents.clear()
+            self.size = 0
+
+
+_label_contents = LabelContents(
+    int(config.get("yunexpress_label_cache_bytes") or YUNEXPRESS_LABEL_CACHE_BYTES)
+)
+
+
+class YunExpressLabel(models.Model):
+    """Labels already obtained from Yun Express. A label never changes for a
+    tracking ref, document model and format, so reprints are served from the
+    stored attachment without calling the API.
+    """
+
+    _name = "yunexpress.label"
+    _description = "Yun Express label cache"
+    _order = "id desc"
+
+    tracking_ref = fields.Char(required=True)
+    model_code = fields.Char(string="Document model", required=True)
+    kind_code = fields.Char(string="Format", required=True)
+    picking_id = fields.Many2one(
+        comodel_name="stock.picking", required=True, ondelete="cascade", index=True
+    )
+    attachment_id = fields.Many2one(
+        comodel_name="ir.attachment", required=True, ondelete="cascade"
+    )
+    checksum = fields.Char(required=True)
+
+    _sql_constraints = [
+        (
+            "label_uniq",
+            "unique(tracking_ref, model_code, kind_code)",
+            "There's already a label for this tracking ref, model and format",
+        ),
+    ]
+
+    @api.model
+    def _get_labels(self, keys):
+        """Cached labels for the given keys
+
+        :param list keys: tuples of (tracking ref, model code, kind code)
+        :return dict: {key: (file name, file content)}
+        """
+        keys = set(keys)
+        if not keys:
+            return {}
+        entries = self.search(
+            [("tracking_ref", "in", list({ref for ref, _m, _k in keys}))]
+        ).filtered(lambda x: (x.tracking_ref, x.model_code, x.kind_code) in keys)
+        labels = {}
+        for entry in entries:
+            content = _label_contents.get(entry.checksum)
+            if content is None:
+                # From the filestore
+                content = entry.attachment_id.raw
+                if not content:
+                    continue
+                _label_contents.put(entry.checksum, content)
+            labels[(entry.tracking_ref, entry.model_code, entry.kind_code)] = (
+                entry.attachment_id.name,
+                content,
+            )
+        return labels
+
+    @api.model
+    def _register(self, labels):
+        """Cache the given stored labels
+
+        :param list labels: tuples of (picking, model code, kind code,
+            `ir.attachment` record, file content)
+        """
+        keys = {
+            (picking.carrier_tracking_ref, model_code, kind_code)
+            for picking, model_code, kind_code, _a, _c in labels
+        }
+        existing = self.search(
+            [("tracking_ref", "in", list({ref for ref, _m, _k in keys}))]
+        ).filtered(lambda x: (x.tracking_ref, x.model_code, x.kind_code) in keys)
+        existing.unlink()
+        vals_list = []
+        for picking, model_code, kind_code, attachment, content in labels:
+            _label_contents.put(attachment.checksum, content)
+            vals_list.append(
+                {
+                    "tracking_ref": picking.carrier_tracking_ref,
+                    "model_code": model_code,
+                    "kind_code": kind_code,
+                    "picking_id": picking.id,
+                    "attachment_id": attachment.id,
+                    "checksum": attachment.checksum,
+                }
+            )
+        self.create(vals_list)
+
+    @api.model
+    def _invalidate(self, pickings=None):
+        """Forget the cached labels, so they're requested again
+
+        :param recordset pickings: `stock.picking` recordset, every label when
+            not given
+        """
+        domain = [("picking_id", "in", pickings.ids)] if pickings is not None else []
+        self.search(domain).unlink()
+        if pickings is None:
+            _label_contents.clear()
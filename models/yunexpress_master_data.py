@@ -3,7 +3,30 @@
 
 # Master Data provided by Yun Express
 
-# YUN Chnnel
+# PackageState values returned by GetTrackAllInfo mapped to delivery states:
+# 0 unknown, 1 submitted, 2 in transit, 3 delivered, 4 received by YUN,
+# 5 cancelled, 6 delivery failed, 7 returned
+YUNEXPRESS_DELIVERY_STATES_STATIC = {
+    0: "shipping_recorded_in_carrier",
+    1: "shipping_recorded_in_carrier",
+    2: "in_transit",
+    3: "customer_delivered",
+    4: "in_transit",
+    5: "canceled_shipment",
+    6: "incidence",
+    7: "warehouse_delivered",
+}
+
+# Delivery states that won't change anymore
+YUNEXPRESS_FINAL_DELIVERY_STATES = [
+    "customer_delivered",
+    "warehouse_delivered",
+    "canceled_shipment",
+    "no_update",
+]
+
+# YUN Chnnel. Channels are synchronized into `yunexpress.channel`, this list is
+# only used to name the former codes when migrating.
 YUNEXPRESS_CHANNELS = [
     ("THPHR","云途全球专线挂号（特惠普货）"),
     ("THZXR","云途全球专线挂号（特惠带电）"),
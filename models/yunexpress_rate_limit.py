@@ -0,0 +1,142 @@
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+import time
+
+from odoo import fields, models
+from odoo.sql_db import db_connect
+
+from .yunexpress_request import YUNExpressUnavailable
+
+# Endpoints sharing every budget. Label downloads aren't API calls.
+YUNEXPRESS_RATE_GROUPS = {
+    "CreateOrder": "create_order",
+    "GetOrder": "create_order",
+    "Label/Print": "label",
+    "GetTrackAllInfo": "tracking",
+    "download": False,
+}
+# Default budgets per group: (tokens per second, burst capacity)
+YUNEXPRESS_RATE_DEFAULTS = {
+    "create_order": (5.0, 10.0),
+    "label": (5.0, 10.0),
+    "tracking": (10.0, 20.0),
+    "default": (5.0, 10.0),
+}
+# Seconds a call waits for a token at most
+YUNEXPRESS_RATE_MAX_WAIT = 60
+
+
+class YunExpressRateLimit(models.Model):
+    _name = "yunexpress.rate.limit"
+    _description = "Yun Express API budget per account"
+    _order = "api_cid, endpoint"
+
+    api_cid = fields.Char(string="API Client ID", required=True, index=True)
+    endpoint = fields.Selection(
+        selection=[
+            ("create_order", "Orders"),
+            ("label", "Labels"),
+            ("tracking", "Tracking"),
+            ("default", "Other calls"),
+        ],
+        required=True,
+    )
+    rate = fields.Float(
+        string="Calls per second",
+        required=True,
+        help="Sustained calls per second shared by every Odoo worker",
+    )
+    capacity = fields.Float(
+        string="Burst", required=True, help="Calls allowed at once after a pause"
+    )
+    tokens = fields.Float(readonly=True)
+    refilled_at = fields.Datetime(readonly=True)
+
+    _sql_constraints = [
+        (
+            "api_cid_endpoint_uniq",
+            "unique(api_cid, endpoint)",
+            "There's already a budget for this account and endpoint",
+        ),
+    ]
+
+
+class PgTokenBucket:
+    """Token bucket per Yun Express account shared by every worker on every
+    node through PostgreSQL. Taking a token is a short transaction on its own
+    connection which locks the budget row, refills it according to the
+    elapsed time and takes a token when there's one.
+    """
+
+    def __init__(self, dbname, api_cid):
+        self.dbname = dbname
+        self.api_cid = api_cid
+
+    def _take(self, group):
+        """Try to take a token
+
+        :param str group: Budget group
+        :return float: 0 when the token is taken, otherwise seconds to wait
+        """
+        with db_connect(self.dbname).cursor() as cr:
+            rate, capacity = YUNEXPRESS_RATE_DEFAULTS[group]
+            cr.execute(
+                """
+                INSERT INTO yunexpress_rate_limit
+                    (api_cid, endpoint, rate, capacity, tokens, refilled_at)
+                VALUES (%s, %s, %s, %s, %s, clock_timestamp() at time zone 'UTC')
+                ON CONFLICT (api_cid, endpoint) DO NOTHING
+                """,
+                (self.api_cid, group, rate, capacity, capacity),
+            )
+            cr.execute(
+                """
+                SELECT id, rate, capacity, COALESCE(tokens, 0),
+                    EXTRACT(EPOCH FROM (clock_timestamp() at time zone 'UTC')
+                        - COALESCE(refilled_at, '1970-01-01'))
+                FROM yunexpress_rate_limit
+                WHERE api_cid = %s AND endpoint = %s
+                FOR UPDATE
+                """,
+                (self.api_cid, group),
+            )
+            limit_id, rate, capacity, tokens, elapsed = cr.fetchone()
+            if rate <= 0:
+                return 0
+            tokens = min(capacity, tokens + rate * float(elapsed))
+            wait = 0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / rate
+            cr.execute(
+                """
+                UPDATE yunexpress_rate_limit
+                SET tokens = %s,
+                    refilled_at = clock_timestamp() at time zone 'UTC'
+                WHERE id = %s
+                """,
+                (tokens, limit_id),
+            )
+        return wait
+
+    def acquire(self, endpoint):
+        """Wait for a token of the endpoint budget
+
+        :param str endpoint: Endpoint name
+        :raises YUNExpressUnavailable: When the budget is exhausted for too long
+        """
+        group = YUNEXPRESS_RATE_GROUPS.get(endpoint, "default")
+        if not group or not self.api_cid:
+            return
+        deadline = time.time() + YUNEXPRESS_RATE_MAX_WAIT
+        while True:
+            wait = self._take(group)
+            if not wait:
+                return
+            if time.time() + wait > deadline:
+                raise YUNExpressUnavailable(
+                    "Yun Express {} budget exhausted for account {}".format(
+                        group, self.api_cid
+                    )
+                )
+            time.sleep(wait)
@@ -2,12 +2,25 @@
 # License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
 import logging
 
-from lxml import etree
 import requests
+from requests.adapters import HTTPAdapter
 import hashlib
+import hmac
+import random
+import threading
 import time
 import json
 import base64
+from collections import deque
+
+from .yunexpress_response import (
+    ApiResponse,
+    LabelResult,
+    OrderDetail,
+    OrderResult,
+    TrackingInfo,
+    TrackingNumberResult,
+)
 
 _logger = logging.getLogger(__name__)
 
@@ -15,6 +28,303 @@ YUNEXPRESS_API_URL = {
     "test": "http://omsapi.uat.yunexpress.com",
     "prod": "http://oms.api.yunexpress.com",
 }
+YUNEXPRESS_CNE_PRINT_URL = "https://label.cne.com/CnePrint"
+
+# Connection pool defaults. They can be tuned per deployment with the
+# `yunexpress_pool_connections` and `yunexpress_pool_maxsize` server options.
+YUNEXPRESS_POOL_CONNECTIONS = 4
+YUNEXPRESS_POOL_MAXSIZE = 16
+# (connect, read) timeouts in seconds
+YUNEXPRESS_TIMEOUT = (10, 60)
+
+# Retry policy per endpoint: (attempts, retry on errors). CreateOrder isn't
+# idempotent, so it's never retried: a lost response is recovered through the
+# duplicated order remark and the shipment ledger.
+YUNEXPRESS_RETRY_POLICIES = {
+    "CreateOrder": (1, False),
+    "GetOrder": (3, True),
+    "Label/Print": (3, True),
+    "download": (3, True),
+    "GetTrackAllInfo": (3, True),
+    "GetTrackingNumber": (3, True),
+    "GetShippingMethods": (3, True),
+    "EmsKindList": (2, True),
+    "CnePrint": (3, True),
+    "Delete": (3, True),
+    "Intercept": (3, True),
+}
+YUNEXPRESS_RETRY_DEFAULT = (1, False)
+# Exponential backoff base and cap in seconds (full jitter)
+YUNEXPRESS_BACKOFF_BASE = 0.5
+YUNEXPRESS_BACKOFF_MAX = 8.0
+# HTTP statuses worth a retry
+YUNEXPRESS_RETRY_STATUSES = {429, 500, 502, 503, 504}
+# Consecutive failures opening the circuit and seconds before probing again
+YUNEXPRESS_BREAKER_THRESHOLD = 5
+YUNEXPRESS_BREAKER_COOLDOWN = 30
+
+# OrderType of the Delete and Intercept calls: 1 for waybill numbers
+YUNEXPRESS_ORDER_TYPE_WAYBILL = "1"
+# Delete error of the orders already received, which are intercepted instead
+YUNEXPRESS_DELETE_RECEIVED_CODE = "1001"
+# Customer order numbers per GetTrackingNumber call
+YUNEXPRESS_TRACKING_NUMBER_CHUNK = 30
+
+# Exchanges kept in memory until the carrier records them
+YUNEXPRESS_EXCHANGES_BUFFER = 500
+# Characters of the bodies kept in the recorded exchanges
+YUNEXPRESS_LOG_BODY_SIZE = 4000
+# Keys which values never reach the logs
+YUNEXPRESS_REDACTED_KEYS = {"authorization", "md5", "signature", "secret", "token"}
+YUNEXPRESS_REDACTED = "***"
+
+
+def redact(value):
+    """Copy of the request values without secrets
+
+    :param value: dict, list or scalar
+    :return: The same structure with the secret values masked
+    """
+    if isinstance(value, dict):
+        return {
+            key: YUNEXPRESS_REDACTED
+            if str(key).lower() in YUNEXPRESS_REDACTED_KEYS
+            else redact(item)
+            for key, item in value.items()
+        }
+    if isinstance(value, (list, tuple)):
+        return [redact(item) for item in value]
+    return value
+
+
+class Exchange:
+    """API call kept for the logs. It's formatted only when it's written, so
+    the calls which aren't logged cost nothing.
+    """
+
+    __slots__ = ("endpoint", "method", "url", "request", "status", "elapsed", "body")
+
+    def __init__(self, endpoint, method, url, request, status, elapsed, body):
+        self.endpoint = endpoint
+        self.method = method
+        self.url = url
+        self.request = request
+        self.status = status
+        self.elapsed = elapsed
+        self.body = body
+
+    def format_request(self):
+        return "{} {}\n{}".format(
+            self.method,
+            self.url,
+            json.dumps(redact(self.request), ensure_ascii=False, default=str),
+        )
+
+    def format_response(self):
+        return "{} in {:.0f}ms\n{}".format(
+            self.status, self.elapsed * 1000, self.body[:YUNEXPRESS_LOG_BODY_SIZE]
+        )
+
+    def __str__(self):
+        return "{}: {} -> {}".format(
+            self.endpoint, self.format_request(), self.format_response()
+        )
+
+
+class YUNExpressUnavailable(Exception):
+    """Yun Express is failing for the account and the circuit is open"""
+
+
+class CircuitBreaker:
+    """Circuit breaker per account and environment. After a run of failed
+    calls it fails fast until the cooldown passes. Then a single probe call is
+    let through: if it works, the circuit closes again.
+    """
+
+    def __init__(
+        self,
+        threshold=YUNEXPRESS_BREAKER_THRESHOLD,
+        cooldown=YUNEXPRESS_BREAKER_COOLDOWN,
+    ):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.retries = 0
+        self.last_error = False
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        """Raise when the circuit is open and it isn't time to probe"""
+        with self._lock:
+            if self.state == "closed":
+                return
+            if self.state == "open" and time.time() - self.opened_at >= self.cooldown:
+                self.state = "half_open"
+                return
+            raise YUNExpressUnavailable(
+                "Yun Express is unavailable, retrying in {:.0f}s. Last error: {}".format(
+                    max(self.cooldown - (time.time() - self.opened_at), 0),
+                    self.last_error,
+                )
+            )
+
+    def success(self):
+        with self._lock:
+            self.state = "closed"
+            self.failures = 0
+
+    def failure(self, error):
+        with self._lock:
+            self.failures += 1
+            self.last_error = error
+            if self.state == "half_open" or self.failures >= self.threshold:
+                self.state = "open"
+                self.opened_at = time.time()
+
+    def retry(self):
+        with self._lock:
+            self.retries += 1
+
+    def release(self):
+        """The call ended before Yun Express answered for reasons of our own,
+        i.e.: the rate limiter gave up. A pending probe goes back to open, so
+        the next call probes again.
+        """
+        with self._lock:
+            if self.state == "half_open":
+                self.state = "open"
+
+    def stats(self):
+        """Breaker status for operators
+
+        :return dict: state, failures, retries and last_error
+        """
+        return {
+            "state": self.state,
+            "failures": self.failures,
+            "retries": self.retries,
+            "last_error": self.last_error,
+        }
+
+
+# Circuit breakers per (api_cid, environment) in this worker
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(api_cid, prod=False):
+    """Get the circuit breaker of the given account and environment
+
+    :return CircuitBreaker: Shared breaker
+    """
+    key = (api_cid, bool(prod))
+    breaker = _breakers.get(key)
+    if not breaker:
+        with _breakers_lock:
+            breaker = _breakers.setdefault(key, CircuitBreaker())
+    return breaker
+
+
+# Shared keep-alive sessions per (api_cid, environment) in this worker
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def get_session(
+    api_cid,
+    api_token,
+    prod=False,
+    pool_connections=YUNEXPRESS_POOL_CONNECTIONS,
+    pool_maxsize=YUNEXPRESS_POOL_MAXSIZE,
+):
+    """Get the pooled session for the given account and environment. The
+    session is built once per worker with the authorization headers already
+    set, so every call reuses the open connections.
+
+    :param str api_cid: Yun Express API Client ID
+    :param str api_token: Base64 token used in the Authorization header
+    :param bool prod: Production environment
+    :param int pool_connections: Number of hosts to keep a pool for
+    :param int pool_maxsize: Maximum connections kept alive per host
+    :return requests.Session: Shared session
+    """
+    key = (api_cid, bool(prod))
+    authorization = "Basic " + api_token
+    session = _sessions.get(key)
+    if session and session.headers.get("Authorization") == authorization:
+        return session
+    with _sessions_lock:
+        session = _sessions.get(key)
+        if session and session.headers.get("Authorization") == authorization:
+            return session
+        new_session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=pool_connections, pool_maxsize=pool_maxsize
+        )
+        new_session.mount("http://", adapter)
+        new_session.mount("https://", adapter)
+        new_session.headers.update(
+            {
+                "Content-Type": "application/json;charset=UTF-8",
+                "Accept": "application/json",
+                "Authorization": authorization,
+            }
+        )
+        _sessions[key] = new_session
+    # The credentials changed, so the old pool can't be used anymore
+    if session:
+        session.close()
+    return new_session
+
+
+def push_signature(api_secret, body):
+    """Signature of a tracking push: HMAC-SHA256 of the raw body with the
+    account secret, hex encoded.
+
+    :param str api_secret: Yun Express API Secret
+    :param bytes body: Raw request body
+    :return str: Signature
+    """
+    return hmac.new(api_secret.encode("utf-8"), body, hashlib.sha256).hexdigest()
+
+
+def verify_push_signature(api_secret, body, signature):
+    """Check a tracking push signature in constant time. It's compared as
+    bytes, as whatever the sender put in the header must be rejected, not
+    raise.
+
+    :return bool: The signature is valid
+    """
+    if not api_secret or not signature:
+        return False
+    if isinstance(signature, str):
+        signature = signature.encode("utf-8", "replace")
+    return hmac.compare_digest(
+        push_signature(api_secret, body).encode("ascii"), signature
+    )
+
+
+def send_tracking_push(url, api_secret, items, timeout=YUNEXPRESS_TIMEOUT):
+    """Stand-in sender of Yun Express tracking pushes. Useful to test the
+    endpoint locally.
+
+    :param str url: Tracking push URL of the carrier
+    :param str api_secret: Yun Express API Secret
+    :param list items: GetTrackAllInfo items to push
+    :return requests.Response: Endpoint response
+    """
+    body = json.dumps(items).encode("utf-8")
+    return requests.post(
+        url,
+        data=body,
+        headers={
+            "Content-Type": "application/json",
+            "X-YunExpress-Signature": push_signature(api_secret, body),
+        },
+        timeout=timeout,
+    )
 
 
 class YUNExpressRequest:
@@ -25,56 +335,208 @@ class YUNExpressRequest:
     api_secret = False
     api_token = False
 
-    def __init__(self, api_cid, api_secret, prod=False):
+    def __init__(
+        self,
+        api_cid,
+        api_secret,
+        prod=False,
+        pool_connections=YUNEXPRESS_POOL_CONNECTIONS,
+        pool_maxsize=YUNEXPRESS_POOL_MAXSIZE,
+        timeout=YUNEXPRESS_TIMEOUT,
+        rate_limiter=None,
+        record_exchanges=False,
+        log_sample_rate=1.0,
+        api_url=None,
+    ):
         self.api_cid = api_cid
+        # Any object with an `acquire(endpoint)` method blocking until the
+        # call is allowed
+        self.rate_limiter = rate_limiter
         self.api_secret = api_secret
-        # We'll store raw xml request/responses in this properties
-        self.yun_last_request = False
-        self.yun_last_response = False
-        self.url = YUNEXPRESS_API_URL["prod"] if prod else YUNEXPRESS_API_URL["test"]
-        self.headers = {
-            "Content-Type": "application/json;charset=UTF-8",
-            "Accept": "application/json",
-        }
+        # API calls waiting to be recorded by the carrier (`debug_logging`).
+        # Failed calls are always kept, the rest according to the sample rate.
+        self.record_exchanges = record_exchanges
+        self.log_sample_rate = log_sample_rate
+        self.exchanges = deque(maxlen=YUNEXPRESS_EXCHANGES_BUFFER)
+        # The API can be served from elsewhere (i.e.: a local simulator)
+        self.url = api_url or (
+            YUNEXPRESS_API_URL["prod"] if prod else YUNEXPRESS_API_URL["test"]
+        )
+        self.cne_print_url = (
+            api_url + "/CnePrint" if api_url else YUNEXPRESS_CNE_PRINT_URL
+        )
+        self.timeout = timeout
+        self.breaker = get_breaker(api_cid, prod)
         self.api_token = self.get_api_token()
-
+        self.session = get_session(
+            self.api_cid,
+            self.api_token,
+            prod=prod,
+            pool_connections=pool_connections,
+            pool_maxsize=pool_maxsize,
+        )
 
     def get_api_token(self):
         token = self.api_cid + "&" + self.api_secret
-        print("Yun token: ", token)
-        print("Yun cid: ", self.api_cid)
-        print("Yun secret: ", self.api_secret)
         base64_token = base64.b64encode(token.encode('utf-8')).decode('utf-8')
         return base64_token
 
-    @staticmethod
-    def _format_error(error):
-        """Common method to format error outputs
+    def _call(self, endpoint, method, url, **kwargs):
+        """Call the API through the pooled session. Transient errors (network
+        errors, 5xx and throttling) are retried with jittered exponential
+        backoff according to the endpoint retry policy, and they're accounted
+        in the circuit breaker of the account.
 
-        :param zeep.objects.ArrayOfErrorResult error: Error response or None
-        :return list: List of tuples with errors (code, description)
-        """
-        if not error:
-            return []
-        return [(x.ErrorCode, x.ErrorMessage) for x in error.ErrorResult]
+        Every attempt takes a token from the rate limiter first, if any.
 
-    @staticmethod
-    def _format_document(documents):
-        """Common method to format document outputs
-
-        :param list document: List of documents
+        :param str endpoint: Endpoint name of the retry policy
+        :param str method: HTTP method
+        :param str url: Request url
+        :raises YUNExpressUnavailable: When the circuit is open
+        :return requests.Response: Last response
         """
-        if not documents:
-            return []
-        return [(x.FileName, x.FileContent) for x in documents.Document]
+        kwargs.setdefault("timeout", self.timeout)
+        started = time.time()
+        try:
+            response = self._call_with_retries(endpoint, method, url, **kwargs)
+        except Exception as e:
+            self._log_exchange(endpoint, method, url, kwargs, started, None, e)
+            raise
+        self._log_exchange(endpoint, method, url, kwargs, started, response)
+        return response
+
+    def _call_with_retries(self, endpoint, method, url, **kwargs):
+        """Apply the retry policy and the circuit breaker to the call. Every
+        way out settles the breaker, so a probe is never left pending.
+        """
+        attempts, retry = YUNEXPRESS_RETRY_POLICIES.get(
+            endpoint, YUNEXPRESS_RETRY_DEFAULT
+        )
+        self.breaker.before_call()
+        settled = False
+        try:
+            for attempt in range(attempts):
+                if attempt:
+                    self.breaker.retry()
+                    time.sleep(
+                        random.uniform(
+                            0,
+                            min(
+                                YUNEXPRESS_BACKOFF_MAX,
+                                YUNEXPRESS_BACKOFF_BASE * 2**attempt,
+                            ),
+                        )
+                    )
+                if self.rate_limiter:
+                    self.rate_limiter.acquire(endpoint)
+                try:
+                    response = self.session.request(method, url, **kwargs)
+                except (requests.ConnectionError, requests.Timeout) as e:
+                    error = "{}: {}".format(endpoint, e)
+                    if not retry or attempt == attempts - 1:
+                        settled = True
+                        self.breaker.failure(error)
+                        raise
+                    _logger.warning("Yun Express %s failed, retrying: %s", endpoint, e)
+                    continue
+                except requests.RequestException as e:
+                    # Broken bodies, bad urls... aren't worth a retry
+                    settled = True
+                    self.breaker.failure("{}: {}".format(endpoint, e))
+                    raise
+                if response.status_code not in YUNEXPRESS_RETRY_STATUSES:
+                    settled = True
+                    self.breaker.success()
+                    return response
+                error = "{}: HTTP {}".format(endpoint, response.status_code)
+                if not retry or attempt == attempts - 1:
+                    break
+                _logger.warning("Yun Express %s failed, retrying: %s", endpoint, error)
+            settled = True
+            self.breaker.failure(error)
+            return response
+        finally:
+            if not settled:
+                self.breaker.release()
+
+    def _log_exchange(
+        self, endpoint, method, url, kwargs, started, response, error=None
+    ):
+        """Log the API call. The summary goes to the DEBUG level and, when
+        the carrier records them, the redacted exchange is buffered. Failed
+        calls are always logged, the rest are sampled.
+        """
+        status = response.status_code if response is not None else repr(error)
+        failed = response is None or response.status_code >= 400
+        if not failed and random.random() >= self.log_sample_rate:
+            return
+        elapsed = time.time() - started
+        _logger.log(
+            logging.WARNING if failed else logging.DEBUG,
+            "Yun Express %s %s: %s in %.0fms",
+            method,
+            endpoint,
+            status,
+            elapsed * 1000,
+        )
+        if not self.record_exchanges and not _logger.isEnabledFor(logging.DEBUG):
+            return
+        body = ""
+        if response is not None:
+            body = (
+                "<{} bytes>".format(len(response.content))
+                if endpoint == "download"
+                else response.text
+            )
+            # The secrets must not leak, even if they're echoed back
+            for secret in (self.api_secret, self.api_token):
+                if secret:
+                    body = body.replace(secret, YUNEXPRESS_REDACTED)
+        exchange = Exchange(
+            endpoint,
+            method,
+            url,
+            {
+                key: kwargs[key]
+                for key in ("params", "json", "data", "headers")
+                if kwargs.get(key) is not None
+            },
+            status,
+            elapsed,
+            body,
+        )
+        _logger.debug("%s", exchange)
+        if self.record_exchanges:
+            self.exchanges.append(exchange)
 
-    def _credentials(self):
-        """Get the credentials in the API expected format.
+    def pop_exchanges(self):
+        """Take the buffered exchanges
 
-        :return dict: Credentials keys and values
+        :return list: `Exchange` objects in call order
         """
-        return {
-        }
+        exchanges = []
+        while True:
+            try:
+                exchanges.append(self.exchanges.popleft())
+            except IndexError:
+                return exchanges
+
+    def _post(self, endpoint, url, **kwargs):
+        """POST through the pooled session"""
+        return self._call(endpoint, "POST", url, **kwargs)
+
+    def _get(self, endpoint, url, **kwargs):
+        """GET through the pooled session"""
+        return self._call(endpoint, "GET", url, **kwargs)
+
+    def get_secret(self, timestamp):
+        """MD5 signature of the EmsData API calls
+
+        :param str timestamp: Request timestamp in milliseconds
+        :return str: Signature
+        """
+        combined = (self.api_cid + timestamp + self.api_secret).encode("utf-8")
+        return hashlib.md5(combined).hexdigest().lower()
 
     # API Methods
 
@@ -88,19 +550,13 @@ class YUNExpressRequest:
             "TimeStamp": timestamp,
             "MD5": secret
         }
-        response = requests.post(url, headers=self.headers, json=data)
-        print(response.text)
-        return response.json()
-        if response.status_code != 200:
-            raise Exception("Error in request")
-        if response.json().get("ErrorCode") != 0:
-            raise Exception("Error in response")
-        return response.json().get("Data")
+        response = self._post("EmsKindList", url, json=data)
+        return ApiResponse.from_response(response)
 
     # cne print
     #@link https://apifox.com/apidoc/shared/6eba6d59-905d-4587-810b-607358a30aa3/doc-2909537
     def cneprint(self, cnos, ptemp="label10x10_1"):
-        url = "https://label.cne.com/CnePrint"
+        url = self.cne_print_url
         timestamp = str(int(time.time()*1000))
         combined = (self.api_cid + cnos + self.api_secret).encode('utf-8')
         # lowercase
@@ -114,13 +570,16 @@ class YUNExpressRequest:
             "cNos": cnos,
             "ptemp": ptemp,
         }
-        response = requests.get(url, params=data)
+        # The CNE print service is a different host, don't leak our token
+        response = self._get(
+            "CnePrint", url, params=data, headers={"Authorization": None}
+        )
         if response.status_code != 200:
             raise Exception("Error in request")
-        if response.json().get("ErrorCode") != 0:
+        data = ApiResponse.from_response(response).data
+        if data.get("ErrorCode") != 0:
             raise Exception("Error in response")
-        return response.json().get("Data")
-
+        return data.get("Data")
 
     def manifest_shipping(self, pickings, shipping_values):
         """Create shipping with the proper picking values
@@ -131,86 +590,56 @@ class YUNExpressRequest:
             list: Document url
             str: Shipping code
         """
-
-        headers = {
-            "Content-Type": "application/json;charset=UTF-8",
-            "Accept": "application/json",
-            "Authorization": "Basic " + self.api_token
-        }
-        print(headers)
-        # Generate the secret key for the API
-        url = self.url + "/api/WayBill/CreateOrder"
-        timestamp = str(int(time.time()*1000))
-
-        print("Yun url" + url)
-
-        data = [
-            shipping_values
-        ]
-
-        print(data)
-
-        response = requests.post(url, headers=headers, json=data)
-
-        # logging
-        _logger.info("Request URL: %s", url)
-        _logger.info("Request Headers: %s", headers)
-        _logger.info("Request Data: %s", data)
-        _logger.info("Response Status Code: %s", response.status_code)
-        _logger.info("Response Headers: %s", response.headers)
-        _logger.info("Response Data: %s", response.text)
-
-        print("Request Data: ", response.text)
-        print("Request URL: ", url)
-        print("Request Headers: ", headers)
-        print("Request Data: ", data)
-        print("Response Status Code: ", response.status_code)
-
-        cNo = ""
-        printUrl = ""
-
-        # check the response status code and response data
-        if response.status_code != 200:
-            raise Exception("Error in request")
-        if response.json().get("Code") == "1001":
-            # if the item[0] Remark include "重复"
-            print("Error in response")
-            print("Error in response: ", response.json().get("Item"))
-            if "重复" in response.json().get("Item")[0].get("Remark"):
-                print("Shipping code already exists")
-                try:
-                    yun_status, yun_order = self.get_order_details(shipping_code=shipping_values["CustomerOrderNumber"])
-                    print("Yun order: ", yun_order)
-                    print("Yun order Code: ", yun_order["Code"])
-                    if str(yun_order['Code']) == "0000":
-                        print("Shipping code already exists: ", yun_order['Item']["WayBillNumber"])
-                        cNo = yun_order['Item']["WayBillNumber"]
-                except Exception as e:
-                    print("Error in get order details: ", e)
-                    raise Exception("Error in get order details")
-        # 
-        if response.json().get("Code") == "0000":
-            print("Success in response")
-            print("Success in response: ", response.json().get("Item"))
-            cNo = response.json().get("Item")[0].get("WayBillNumber")
-                
+        order_number = shipping_values["CustomerOrderNumber"]
+        order = self.create_orders([shipping_values]).get(order_number)
+        if not order or not order.waybill_number:
+            raise Exception(
+                "Error in response: {}".format(order.remark if order else "")
+            )
         try:
-            printUrlInfo = self.get_documents_multi(shipping_codes=shipping_values["CustomerOrderNumber"])
-            printUrl = printUrlInfo.get("Item")[0].get("Url")
+            documents = self.get_documents_multi(shipping_codes=order_number)
         except Exception as e:
-            print("Error in get documents: ", e)
+            _logger.warning("Yun Express documents of %s failed: %s", order_number, e)
             raise Exception("Error in get documents")
-
-        print("PrintUrlInfo: ", printUrlInfo)
-        
-        print("cNo: ", cNo)
-        print("PrintUrl: ", printUrl)
-
         return (
             "1",
-            printUrl,
-            cNo,
+            documents[0].url if documents else "",
+            order.waybill_number,
+        )
+
+    def create_orders(self, shipping_values_list):
+        """Create several shippings in a single CreateOrder call. The API
+        accepts an array of orders and answers with one item per order.
+
+        :param list shipping_values_list: Shipping values prepared from Odoo
+        :return dict: `OrderResult` by CustomerOrderNumber. Orders that
+            already existed get their waybill number from GetOrder and are
+            flagged as `duplicated`.
+        """
+        url = self.url + "/api/WayBill/CreateOrder"
+        response = self._post("CreateOrder", url, json=shipping_values_list)
+        _logger.debug(
+            "CreateOrder batch of %s orders: %s",
+            len(shipping_values_list),
+            response.status_code,
         )
+        if response.status_code != 200:
+            raise Exception("Error in request")
+        items = {}
+        for index, item in enumerate(ApiResponse.from_response(response).item or []):
+            order = OrderResult.from_item(
+                item,
+                index < len(shipping_values_list)
+                and shipping_values_list[index]["CustomerOrderNumber"],
+            )
+            if order.is_duplicate:
+                _errors, detail = self.get_order_details(order.order_number)
+                if detail and detail.waybill_number:
+                    order.waybill_number = detail.waybill_number
+                    order.tracking_number = detail.tracking_number
+                    order.duplicated = True
+            items[order.order_number] = order
+        return items
 
     def get_order_details(self, shipping_code):
         """Get order details by shipping code. Maps to API's GetOrderDetails.
@@ -218,22 +647,19 @@ class YUNExpressRequest:
         :param str shipping_code: Shipping code
         :return tuple: contents of tuple:
             list: error codes in the form of tuples (code, descriptions)
-            list: of OrderedDict with order details
+            OrderDetail: order details or None
         """
         url = self.url + "/api/WayBill/GetOrder"
-        
-        headers = {
-            "Content-Type": "application/json;charset=UTF-8",
-            "Accept": "application/json",
-            "Authorization": "Basic " + self.api_token
-        }
 
         data = {
             "OrderNumber": shipping_code,
         }
-        response = requests.post(url, headers=headers, json=data)
-        print(response.json())
-        return (response.status_code, response.json())
+        response = ApiResponse.from_response(
+            self._post("GetOrder", url, json=data)
+        )
+        if not response.ok or not response.item:
+            return response.errors() or [("-", "No order")], None
+        return [], OrderDetail.from_item(response.item)
 
     def get_tracking(self, shipping_code):
         """Gather tracking status of shipping code. Maps to API's GetTracking.
@@ -241,35 +667,16 @@ class YUNExpressRequest:
         :param str shipping_code: Shipping code
         :return tuple: contents of tuple:
             list: error codes in the form of tuples (code, descriptions)
-            list: of OrderedDict with statuses
+            TrackingInfo: tracking status and events
         """
         url = self.url + "/api/Tracking/GetTrackAllInfo"
-        headers = {
-            "Content-Type": "application/json;charset=UTF-8",
-            "Accept": "application/json",
-            "Authorization": "Basic " + self.api_token
-        }
         data = {
             "OrderNumber": shipping_code  
         }
-        response = requests.post(url, headers=headers, json=data)
-        print(response.text)
-        return (response.status_code, response.text)
-
-    def get_documents(self, shipping_code):
-        """Get shipping documents (label)
-
-        :param str shipping_code: Shipping code
-        :return tuple: tuple containing:
-            list: error codes in the form of tuples (code, descriptions)
-            list: documents in the form of tuples (file_content, file_name)
-        """
-        values = dict(self._credentials(), ShippingCode=shipping_code)
-        response = self.client.service.GetDocuments(**values)
-        return (
-            self._format_error(response.ErrorCodes),
-            self._format_document(response.Documents),
+        response = ApiResponse.from_response(
+            self._post("GetTrackAllInfo", url, json=data)
         )
+        return response.errors(), TrackingInfo.from_item(response.item)
 
     def get_documents_multi(
         self,
@@ -281,7 +688,8 @@ class YUNExpressRequest:
     ):
         """Get shipping codes documents
 
-        :param str shipping_codes: shipping codes separated by ;
+        :param str|list shipping_codes: shipping code or list of them. Several
+            codes are printed in the same document.
         :param str document_code: Document code, defaults to LASER_MAIN_ES
         :param str model_code: (SINGLE|MULTI1|MULTI3|MULTI4), defaults to SINGLE
             - SINGLE: Thermical single label printer
@@ -290,97 +698,142 @@ class YUNExpressRequest:
             - MULTI4: Landscape 4 labels per sheet
         :param str kind_code: (PDF|PNG|BMP), defaults to PDF
         :param int offset: Document offset, defaults to 0
-        :return tuple: tuple containing:
-            list: error codes in the form of tuples (code, descriptions)
-            list: documents in the form of tuples (file_content, file_name)
+        :return list: `LabelResult` documents
         """
         url = self.url + "/api/Label/Print"
-        print("Yun Label Print url" + url)
-        data = [
-            shipping_codes,
-        ]
-            
-        headers = {
-            "Content-Type": "application/json;charset=UTF-8",
-            "Accept": "application/json",
-            "Authorization": "Basic " + self.api_token
+        if isinstance(shipping_codes, str):
+            shipping_codes = [shipping_codes]
+        params = {
+            "DocumentCode": document_code,
+            "ModelCode": model_code,
+            "KindCode": kind_code,
+            "Offset": offset,
         }
-        response = requests.post(url, headers=headers, json=data)
-        if response.status_code != 200:
+        response = ApiResponse.from_response(
+            self._post("Label/Print", url, params=params, json=list(shipping_codes))
+        )
+        if response.status != 200:
             raise Exception("Error in request")
-        if response.json().get("Code") != "0000":
-            raise Exception("Error in response" + response.json())
-        return response.json()
+        if not response.ok:
+            raise Exception("Error in response {} - {}".format(*response.errors()[0]))
+        return [LabelResult.from_item(item) for item in response.item or []]
 
-    def get_service_types(self):
-        """Gets the hired service types. Maps to API's GetServiceTypes.
+    def download(self, url):
+        """Download a document served by Yun Express (i.e.: a label url)
 
-        :return tuple: contents of tuple:
-            list: error codes in the form of tuples (code, descriptions)
-            list: list of tuples (service_code, service_description):
+        :param str url: Document url
+        :return bytes: Document content
         """
-        return self.emskindlist()
+        # Documents are served from another host, don't leak our token
+        response = self._get("download", url, headers={"Authorization": None})
+        if response.status_code != 200:
+            raise Exception("Error in request")
+        return response.content
 
-    def cancel_shipping(self, shipping_code):
-        """Cancel a shipping by code
+    def get_shipping_methods(self, country_code=None):
+        """Get the shipping methods (channels). Maps to API's
+        GetShippingMethods.
 
-        :param str shipping_code: Shipping code
-        :return str: Error codes
+        :param str country_code: Only the methods covering this destination
+        :return list: Shipping methods items (Code, CName, EName...)
         """
-        values = dict(self._credentials(), ShippingCode=shipping_code)
-        response = self.client.service.CancelShipping(**values)
-        return [(x.ErrorCode, x.ErrorMessage) for x in response]
+        url = self.url + "/api/Common/GetShippingMethods"
+        params = {"CountryCode": country_code} if country_code else None
+        response = ApiResponse.from_response(
+            self._get("GetShippingMethods", url, params=params)
+        )
+        if response.status != 200:
+            raise Exception("Error in request")
+        return response.data.get("Items") or []
 
-    def report_shipping(
-        self, process_code="ODOO", document_type="XLSX", from_date=None, to_date=None
-    ):
-        """Get the shippings manifest. Mapped to API's ReportShipping
+    def get_service_types(self):
+        """Gets the hired service types. Maps to API's EmsKindList.
 
-        :param str process_code: (ODOO|MAGENTO|PRESTASHOP), defaults to "ODOO"
-        :param str document_type: Report type, defaults to "XLSX" (PDF|XLSX)
-        :param str from_date: Date from "yyyy-mm-dd", defaults to None.
-        :param str to_date: Date to "yyyy-mm-dd", defaults to None.
-        :return tuple: tuple containing:
+        :return tuple: contents of tuple:
             list: error codes in the form of tuples (code, descriptions)
-            list: documents in the form of tuples (file_content, file_name)
+            list: list of tuples (service_code, service_description):
+        """
+        response = self.emskindlist()
+        services = [
+            (service.get("oName"), service.get("cName") or service.get("oName"))
+            for service in response.data.get("List") or []
+            if service.get("oName")
+        ]
+        errors = response.errors()
+        if not errors and not services:
+            errors = [("-", "No services")]
+        return errors, services
+
+    def cancel_shipping(self, shipping_code, remark=None):
+        """Cancel a shipping by waybill number. Orders Yun Express hasn't
+        received yet are deleted and the ones already received are
+        intercepted. Delete and Intercept API's mapping.
+
+        :param str shipping_code: Waybill number
+        :param str remark: Interception reason
+        :return list: error codes in the form of tuples (code, descriptions)
         """
-        values = dict(
-            self._credentials(),
-            ProcessCode=process_code,
-            DocumentKindCode=document_type,
-            FromDate=from_date,
-            ToDate=to_date,
+        data = {
+            "OrderType": YUNEXPRESS_ORDER_TYPE_WAYBILL,
+            "OrderNumber": shipping_code,
+        }
+        response = ApiResponse.from_response(
+            self._post("Delete", self.url + "/api/WayBill/Delete", json=data)
         )
-        response = self.client.service.ReportShipping(**values)
-        return (
-            self._format_error(response.ErrorCodes),
-            self._format_document(response.Documents),
+        if response.ok:
+            return []
+        if response.code != YUNEXPRESS_DELETE_RECEIVED_CODE:
+            return response.errors()
+        response = ApiResponse.from_response(
+            self._post(
+                "Intercept",
+                self.url + "/api/WayBill/Intercept",
+                json=dict(data, Remark=remark or "Cancelled"),
+            )
         )
+        return response.errors()
 
     def validate_user(self):
+        """Check the account credentials
 
-        return self.emskindlist()
+        :return list: error codes in the form of tuples (code, descriptions)
+        """
+        return self.emskindlist().errors()
 
 
+    def get_tracking_numbers(self, shipping_codes):
+        """Get the tracking numbers of many orders in a single call. The API
+        takes up to `YUNEXPRESS_TRACKING_NUMBER_CHUNK` comma separated codes.
+
+        :param list shipping_codes: Customer order numbers
+        :return tuple: tuple containing:
+            list: Error codes
+            dict: `TrackingNumberResult` by customer order number
+        """
+        url = self.url + "/api/Waybill/GetTrackingNumber"
+        params = {"CustomerOrderNumber": ",".join(shipping_codes)}
+        response = ApiResponse.from_response(
+            self._get("GetTrackingNumber", url, params=params)
+        )
+        items = response.item or []
+        if isinstance(items, dict):
+            items = [items]
+        results = {}
+        for item in items:
+            result = TrackingNumberResult.from_item(item)
+            results[result.order_number] = result
+        return response.errors(), results
+
     def create_request(self, shipping_code):
-        """Create a shipping pickup request. CreateRequest API's mapping.
+        """Create a shipping pickup request. GetTrackingNumber API's mapping.
 
-        :param datetime.date delivery_date: Delivery date
-        :param str min_hour: Minimum pickup hour in format "HH:MM"
-        :param str max_hour: Maximum pickup hour in format "HH:MM"
+        :param str shipping_code: Customer order number
         :return tuple: tuple containing:
             list: Error codes
             str: Request shipping code
         """
-        url = self.url + "/api/Waybill/GetTrackingNumber"
-        headers = {
-            "Content-Type": "application/json;charset=UTF-8",
-            "Accept": "application/json",
-            "Authorization": "Basic " + self.api_token
-        }
-        data = {
-            "CustomerOrderNumber": shipping_code,
-        }
-        response = requests.get(url, headers=headers, json=data)
-        print(response.text)
-        return (response.status_code, response.text)
+        errors, results = self.get_tracking_numbers([shipping_code])
+        return (
+            errors,
+            ", ".join(result.tracking_number or "" for result in results.values()),
+        )
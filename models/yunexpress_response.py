@@ -0,0 +1,243 @@
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+"""Typed results of the Yun Express API. Every response body is decoded once
+and mapped into compact objects, so the callers get the same contract whatever
+the endpoint.
+"""
+import json
+import logging
+
+_logger = logging.getLogger(__name__)
+
+try:
+    import orjson
+
+    loads = orjson.loads
+except (ImportError, IOError) as err:
+    _logger.debug(err)
+    loads = json.loads
+
+# Code of the successful REST responses
+YUNEXPRESS_SUCCESS_CODE = "0000"
+
+
+class ApiResponse:
+    """Decoded API response. The REST API answers with `Code` and `Message`
+    while the EmsData API uses `ReturnValue` and `cMess`: both are normalised
+    into `code` and `message`.
+    """
+
+    __slots__ = ("status", "code", "message", "data")
+
+    def __init__(self, status, data):
+        self.status = status
+        self.data = data if isinstance(data, dict) else {}
+        if "ReturnValue" in self.data:
+            self.code = str(self.data["ReturnValue"])
+            self.message = self.data.get("cMess") or ""
+        else:
+            self.code = str(self.data.get("Code") or "")
+            self.message = self.data.get("Message") or ""
+
+    @classmethod
+    def from_response(cls, response):
+        """Decode a `requests` response body once
+
+        :param requests.Response response: API response
+        :return ApiResponse: Decoded response. A body which isn't JSON gives
+            an empty payload
+        """
+        try:
+            data = loads(response.content) if response.content else {}
+        except ValueError:
+            data = {}
+        return cls(response.status_code, data)
+
+    @property
+    def ok(self):
+        if self.status != 200:
+            return False
+        if "ReturnValue" in self.data:
+            try:
+                return int(self.data["ReturnValue"] or 0) > 0
+            except (TypeError, ValueError):
+                return False
+        return self.code == YUNEXPRESS_SUCCESS_CODE
+
+    @property
+    def item(self):
+        return self.data.get("Item")
+
+    def errors(self):
+        """Errors in the form `_yun_check_error` expects
+
+        :return list: tuples of (code, message). Empty when the call went fine
+        """
+        if self.ok:
+            return []
+        if self.status != 200:
+            return [("HTTP {}".format(self.status), self.message or "")]
+        return [(self.code or "-", self.message)]
+
+
+class OrderResult:
+    """CreateOrder item"""
+
+    __slots__ = (
+        "order_number",
+        "waybill_number",
+        "tracking_number",
+        "success",
+        "remark",
+        "duplicated",
+    )
+
+    def __init__(
+        self,
+        order_number,
+        waybill_number=False,
+        tracking_number=False,
+        success=False,
+        remark="",
+        duplicated=False,
+    ):
+        self.order_number = order_number
+        self.waybill_number = waybill_number
+        self.tracking_number = tracking_number
+        self.success = success
+        self.remark = remark
+        self.duplicated = duplicated
+
+    @classmethod
+    def from_item(cls, item, order_number=False):
+        return cls(
+            item.get("CustomerOrderNumber") or order_number,
+            waybill_number=item.get("WayBillNumber") or False,
+            tracking_number=item.get("TrackingNumber") or False,
+            success=item.get("Success") in (1, True),
+            remark=item.get("Remark") or "",
+        )
+
+    @property
+    def is_duplicate(self):
+        """The order was already created"""
+        return not self.waybill_number and "重复" in self.remark
+
+
+class OrderDetail:
+    """GetOrder item"""
+
+    __slots__ = ("order_number", "waybill_number", "tracking_number", "status")
+
+    def __init__(self, order_number, waybill_number, tracking_number, status):
+        self.order_number = order_number
+        self.waybill_number = waybill_number
+        self.tracking_number = tracking_number
+        self.status = status
+
+    @classmethod
+    def from_item(cls, item):
+        return cls(
+            item.get("CustomerOrderNumber") or False,
+            item.get("WayBillNumber") or False,
+            item.get("TrackingNumber") or False,
+            item.get("Status"),
+        )
+
+
+class TrackingNumberResult:
+    """GetTrackingNumber item"""
+
+    __slots__ = ("order_number", "waybill_number", "tracking_number")
+
+    def __init__(self, order_number, waybill_number, tracking_number):
+        self.order_number = order_number
+        self.waybill_number = waybill_number
+        self.tracking_number = tracking_number
+
+    @classmethod
+    def from_item(cls, item):
+        return cls(
+            item.get("CustomerOrderNumber") or False,
+            item.get("WayBillNumber") or False,
+            item.get("TrackingNumber") or False,
+        )
+
+
+class LabelInfo:
+    """Label of an order inside a Label/Print document"""
+
+    __slots__ = ("waybill_number", "order_number", "error")
+
+    def __init__(self, waybill_number, order_number, error):
+        self.waybill_number = waybill_number
+        self.order_number = order_number
+        self.error = error
+
+    @classmethod
+    def from_item(cls, item):
+        return cls(
+            item.get("WayBillNumber") or False,
+            item.get("CustomerOrderNumber") or False,
+            item.get("ErrorBody") or False,
+        )
+
+
+class LabelResult:
+    """Label/Print document. Without `infos`, the document holds every
+    requested label.
+    """
+
+    __slots__ = ("url", "infos")
+
+    def __init__(self, url, infos):
+        self.url = url
+        self.infos = infos
+
+    @classmethod
+    def from_item(cls, item):
+        return cls(
+            item.get("Url") or False,
+            [LabelInfo.from_item(info) for info in item.get("LabelPrintInfos") or []],
+        )
+
+
+class TrackingEvent:
+    """Tracking event (OrderTrackingDetails item)"""
+
+    __slots__ = ("date", "content", "location")
+
+    def __init__(self, date, content, location):
+        self.date = date
+        self.content = content
+        self.location = location
+
+    @classmethod
+    def from_item(cls, item):
+        return cls(
+            item.get("ProcessDate") or "",
+            item.get("ProcessContent") or "",
+            item.get("ProcessLocation") or "",
+        )
+
+
+class TrackingInfo:
+    """GetTrackAllInfo item, also sent by the tracking pushes"""
+
+    __slots__ = ("waybill_number", "package_state", "events")
+
+    def __init__(self, waybill_number, package_state, events):
+        self.waybill_number = waybill_number
+        self.package_state = package_state
+        self.events = events
+
+    @classmethod
+    def from_item(cls, item):
+        item = item or {}
+        return cls(
+            item.get("WaybillNumber") or item.get("WayBillNumber") or False,
+            item.get("PackageState"),
+            [
+                TrackingEvent.from_item(event)
+                for event in item.get("OrderTrackingDetails") or []
+            ],
+        )
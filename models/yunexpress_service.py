@@ -0,0 +1,13 @@
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+from odoo import fields, models
+
+
+class YunExpressService(models.Model):
+    _name = "yunexpress.service"
+    _description = "Yun Express services allowed per account"
+    _order = "api_cid, code"
+
+    api_cid = fields.Char(string="API Client ID", required=True, index=True)
+    prod_environment = fields.Boolean()
+    code = fields.Char(required=True)
+    name = fields.Char(required=True)
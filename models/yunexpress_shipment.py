@@ -0,0 +1,211 @@
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+from odoo import api, fields, models
+from odoo.tools.sql import create_index
+
+# Manifest rows read at once
+YUNEXPRESS_MANIFEST_PAGE = 2000
+
+
+class YunExpressShipment(models.Model):
+    """Ledger of the shipments sent to Yun Express. Every completed stage is
+    recorded, so a failed or crashed dispatch resumes from the last one without
+    repeating its API calls.
+    """
+
+    _name = "yunexpress.shipment"
+    _description = "Yun Express shipment"
+    _order = "id desc"
+
+    name = fields.Char(string="Customer order number", required=True, index=True)
+    carrier_id = fields.Many2one(
+        comodel_name="delivery.carrier", required=True, ondelete="cascade", index=True
+    )
+    # The ledger is written in its own transaction, where the picking may not
+    # exist yet: it's linked by order number instead of a foreign key
+    picking_id = fields.Many2one(
+        comodel_name="stock.picking",
+        compute="_compute_picking_id",
+        search="_search_picking_id",
+    )
+    stage = fields.Selection(
+        selection=[
+            ("created", "Order created"),
+            ("labeled", "Label obtained"),
+            ("stored", "Label stored"),
+            ("cancelled", "Cancelled"),
+        ],
+        required=True,
+        default="created",
+    )
+    waybill_number = fields.Char(index=True)
+    api_cid = fields.Char(string="API Client ID")
+    ship_date = fields.Datetime(help="When the order was created in Yun Express")
+    label_url = fields.Char()
+    label_position = fields.Integer(help="Label position in the url document")
+    label_count = fields.Integer(help="Labels in the url document")
+    label_checksum = fields.Char(help="Checksum of the stored label attachment")
+
+    _sql_constraints = [
+        ("name_uniq", "unique(name)", "The customer order number must be unique"),
+    ]
+
+    def _compute_picking_id(self):
+        pickings = {
+            picking.yunexpress_order_number: picking
+            for picking in self.env["stock.picking"].search(
+                [("yunexpress_order_number", "in", self.mapped("name"))]
+            )
+        }
+        for shipment in self:
+            shipment.picking_id = pickings.get(shipment.name)
+
+    def _search_picking_id(self, operator, value):
+        # Searched by name from the views
+        field = "name" if isinstance(value, str) else "id"
+        pickings = self.env["stock.picking"].search(
+            [(field, operator, value), ("yunexpress_order_number", "!=", False)]
+        )
+        return [("name", "in", pickings.mapped("yunexpress_order_number"))]
+
+    def _auto_init(self):
+        res = super()._auto_init()
+        # Manifests read the shipments of an account and carriers in a range
+        create_index(
+            self.env.cr,
+            "yunexpress_shipment_manifest_index",
+            self._table,
+            ["api_cid", "carrier_id", "ship_date"],
+        )
+        return res
+
+    @api.model
+    def _manifest_rows(self, api_cid, carrier_ids, date_from, date_to):
+        """Shipments of an account for the manifest. They're read page by page
+        with a keyset, so the whole range is never held in memory.
+
+        :param str api_cid: Yun Express API Client ID
+        :param list carrier_ids: `delivery.carrier` ids of the account
+        :param datetime date_from: Ship date from (included)
+        :param datetime date_to: Ship date to (excluded)
+        :return generator: tuples of (ship date, customer order number, waybill
+            number, picking, channel, recipient, country, zip, city, weight)
+        """
+        last = None
+        while True:
+            keyset = ""
+            params = [api_cid, tuple(carrier_ids), date_from, date_to]
+            if last:
+                keyset = "AND (s.ship_date, s.id) > (%s, %s)"
+                params += list(last)
+            self.env.cr.execute(
+                """
+                SELECT s.id, s.ship_date, s.name, s.waybill_number, sp.name,
+                    yc.code, rp.name, rc.code, rp.zip, rp.city, sp.shipping_weight
+                FROM yunexpress_shipment s
+                LEFT JOIN stock_picking sp ON sp.yunexpress_order_number = s.name
+                LEFT JOIN res_partner rp ON rp.id = sp.partner_id
+                LEFT JOIN res_country rc ON rc.id = rp.country_id
+                LEFT JOIN delivery_carrier dc ON dc.id = s.carrier_id
+                LEFT JOIN yunexpress_channel yc ON yc.id = dc.yunexpress_channel
+                WHERE s.api_cid = %s
+                    AND s.carrier_id IN %s
+                    AND s.ship_date >= %s
+                    AND s.ship_date < %s
+                    AND s.stage != 'cancelled'
+                    {}
+                ORDER BY s.ship_date, s.id
+                LIMIT {}
+                """.format(
+                    keyset, YUNEXPRESS_MANIFEST_PAGE
+                ),
+                params,
+            )
+            rows = self.env.cr.fetchall()
+            for row in rows:
+                yield row[1:]
+            if len(rows) < YUNEXPRESS_MANIFEST_PAGE:
+                return
+            last = (rows[-1][1], rows[-1][0])
+
+    @api.model
+    def _get_ledger(self, order_numbers):
+        """Ledger entries of the given orders
+
+        :param list order_numbers: Customer order numbers
+        :return dict: `yunexpress.shipment` records by customer order number
+        """
+        return {
+            shipment.name: shipment
+            for shipment in self.search([("name", "in", order_numbers)])
+        }
+
+    @api.model
+    def _get_stages(self, order_numbers):
+        """Completed stages of the given orders as plain values, so they can
+        be kept up to date along the dispatch. Cancelled orders are sent again
+        from scratch.
+
+        :param list order_numbers: Customer order numbers
+        :return dict: {customer order number: ledger values}
+        """
+        return {
+            name: {
+                "stage": shipment.stage,
+                "waybill_number": shipment.waybill_number,
+                "label_url": shipment.label_url,
+                "label_position": shipment.label_position,
+                "label_count": shipment.label_count,
+                "label_checksum": shipment.label_checksum,
+            }
+            for name, shipment in self._get_ledger(order_numbers).items()
+            if shipment.stage != "cancelled"
+        }
+
+    @api.model
+    def _checkpoint(self, vals_by_name):
+        """Record the completed stages in an independent transaction. The
+        orders exist in Yun Express whatever happens to the current one.
+        Mind that the current transaction won't see these changes.
+
+        :param dict vals_by_name: {customer order number: ledger values}
+        """
+        if not vals_by_name:
+            return
+        if self.env.registry.in_test_mode():
+            self._upsert(vals_by_name)
+            return
+        with self.env.registry.cursor() as cr:
+            self.with_env(self.env(cr=cr))._upsert(vals_by_name)
+        self.invalidate_model()
+
+    @api.model
+    def _upsert(self, vals_by_name):
+        ledger = self._get_ledger(list(vals_by_name))
+        to_create = []
+        for name, vals in vals_by_name.items():
+            if name in ledger:
+                ledger[name].write(vals)
+            else:
+                to_create.append(dict(vals, name=name))
+        self.create(to_create)
+
+    @api.model
+    def _label_documents(self, pickings, stages):
+        """Label documents we already got for the given pickings
+
+        :param recordset pickings: `stock.picking` recordset
+        :param dict stages: ledger values by picking id
+        :return list: tuples of (url, slots) with the pickings in the document
+            order (False for labels of other pickings)
+        """
+        documents = {}
+        for picking in pickings:
+            stage = stages[picking.id]
+            if stage["stage"] == "created" or not stage["label_url"]:
+                continue
+            slots = documents.setdefault(
+                stage["label_url"], [False] * max(stage["label_count"], 1)
+            )
+            if stage["label_position"] < len(slots):
+                slots[stage["label_position"]] = picking
+        return list(documents.items())
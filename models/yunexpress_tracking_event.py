@@ -0,0 +1,66 @@
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+import logging
+
+from odoo import api, fields, models
+from odoo.tools import split_every
+
+from .yunexpress_response import TrackingInfo, loads
+
+_logger = logging.getLogger(__name__)
+
+# Events applied (and committed) at once
+YUNEXPRESS_EVENTS_CHUNK = 1000
+
+
+class YunExpressTrackingEvent(models.Model):
+    _name = "yunexpress.tracking.event"
+    _description = "Yun Express pushed tracking event"
+    _order = "id"
+    _log_access = False
+
+    carrier_id = fields.Many2one(
+        comodel_name="delivery.carrier", required=True, ondelete="cascade"
+    )
+    tracking_ref = fields.Char(required=True, index=True)
+    payload = fields.Text(required=True)
+
+    def _apply(self):
+        """Apply the queued events to their pickings. Events come with the
+        whole tracking history, so only the last one for every tracking ref
+        matters.
+        """
+        last_events = {}
+        for event in self:
+            last_events[(event.carrier_id, event.tracking_ref)] = event
+        pickings = self.env["stock.picking"].search(
+            [
+                ("carrier_tracking_ref", "in", list({ref for _c, ref in last_events})),
+                ("delivery_type", "=", "yunexpress"),
+            ]
+        )
+        for carrier in pickings.carrier_id:
+            carrier_pickings = pickings.filtered(lambda x: x.carrier_id == carrier)
+            values = {}
+            for picking in carrier_pickings:
+                event = last_events.get((carrier, picking.carrier_tracking_ref))
+                if not event:
+                    continue
+                try:
+                    values[picking.id] = carrier._yunexpress_tracking_values(
+                        TrackingInfo.from_item(loads(event.payload))
+                    )
+                except ValueError:
+                    _logger.warning("Wrong tracking event %s", event.id)
+            carrier._yunexpress_write_trackings(
+                carrier_pickings.filtered(lambda x: x.id in values), values
+            )
+        self.unlink()
+
+    @api.model
+    def _cron_apply_events(self):
+        """Apply the pushed events in chunks"""
+        events = self.search([])
+        for chunk in split_every(YUNEXPRESS_EVENTS_CHUNK, events.ids, self.browse):
+            chunk._apply()
+            if not self.env.registry.in_test_mode():
+                self.env.cr.commit()  # pylint: disable=invalid-commit
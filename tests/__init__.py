@@ -1,2 +1,23 @@
 # Disabled as the provider's test environment isn't stable enough
 # from . import test_delivery_yunexpress
+from . import test_create_orders
+from . import test_labels
+from . import test_label_storage
+from . import test_tracking
+from . import test_tracking_push
+from . import test_client_cache
+from . import test_services
+from . import test_channel
+from . import test_shipment_ledger
+from . import test_request_resilience
+from . import test_rate_limit
+from . import test_dispatch
+from . import test_response
+from . import test_request_logging
+from . import test_payloads
+from . import test_benchmark
+from . import test_label_cache
+from . import test_manifest
+from . import test_pickup
+from . import test_cancel
+from . import test_async_request
@@ -0,0 +1,133 @@
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+from unittest.mock import patch
+
+from odoo.tests import TransactionCase
+from odoo.tools.config import config
+
+from ..models import yunexpress_request
+from ..models.yunexpress_rate_limit import PgTokenBucket
+from .yunexpress_simulator import YunExpressSimulator
+
+
+class YunExpressCase(TransactionCase):
+    """Yun Express delivery method pointed at the local simulator of the API"""
+
+    # The side transactions (shipment ledger, exchange logs...) run on the
+    # test cursor, so they're rolled back with the test
+    yunexpress_test_mode = True
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.simulator = YunExpressSimulator().start()
+        cls.addClassCleanup(cls.simulator.stop)
+        cls.startClassPatcher(
+            patch.dict(config.options, {"yunexpress_api_url": cls.simulator.url})
+        )
+        # The shared budget is tested on its own
+        cls.startClassPatcher(patch.object(PgTokenBucket, "acquire", lambda *a: None))
+        cls.env = cls.env(context=dict(cls.env.context, tracking_disable=True))
+        cls.records = cls._create_records(cls.env, "TEST")
+        cls.carrier = cls.records["carrier"]
+
+    def setUp(self):
+        super().setUp()
+        if self.yunexpress_test_mode and not self.registry.in_test_mode():
+            self.registry.enter_test_mode(self.cr)
+            self.addCleanup(self.registry.leave_test_mode)
+        self.simulator.reset()
+        # Every test starts with closed circuits
+        self.startPatcher(patch.dict(yunexpress_request._breakers, clear=True))
+
+    @classmethod
+    def _create_records(cls, env, code):
+        """Delivery method, channel, customer and products to ship
+
+        :param Environment env: Environment where they're created
+        :param str code: Account and channel code
+        :return dict: channel, carrier, partner and products records
+        """
+        channel = env["yunexpress.channel"].create(
+            {"code": code, "name": "{} channel".format(code)}
+        )
+        carrier = env["delivery.carrier"].create(
+            {
+                "name": "Yun Express {}".format(code),
+                "delivery_type": "yunexpress",
+                "product_id": env["product.product"]
+                .create({"type": "service", "name": "Yun Express {}".format(code)})
+                .id,
+                "yunexpress_api_cid": code,
+                "yunexpress_api_secret": "secret",
+                "yunexpress_channel": channel.id,
+            }
+        )
+        partner = env["res.partner"].create(
+            {
+                "name": "Yun Express customer",
+                "street": "Calle Mayor, 1",
+                "city": "Madrid",
+                "zip": "28001",
+                "email": "customer@example.com",
+                "country_id": env.ref("base.es").id,
+            }
+        )
+        products = env["product.product"].create(
+            [
+                {
+                    "type": "consu",
+                    "name": "Yun Express product {}".format(index),
+                    "declared_name_en": "Product {}".format(index),
+                    "declared_name_cn": "产品 {}".format(index),
+                    "declared_price": 10.0 + index,
+                }
+                for index in range(3)
+            ]
+        )
+        return {
+            "channel": channel,
+            "carrier": carrier,
+            "partner": partner,
+            "products": products,
+        }
+
+    def _create_pickings(self, size, records=None):
+        """Outgoing pickings of the delivery method
+
+        :param int size: Pickings to create
+        :param dict records: Records of `_create_records`, the class ones by
+            default
+        :return recordset: `stock.picking` records
+        """
+        records = records or self.records
+        env = records["carrier"].env
+        picking_type = env.ref("stock.picking_type_out")
+        location = picking_type.default_location_src_id
+        location_dest = env.ref("stock.stock_location_customers")
+        return env["stock.picking"].create(
+            [
+                {
+                    "partner_id": records["partner"].id,
+                    "picking_type_id": picking_type.id,
+                    "location_id": location.id,
+                    "location_dest_id": location_dest.id,
+                    "carrier_id": records["carrier"].id,
+                    "move_ids": [
+                        (
+                            0,
+                            0,
+                            {
+                                "name": product.name,
+                                "product_id": product.id,
+                                "product_uom": product.uom_id.id,
+                                "product_uom_qty": 1.0,
+                                "location_id": location.id,
+                                "location_dest_id": location_dest.id,
+                            },
+                        )
+                        for product in records["products"]
+                    ],
+                }
+                for _index in range(size)
+            ]
+        )
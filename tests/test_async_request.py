@@ -0,0 +1,101 @@
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+import time
+import unittest
+from unittest.mock import patch
+
+from odoo.tools.config import config
+
+from ..models import delivery_carrier, yunexpress_async_request, yunexpress_request
+from ..models.yunexpress_async_request import (
+    YUNExpressAsyncRequest,
+    aiohttp,
+    run_batch,
+)
+from ..models.yunexpress_request import YUNExpressRequest
+from .common import YunExpressCase
+from .yunexpress_simulator import EndpointScript
+
+
+@unittest.skipIf(aiohttp is None, "aiohttp isn't installed")
+class TestYunExpressAsyncRequest(YunExpressCase):
+    def setUp(self):
+        super().setUp()
+        self.startPatcher(
+            patch.object(yunexpress_async_request, "YUNEXPRESS_BACKOFF_BASE", 0)
+        )
+        self.client = YUNExpressAsyncRequest(
+            "ASYNC", "secret", concurrency=50, api_url=self.simulator.url
+        )
+        self.pickings = self._create_pickings(3)
+        self.carrier.yunexpress_send_shipping(self.pickings)
+        self.refs = self.pickings.mapped("carrier_tracking_ref")
+        self.simulator.reset()
+
+    def test_same_results(self):
+        """The results are the ones of the blocking client"""
+        client = YUNExpressRequest("ASYNC", "secret", api_url=self.simulator.url)
+        codes = self.pickings.mapped("yunexpress_order_number") + ["WH-UNKNOWN"]
+        results = run_batch(
+            self.client,
+            lambda c: [c.get_tracking(self.refs[0]), c.get_tracking_numbers(codes)],
+        )
+        errors, info = results[0]
+        expected_errors, expected_info = client.get_tracking(self.refs[0])
+        self.assertEqual(errors, expected_errors)
+        self.assertEqual(info.waybill_number, expected_info.waybill_number)
+        self.assertEqual(
+            [event.content for event in info.events],
+            [event.content for event in expected_info.events],
+        )
+        errors, numbers = results[1]
+        self.assertEqual(errors, [])
+        self.assertEqual(
+            {code: number.tracking_number for code, number in numbers.items()},
+            {
+                code: number.tracking_number
+                for code, number in client.get_tracking_numbers(codes)[1].items()
+            },
+        )
+
+    def test_fan_out(self):
+        """The calls are in flight at once"""
+        self.simulator.default = EndpointScript(latency=0.2)
+        started = time.time()
+        results = run_batch(
+            self.client, lambda c: [c.get_tracking(self.refs[0]) for _i in range(40)]
+        )
+        self.assertLess(time.time() - started, 40 * 0.2 / 4)
+        self.assertEqual(len(results), 40)
+        self.assertEqual(self.simulator.calls["GetTrackAllInfo"], 40)
+
+    def test_failures(self):
+        """Failed calls give their exception without failing the batch, and
+        the retries are accounted in the breaker shared with the blocking
+        client
+        """
+        self.simulator.script("GetTrackAllInfo", error_rate=1.0, error_status=503)
+        self.simulator.script("download", drop_rate=1.0)
+        results = run_batch(
+            self.client,
+            lambda c: [
+                c.get_tracking(self.refs[0]),
+                c.download(self.simulator.url + "/labels/unknown.pdf"),
+            ],
+        )
+        self.assertEqual(results[0][0][0][0], "HTTP 503")
+        self.assertIsInstance(results[1], Exception)
+        self.assertEqual(self.simulator.calls["GetTrackAllInfo"], 3)
+        breaker = yunexpress_request.get_breaker("ASYNC", False)
+        self.assertIs(self.client.breaker, breaker)
+        # Two retries of the tracking and two of the download
+        self.assertEqual(breaker.retries, 4)
+
+    def test_sync_trackings(self):
+        """The carrier sweeps with the asynchronous client beyond its threads"""
+        with patch.dict(
+            config.options, {"yunexpress_tracking_workers": 2}
+        ), patch.object(delivery_carrier, "run_batch", wraps=run_batch) as batch:
+            updated = self.carrier.yunexpress_sync_trackings(self.pickings)
+        batch.assert_called_once()
+        self.assertEqual(updated, self.pickings)
+        self.assertEqual(self.simulator.calls["GetTrackAllInfo"], 3)
@@ -0,0 +1,242 @@
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+"""Benchmark of the dispatch, label and tracking paths against the local
+simulator. It doesn't run with the standard tests:
+
+    odoo-bin -d db -i delivery_yunexpress --test-tags yunexpress_benchmark
+
+It's tuned with environment variables:
+
+- YUNEXPRESS_BENCH_SIZES: pickings per run (default "10,100,1000")
+- YUNEXPRESS_BENCH_LATENCY_MS: simulated API latency (default 50)
+- YUNEXPRESS_BENCH_JITTER_MS: latency jitter (default 10)
+- YUNEXPRESS_BENCH_MEMORY: trace the peak memory (default 1). Tracing slows the
+  runs down, set it to 0 to get raw timings.
+- YUNEXPRESS_BENCH_OUTPUT: file where the JSON report is written. Otherwise it
+  is logged.
+"""
+import json
+import logging
+import os
+import time
+import tracemalloc
+from unittest.mock import patch
+
+from odoo.modules.module import get_manifest
+from odoo.release import version
+from odoo.tests import tagged
+
+from ..models.yunexpress_async_request import YUNExpressAsyncRequest
+from ..models.yunexpress_request import YUNExpressRequest
+from .common import YunExpressCase
+from .yunexpress_simulator import EndpointScript
+
+_logger = logging.getLogger(__name__)
+
+
+def percentile(values, rank):
+    """Nearest-rank percentile
+
+    :param list values: Sorted values
+    :param int rank: Percentile from 0 to 100
+    :return float: Value or None when there are no values
+    """
+    if not values:
+        return None
+    return values[min(len(values) - 1, max(0, -(-len(values) * rank // 100) - 1))]
+
+
+@tagged("-standard", "-at_install", "post_install", "yunexpress_benchmark")
+class TestYunExpressBenchmark(YunExpressCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.sizes = [
+            int(size)
+            for size in os.environ.get("YUNEXPRESS_BENCH_SIZES", "10,100,1000").split(
+                ","
+            )
+        ]
+        cls.latency = float(os.environ.get("YUNEXPRESS_BENCH_LATENCY_MS", 50))
+        cls.jitter = float(os.environ.get("YUNEXPRESS_BENCH_JITTER_MS", 10))
+        cls.trace_memory = os.environ.get("YUNEXPRESS_BENCH_MEMORY", "1") != "0"
+        super().setUpClass()
+        cls.carrier.yunexpress_send_batch_size = 50
+        cls.products = cls.env["product.product"].create(
+            [
+                {
+                    "type": "consu",
+                    "name": "Benchmark product {}".format(index),
+                    "declared_name_en": "Product {}".format(index),
+                    "declared_name_cn": "产品 {}".format(index),
+                    "declared_price": 10.0 + index,
+                }
+                for index in range(20)
+            ]
+        )
+        cls.partner = cls.records["partner"]
+        cls.picking_type = cls.env.ref("stock.picking_type_out")
+        cls.results = []
+
+    def setUp(self):
+        super().setUp()
+        # The simulated latency is what the runs are about
+        self.simulator.default = EndpointScript(
+            self.latency / 1000, "uniform", self.jitter / 1000
+        )
+
+    @classmethod
+    def tearDownClass(cls):
+        report = json.dumps(
+            {
+                "odoo": version,
+                "module": get_manifest("delivery_yunexpress").get("version"),
+                "latency_ms": cls.latency,
+                "jitter_ms": cls.jitter,
+                "memory_traced": cls.trace_memory,
+                "results": cls.results,
+            },
+            indent=2,
+        )
+        output = os.environ.get("YUNEXPRESS_BENCH_OUTPUT")
+        if output:
+            with open(output, "w") as report_file:
+                report_file.write(report)
+        else:
+            _logger.info("Yun Express benchmark:\n%s", report)
+        super().tearDownClass()
+
+    def _bench_pickings(self, size):
+        location = self.picking_type.default_location_src_id
+        location_dest = self.env.ref("stock.stock_location_customers")
+        return self.env["stock.picking"].create(
+            [
+                {
+                    "partner_id": self.partner.id,
+                    "picking_type_id": self.picking_type.id,
+                    "location_id": location.id,
+                    "location_dest_id": location_dest.id,
+                    "carrier_id": self.carrier.id,
+                    "move_ids": [
+                        (
+                            0,
+                            0,
+                            {
+                                "name": product.name,
+                                "product_id": product.id,
+                                "product_uom": product.uom_id.id,
+                                "product_uom_qty": 1.0,
+                                "location_id": location.id,
+                                "location_dest_id": location_dest.id,
+                            },
+                        )
+                        for product in self.products[
+                            index % 10 : index % 10 + 1 + index % 3
+                        ]
+                    ],
+                }
+                for index in range(size)
+            ]
+        )
+
+    def _measure(self, scenario, pickings, func, samples=None):
+        """Run the scenario and keep its figures
+
+        :param str scenario: Scenario name
+        :param recordset pickings: `stock.picking` recordset
+        :param callable func: Scenario to run
+        :param list samples: Latencies in seconds to report instead of the
+            API calls ones
+        """
+        self.env.flush_all()
+        self.env.invalidate_all()
+        calls = []
+        call = YUNExpressRequest._call
+        async_call = YUNExpressAsyncRequest._call
+
+        def timed_call(request, *args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return call(request, *args, **kwargs)
+            finally:
+                calls.append(time.perf_counter() - started)
+
+        async def async_timed_call(request, *args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await async_call(request, *args, **kwargs)
+            finally:
+                calls.append(time.perf_counter() - started)
+
+        queries = self.env.cr.sql_log_count
+        if self.trace_memory:
+            tracemalloc.start()
+        started = time.perf_counter()
+        # Throttling isn't what we measure here, `YunExpressCase` turns it off
+        with patch.object(YUNExpressRequest, "_call", timed_call), patch.object(
+            YUNExpressAsyncRequest, "_call", async_timed_call
+        ):
+            func()
+            self.env.flush_all()
+        elapsed = time.perf_counter() - started
+        peak = None
+        if self.trace_memory:
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        latencies = sorted(calls if samples is None else samples)
+        result = {
+            "scenario": scenario,
+            "pickings": len(pickings),
+            "seconds": round(elapsed, 4),
+            "throughput": round(len(pickings) / elapsed, 2) if elapsed else None,
+            "latency_of": "api_call" if samples is None else "picking",
+            "latency_samples": len(latencies),
+            "queries": self.env.cr.sql_log_count - queries,
+            "api_calls": len(calls),
+            "peak_memory_kb": peak and round(peak / 1024, 1),
+        }
+        for rank in (50, 95, 99):
+            value = percentile(latencies, rank)
+            result["p{}_ms".format(rank)] = (
+                value if value is None else round(value * 1000, 2)
+            )
+        self.results.append(result)
+        _logger.info("Yun Express benchmark %s", result)
+        return result
+
+    def _single_prepare_samples(self, pickings):
+        """Latency of the payload preparation of a single picking"""
+        samples = []
+        for picking in pickings[:100]:
+            self.env.invalidate_all()
+            started = time.perf_counter()
+            self.carrier._prepare_yunexpress_shipping(picking)
+            samples.append(time.perf_counter() - started)
+        return samples
+
+    def test_benchmark(self):
+        for size in self.sizes:
+            pickings = self._bench_pickings(size)
+            self._measure(
+                "prepare_shipping",
+                pickings,
+                lambda: list(self.carrier._yunexpress_shipping_payloads(pickings)),
+                samples=self._single_prepare_samples(pickings),
+            )
+            self._measure(
+                "send_shipping",
+                pickings,
+                lambda: self.carrier.yunexpress_send_shipping(pickings),
+            )
+            self.assertTrue(all(pickings.mapped("carrier_tracking_ref")))
+            result = {}
+            self._measure(
+                "get_labels",
+                pickings,
+                lambda: result.update(self.carrier.yunexpress_get_labels(pickings)),
+            )
+            self.assertEqual(len(result["labels"]), size)
+            self._measure(
+                "tracking_state_update",
+                pickings,
+                lambda: self.carrier.yunexpress_tracking_state_update(pickings),
+            )
+            self.assertTrue(all(pickings.mapped("yunexpress_package_state")))
@@ -0,0 +1,58 @@
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+from odoo.exceptions import UserError
+
+from ..models.yunexpress_request import YUNExpressRequest
+from .common import YunExpressCase
+from .yunexpress_simulator import TRACKING_STEP
+
+
+class TestYunExpressCancel(YunExpressCase):
+    def setUp(self):
+        super().setUp()
+        self.pickings = self._create_pickings(2)
+        self.carrier.yunexpress_send_shipping(self.pickings)
+        self.refs = self.pickings.mapped("carrier_tracking_ref")
+        # Unknown in Yun Express, its cancellation fails
+        self.pickings[1].carrier_tracking_ref = "YTUNKNOWN"
+
+    def _stages(self):
+        return self.env["yunexpress.shipment"]._get_stages(
+            self.pickings.mapped("yunexpress_order_number")
+        )
+
+    def test_cancel_partial_failure(self):
+        """The cancelled shippings lose their tracking ref even when others
+        fail, and they're recorded so they aren't resumed from the ledger
+        """
+        action = self.pickings.cancel_shipment()
+        self.assertEqual(action["params"]["type"], "warning")
+        self.assertIn(self.pickings[1].name, action["params"]["message"])
+        self.assertFalse(self.pickings[0].carrier_tracking_ref)
+        self.assertEqual(self.pickings[1].carrier_tracking_ref, "YTUNKNOWN")
+        stages = self._stages()
+        self.assertNotIn(self.pickings[0].yunexpress_order_number, stages)
+        self.assertEqual(
+            stages[self.pickings[1].yunexpress_order_number]["stage"], "stored"
+        )
+        self.assertNotIn(self.refs[0], self.simulator.waybills)
+
+    def test_cancel_hook(self):
+        self.assertTrue(self.carrier.cancel_shipment(self.pickings))
+        self.assertFalse(self.pickings[0].carrier_tracking_ref)
+        self.assertEqual(self.pickings[1].carrier_tracking_ref, "YTUNKNOWN")
+        self.assertIn("1011", self.pickings[1].message_ids[0].body)
+        # Nothing cancelled, nothing to keep
+        with self.assertRaisesRegex(UserError, "YTUNKNOWN"):
+            self.carrier.cancel_shipment(self.pickings[1])
+
+    def test_cancel_received(self):
+        """Received orders are intercepted, other Delete errors are returned"""
+        client = YUNExpressRequest("TEST", "secret", api_url=self.simulator.url)
+        order = self.simulator.orders[self.pickings[0].yunexpress_order_number]
+        order["created"] -= TRACKING_STEP
+        self.assertEqual(client.cancel_shipping(self.refs[0]), [])
+        self.assertTrue(order.get("Intercepted"))
+        self.assertEqual(self.simulator.calls["Intercept"], 1)
+        errors = client.cancel_shipping("YTUNKNOWN")
+        self.assertEqual(errors[0][0], "1011")
+        self.assertEqual(self.simulator.calls["Intercept"], 1)
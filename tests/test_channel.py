@@ -0,0 +1,83 @@
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+from unittest.mock import patch
+
+from odoo.exceptions import UserError
+from odoo.tests import TransactionCase
+
+from .common import YunExpressCase
+
+
+class TestYunExpressChannel(TransactionCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.Channel = cls.env["yunexpress.channel"]
+        cls.methods = [
+            {"Code": "SYNCA", "CName": "Line A"},
+            {"Code": "SYNCB", "CName": "Line B 带电"},
+            {"Code": "SYNCC", "CName": "Line C"},
+            {"Code": "SYNCD", "CName": "Line D"},
+        ]
+        cls.coverage = {"ES": {"SYNCA", "SYNCB"}, "FR": {"SYNCC"}}
+
+    def _channel(self, code):
+        return self.Channel.search([("code", "=", code)])
+
+    def test_sync(self):
+        self.addCleanup(self.Channel.clear_caches)
+        with patch.object(type(self.Channel), "clear_caches") as clear_caches:
+            self.Channel._sync(self.methods, self.coverage)
+            self.assertEqual(clear_caches.call_count, 1)
+            self.Channel._sync(self.methods, {"ES": {"SYNCA"}, "FR": {"SYNCC"}})
+            self.assertEqual(clear_caches.call_count, 2)
+            # Nothing changed, nothing to clear
+            self.Channel._sync(self.methods, {"ES": {"SYNCA"}, "FR": {"SYNCC"}})
+            self.assertEqual(clear_caches.call_count, 2)
+        spain, france = self.env.ref("base.es"), self.env.ref("base.fr")
+        self.assertEqual(self._channel("SYNCA").country_ids, spain)
+        self.assertFalse(self._channel("SYNCB").country_ids)
+        self.assertEqual(self._channel("SYNCB").goods_type, "battery")
+        self.assertEqual(self._channel("SYNCC").country_ids, france)
+
+    def test_retire(self):
+        manual = self.Channel.create({"code": "SYNCM", "name": "Manual"})
+        self.Channel._sync(self.methods, self.coverage)
+        self.assertFalse(manual.active)
+        self.Channel._sync(self.methods[:3], self.coverage)
+        self.assertFalse(self._channel("SYNCD"))
+        self.assertNotIn("SYNCD", self.Channel._get_channel_map())
+        # Returned again, it's back
+        self.Channel._sync(self.methods, self.coverage)
+        self.assertTrue(self._channel("SYNCD").active)
+        # An empty answer doesn't retire them all
+        self.Channel._sync([], self.coverage)
+        self.assertTrue(self._channel("SYNCA"))
+
+    def test_uncovered_countries(self):
+        self.Channel._sync(self.methods, self.coverage)
+        self.assertFalse(self.Channel._uncovered_countries("SYNCA", ["ES"]))
+        self.assertEqual(
+            self.Channel._uncovered_countries("SYNCA", ["ES", "FR"]), {"FR"}
+        )
+        # Nobody covers Portugal, its coverage wasn't gathered
+        self.assertFalse(self.Channel._uncovered_countries("SYNCC", ["PT"]))
+        # Unknown coverage
+        self.assertFalse(self.Channel._uncovered_countries("SYNCD", ["FR"]))
+
+
+class TestYunExpressChannelCoverage(YunExpressCase):
+    def test_send_uncovered(self):
+        """The configured channel is kept, shippings it can't take are refused"""
+        france = self.env.ref("base.fr")
+        self.env["yunexpress.channel"].create(
+            {"code": "OTHER", "name": "Other", "country_ids": [(6, 0, france.ids)]}
+        )
+        self.records["channel"].country_ids = self.env.ref("base.es")
+        pickings = self._create_pickings(2)
+        pickings[1].partner_id = self.records["partner"].copy({"country_id": france.id})
+        with self.assertRaisesRegex(UserError, "doesn't ship to FR"):
+            self.carrier.yunexpress_send_shipping(pickings)
+        self.assertNotIn("CreateOrder", self.simulator.calls)
+        self.carrier.yunexpress_send_shipping(pickings[0])
+        order = self.simulator.orders[pickings[0].name.replace("/", "-")]
+        self.assertEqual(order["ShippingMethodCode"], "TEST")
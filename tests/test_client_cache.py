@@ -0,0 +1,39 @@
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+from unittest.mock import patch
+
+from odoo.tools.config import config
+
+from ..models import delivery_carrier
+from .common import YunExpressCase
+
+
+class TestYunExpressClientCache(YunExpressCase):
+    def setUp(self):
+        super().setUp()
+        self.startPatcher(patch.dict(delivery_carrier._yun_clients, clear=True))
+
+    def test_cached(self):
+        client = self.carrier._yun_request()
+        self.assertIs(self.carrier._yun_request(), client)
+        # Every carrier has its own
+        other = self._create_records(self.env, "OTHER")["carrier"]
+        self.assertIsNot(other._yun_request(), client)
+        self.assertIs(self.carrier._yun_request(), client)
+
+    def test_credentials(self):
+        """Changing the credentials discards the client"""
+        client = self.carrier._yun_request()
+        self.carrier.yunexpress_api_secret = "new secret"
+        new_client = self.carrier._yun_request()
+        self.assertIsNot(new_client, client)
+        self.assertEqual(new_client.api_secret, "new secret")
+        self.assertNotEqual(new_client.api_token, client.api_token)
+        self.carrier.prod_environment = True
+        self.assertIsNot(self.carrier._yun_request(), new_client)
+
+    def test_server_options(self):
+        client = self.carrier._yun_request()
+        with patch.dict(config.options, {"yunexpress_api_url": "http://other"}):
+            new_client = self.carrier._yun_request()
+        self.assertIsNot(new_client, client)
+        self.assertEqual(new_client.url, "http://other")
@@ -0,0 +1,49 @@
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+from .common import YunExpressCase
+
+
+class TestYunExpressCreateOrders(YunExpressCase):
+    def setUp(self):
+        super().setUp()
+        self.carrier.yunexpress_send_batch_size = 2
+        self.pickings = self._create_pickings(5)
+
+    @staticmethod
+    def _order_number(picking):
+        return picking.name.replace("/", "-")
+
+    def test_batches(self):
+        """Every order gets the waybill of its own item"""
+        self.carrier.yunexpress_send_shipping(self.pickings)
+        self.assertEqual(self.simulator.calls["CreateOrder"], 3)
+        for picking in self.pickings:
+            order = self.simulator.orders[self._order_number(picking)]
+            self.assertEqual(picking.carrier_tracking_ref, order["WayBillNumber"])
+        self.assertEqual(len(set(self.pickings.mapped("carrier_tracking_ref"))), 5)
+
+    def test_duplicates(self):
+        """Orders created in a former attempt get their waybill from GetOrder"""
+        orders = len(self.simulator.orders)
+        self.carrier.yunexpress_send_shipping(self.pickings[:2])
+        waybills = self.pickings[:2].mapped("carrier_tracking_ref")
+        # Lost on our side
+        self.env["yunexpress.shipment"].search([]).unlink()
+        self.pickings.write(
+            {"carrier_tracking_ref": False, "yunexpress_order_number": False}
+        )
+        self.simulator.reset()
+        self.carrier.yunexpress_send_shipping(self.pickings)
+        self.assertEqual(self.pickings[:2].mapped("carrier_tracking_ref"), waybills)
+        self.assertEqual(self.simulator.calls["GetOrder"], 2)
+        self.assertEqual(len(self.simulator.orders), orders + 5)
+
+    def test_failed_batch(self):
+        """A failing batch stops the sending. CreateOrder isn't retried, the
+        orders could be duplicated.
+        """
+        self.simulator.script("CreateOrder", error_rate=1.0)
+        with self.assertRaisesRegex(Exception, "Error in request"):
+            self.carrier.yunexpress_send_shipping(self.pickings)
+        self.assertEqual(self.simulator.calls["CreateOrder"], 1)
+        for picking in self.pickings:
+            self.assertNotIn(self._order_number(picking), self.simulator.orders)
@@ -0,0 +1,68 @@
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+import threading
+from unittest.mock import patch
+
+from odoo import SUPERUSER_ID, api
+from odoo.tools.config import config
+
+from .common import YunExpressCase
+
+
+class TestYunExpressDispatch(YunExpressCase):
+    """The dispatch workers and the shipment ledger run their own transactions
+    as they do in production, so the records are committed and removed
+    afterwards.
+    """
+
+    yunexpress_test_mode = False
+
+    def _committed_env(self, cr):
+        return api.Environment(cr, SUPERUSER_ID, {"tracking_disable": True})
+
+    def _remove(self, ids):
+        with self.registry.cursor() as cr:
+            env = self._committed_env(cr)
+            pickings = env["stock.picking"].browse(ids["pickings"])
+            env["yunexpress.shipment"].search(
+                [("name", "in", pickings.mapped("yunexpress_order_number"))]
+            ).unlink()
+            env["ir.attachment"].search(
+                [("res_model", "=", "stock.picking"), ("res_id", "in", pickings.ids)]
+            ).unlink()
+            pickings.unlink()
+            carrier = env["delivery.carrier"].browse(ids["carrier"])
+            service = carrier.product_id
+            carrier.unlink()
+            (service | env["product.product"].browse(ids["products"])).unlink()
+            env["res.partner"].browse(ids["partner"]).unlink()
+            env["yunexpress.channel"].browse(ids["channel"]).unlink()
+
+    def test_dispatch_workers(self):
+        """The workers hold the claimed pickings while the ledger is written
+        in a transaction of its own: it mustn't wait for them.
+        """
+        with self.registry.cursor() as cr:
+            records = self._create_records(self._committed_env(cr), "DISPATCH")
+            pickings = self._create_pickings(4, records)
+            pickings.write({"yunexpress_label_state": "pending"})
+            ids = {name: record.ids for name, record in records.items()}
+            ids["pickings"] = pickings.ids
+        self.addCleanup(self._remove, ids)
+        cron = threading.Thread(
+            target=self.env["stock.picking"]._cron_yunexpress_dispatch,
+            name="yunexpress_dispatch_test",
+        )
+        with patch.dict(config.options, {"yunexpress_dispatch_workers": 2}):
+            cron.start()
+            cron.join(timeout=120)
+        self.assertFalse(cron.is_alive(), "The dispatch workers are blocked")
+        with self.registry.cursor() as cr:
+            pickings = self._committed_env(cr)["stock.picking"].browse(ids["pickings"])
+            self.assertEqual(set(pickings.mapped("yunexpress_label_state")), {"ready"})
+            self.assertTrue(all(pickings.mapped("carrier_tracking_ref")))
+            shipments = self._committed_env(cr)["yunexpress.shipment"].search(
+                [("name", "in", pickings.mapped("yunexpress_order_number"))]
+            )
+            self.assertEqual(len(shipments), 4)
+            self.assertEqual(set(shipments.mapped("stage")), {"stored"})
+            self.assertEqual(shipments.picking_id, pickings)
@@ -0,0 +1,83 @@
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+from unittest.mock import patch
+
+from odoo.tests import HttpCase, TransactionCase, tagged
+
+from ..models import yunexpress_label
+from ..models.yunexpress_label import LabelContents
+from .common import YunExpressCase
+
+
+class TestYunExpressLabelContents(TransactionCase):
+    def test_budget(self):
+        contents = LabelContents(10)
+        contents.put("a", b"aaaa")
+        contents.put("b", b"bbbb")
+        # Used again, so it's kept
+        self.assertEqual(contents.get("a"), b"aaaa")
+        contents.put("a", b"aaaa")
+        self.assertEqual(contents.size, 8)
+        contents.put("c", b"cccc")
+        self.assertIsNone(contents.get("b"))
+        self.assertEqual(contents.get("a"), b"aaaa")
+        self.assertEqual(contents.get("c"), b"cccc")
+        self.assertEqual(contents.size, 8)
+        # Over the whole budget, it's not kept at all
+        contents.put("d", b"d" * 11)
+        self.assertIsNone(contents.get("d"))
+        self.assertEqual(contents.size, 8)
+        contents.clear()
+        self.assertIsNone(contents.get("a"))
+        self.assertEqual(contents.size, 0)
+
+
+class TestYunExpressLabelCache(YunExpressCase):
+    def setUp(self):
+        super().setUp()
+        self.contents = LabelContents(1024 * 1024)
+        self.startPatcher(
+            patch.object(yunexpress_label, "_label_contents", self.contents)
+        )
+        self.Label = self.env["yunexpress.label"]
+        self.pickings = self._create_pickings(2)
+        self.carrier.yunexpress_send_shipping(self.pickings)
+        self.simulator.reset()
+
+    def test_reprint(self):
+        self.assertEqual(self.Label.search([]).picking_id, self.pickings)
+        labels = self.pickings._yunexpress_labels()
+        self.assertEqual(set(labels), set(self.pickings.ids))
+        self.assertFalse(self.simulator.calls)
+        # Evicted from memory, they come from the filestore
+        self.contents.clear()
+        self.assertEqual(self.pickings._yunexpress_labels(), labels)
+        self.assertFalse(self.simulator.calls)
+        self.assertGreater(self.contents.size, 0)
+
+    def test_invalidate(self):
+        self.Label._invalidate(self.pickings[0])
+        self.assertEqual(self.Label.search([]).picking_id, self.pickings[1])
+        self.pickings._yunexpress_labels()
+        self.assertEqual(self.simulator.calls["Label/Print"], 1)
+        self.assertEqual(self.Label.search([]).picking_id, self.pickings)
+        self.Label._invalidate()
+        self.assertFalse(self.Label.search([]))
+        self.assertEqual(self.contents.size, 0)
+
+
+@tagged("post_install", "-at_install")
+class TestYunExpressPrintLabels(YunExpressCase, HttpCase):
+    def test_print_labels(self):
+        """The merged document is streamed, nothing is stored for it"""
+        pickings = self._create_pickings(3)
+        self.carrier.yunexpress_send_shipping(pickings)
+        Attachment = self.env["ir.attachment"]
+        attachments = Attachment.search([])
+        action = pickings.action_yunexpress_print_labels()
+        self.assertEqual(Attachment.search([]), attachments)
+        self.authenticate("admin", "admin")
+        response = self.url_open(action["url"])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers["Content-Type"], "application/pdf")
+        self.assertTrue(response.content.startswith(b"%PDF"))
+        self.assertEqual(Attachment.search([]), attachments)
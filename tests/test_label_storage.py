@@ -0,0 +1,47 @@
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+from .common import YunExpressCase
+
+
+class TestYunExpressLabelStorage(YunExpressCase):
+    def setUp(self):
+        super().setUp()
+        self.pickings = self._create_pickings(2)
+        self.Attachment = self.env["ir.attachment"]
+
+    def _attachments(self):
+        return self.Attachment.search(
+            [("res_model", "=", "stock.picking"), ("res_id", "in", self.pickings.ids)]
+        )
+
+    def test_reuse(self):
+        labels = [
+            (self.pickings[0], "A.pdf", b"%PDF label A"),
+            (self.pickings[1], "A.pdf", b"%PDF label A"),
+        ]
+        attachments = self.carrier._yunexpress_store_labels(labels)
+        self.assertEqual(len(attachments), 2)
+        self.assertEqual(attachments.mapped("res_id"), self.pickings.ids)
+        # Same content, a single copy in the filestore
+        self.assertEqual(len(set(attachments.mapped("store_fname"))), 1)
+        # Stored again, they're referenced again
+        self.assertEqual(self.carrier._yunexpress_store_labels(labels), attachments)
+        self.assertEqual(self._attachments(), attachments)
+        # A new label is a new attachment
+        new = self.carrier._yunexpress_store_labels(
+            [(self.pickings[0], "B.pdf", b"%PDF label B")]
+        )
+        self.assertNotIn(new, attachments)
+        self.assertEqual(len(self._attachments()), 3)
+
+    def test_resend(self):
+        """The labels of the orders sent again aren't stored twice"""
+        self.carrier.yunexpress_send_shipping(self.pickings)
+        attachments = self._attachments()
+        self.assertEqual(len(attachments), 2)
+        self.env["yunexpress.shipment"].search([]).unlink()
+        self.env["yunexpress.label"]._invalidate(self.pickings)
+        self.pickings.write(
+            {"carrier_tracking_ref": False, "yunexpress_order_number": False}
+        )
+        self.carrier.yunexpress_send_shipping(self.pickings)
+        self.assertEqual(self._attachments(), attachments)
@@ -0,0 +1,92 @@
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+import io
+from unittest.mock import patch
+
+from odoo.tools.pdf import PdfFileReader
+
+from ..models import delivery_carrier
+from .common import YunExpressCase
+
+
+class TestYunExpressLabels(YunExpressCase):
+    def _send(self, size, model_code="MULTI4", offset=0):
+        self.carrier.write(
+            {
+                "yunexpress_document_model_code": model_code,
+                "yunexpress_document_offset": offset,
+            }
+        )
+        pickings = self._create_pickings(size)
+        self.carrier.yunexpress_send_shipping(pickings)
+        self.simulator.reset()
+        return pickings
+
+    def _pages(self, content):
+        """Text of every page of a PDF document"""
+        reader = PdfFileReader(io.BytesIO(content), strict=False)
+        return [
+            reader.getPage(page).getContents().getData().decode("latin-1")
+            for page in range(reader.getNumPages())
+        ]
+
+    def _assert_sheets(self, pickings, result, sheets):
+        """Every label is the sheet holding it and the merged document holds
+        the sheets in order
+
+        :param list sheets: Pickings indexes printed in every sheet
+        """
+        merged = self._pages(result["merged"][1])
+        self.assertEqual(len(merged), len(sheets))
+        for page, indexes in zip(merged, sheets):
+            for index in indexes:
+                picking = pickings[index]
+                self.assertIn(picking.carrier_tracking_ref, page)
+                label = self._pages(result["labels"][picking.id][1])
+                self.assertEqual(label, [page])
+
+    def test_bulk(self):
+        pickings = self._send(5)
+        result = self.carrier.yunexpress_get_labels(pickings)
+        self.assertEqual(self.simulator.calls["Label/Print"], 1)
+        self.assertEqual(self.simulator.calls["download"], 1)
+        self.assertFalse(result["errors"])
+        self._assert_sheets(pickings, result, [range(4), [4]])
+
+    def test_offset(self):
+        """The slots skipped in the first sheet are part of the mapping"""
+        pickings = self._send(5, offset=3)
+        result = self.carrier.yunexpress_get_labels(pickings)
+        self._assert_sheets(pickings, result, [[0], range(1, 5)])
+
+    def test_offset_chunks(self):
+        """The first chunk makes room for the offset, so no sheet is split
+        between two documents
+        """
+        pickings = self._send(10, offset=2)
+        with patch.object(delivery_carrier, "YUNEXPRESS_LABEL_PRINT_CHUNK", 8):
+            result = self.carrier.yunexpress_get_labels(pickings)
+        self.assertEqual(self.simulator.calls["Label/Print"], 2)
+        self._assert_sheets(pickings, result, [[0, 1], range(2, 6), range(6, 10)])
+
+    def test_errors(self):
+        pickings = self._send(3, model_code="SINGLE")
+        pickings[1].carrier_tracking_ref = "YTUNKNOWN"
+        result = self.carrier.yunexpress_get_labels(pickings)
+        self.assertEqual(set(result["errors"]), {pickings[1].id})
+        self.assertEqual(set(result["labels"]), set((pickings - pickings[1]).ids))
+        self._assert_sheets(pickings, result, [[0], [2]])
+
+    def test_unsplit(self):
+        """Documents which can't be split give way to a call per label"""
+        pickings = self._send(3)
+        with patch.object(
+            type(self.carrier), "_yunexpress_split_label", return_value=False
+        ):
+            result = self.carrier.yunexpress_get_labels(pickings)
+        self.assertEqual(self.simulator.calls["Label/Print"], 4)
+        self.assertEqual(set(result["labels"]), set(pickings.ids))
+        for picking in pickings:
+            self.assertIn(
+                picking.carrier_tracking_ref,
+                self._pages(result["labels"][picking.id][1])[0],
+            )
@@ -0,0 +1,65 @@
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+from datetime import timedelta
+from unittest.mock import patch
+
+from odoo import fields
+
+from ..models import yunexpress_shipment
+from .common import YunExpressCase
+
+
+class TestYunExpressManifest(YunExpressCase):
+    def setUp(self):
+        super().setUp()
+        self.pickings = self._create_pickings(5)
+        self.carrier.yunexpress_send_shipping(self.pickings)
+        self.Shipment = self.env["yunexpress.shipment"]
+        self.shipments = self.Shipment.search(
+            [("name", "in", self.pickings.mapped("yunexpress_order_number"))]
+        )
+        now = fields.Datetime.now()
+        self.date_range = (now - timedelta(days=1), now + timedelta(days=1))
+
+    def _rows(self):
+        self.env.flush_all()
+        return list(
+            self.Shipment._manifest_rows("TEST", self.carrier.ids, *self.date_range)
+        )
+
+    def test_rows(self):
+        """The shipments are read page by page in ship date order"""
+        for index, shipment in enumerate(self.shipments.sorted("id")):
+            shipment.ship_date = self.date_range[0] + timedelta(minutes=index)
+        with patch.object(yunexpress_shipment, "YUNEXPRESS_MANIFEST_PAGE", 2):
+            rows = self._rows()
+        self.assertEqual(
+            [row[1] for row in rows], self.shipments.sorted("id").mapped("name")
+        )
+        picking = self.pickings[0]
+        row = next(row for row in rows if row[1] == picking.yunexpress_order_number)
+        self.assertEqual(row[2], picking.carrier_tracking_ref)
+        self.assertEqual(row[3], picking.name)
+        self.assertEqual(row[4], "TEST")
+        self.assertEqual(row[6:9], ("ES", "28001", "Madrid"))
+
+    def test_filters(self):
+        """Cancelled shipments, other accounts and dates are left out"""
+        self.shipments[0].stage = "cancelled"
+        self.shipments[1].api_cid = "OTHER"
+        self.shipments[2].ship_date = self.date_range[1]
+        self.assertEqual(
+            {row[1] for row in self._rows()}, set(self.shipments[3:].mapped("name"))
+        )
+
+    def test_wizard(self):
+        for document_type in ("XLSX", "PDF"):
+            wizard = self.env["yunexpress.manifest.wizard"].create(
+                {"document_type": document_type, "carrier_ids": self.carrier.ids}
+            )
+            wizard.get_manifest()
+            self.assertEqual(wizard.state, "done")
+            self.assertEqual(len(wizard.attachment_ids), 1)
+            self.assertTrue(wizard.attachment_ids.raw)
+            self.assertTrue(
+                wizard.attachment_ids.name.endswith("." + document_type.lower())
+            )
@@ -0,0 +1,37 @@
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+from .common import YunExpressCase
+
+
+class TestYunExpressPayloads(YunExpressCase):
+    def _queries(self, pickings):
+        """Queries to build the payloads of the pickings from a cold cache"""
+        self.env.flush_all()
+        self.env.invalidate_all()
+        count = self.env.cr.sql_log_count
+        payloads = list(self.carrier._yunexpress_shipping_payloads(pickings))
+        self.assertEqual(len(payloads), len(pickings))
+        return self.env.cr.sql_log_count - count
+
+    def test_query_count(self):
+        """The queries don't grow with the pickings or their moves"""
+        pickings = self._create_pickings(12)
+        # Customers of their own
+        for picking in pickings[6:]:
+            picking.partner_id = picking.partner_id.copy()
+        self.assertEqual(self._queries(pickings[:2]), self._queries(pickings))
+
+    def test_values(self):
+        picking = self._create_pickings(1)
+        values = self.carrier._prepare_yunexpress_shipping(picking)
+        self.assertEqual(values["ShippingMethodCode"], "TEST")
+        self.assertEqual(values["CustomerOrderNumber"], picking.name.replace("/", "-"))
+        self.assertEqual(values["Receiver"]["CountryCode"], "ES")
+        self.assertEqual(values["Receiver"]["City"], "Madrid")
+        self.assertEqual(
+            [(parcel["Ename"], parcel["UnitPrice"]) for parcel in values["Parcels"]],
+            [("Product 0", 10.0), ("Product 1", 11.0), ("Product 2", 12.0)],
+        )
+        self.assertEqual(
+            {parcel["CurrencyCode"] for parcel in values["Parcels"]},
+            {picking.company_id.currency_id.name},
+        )
@@ -0,0 +1,32 @@
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+from unittest.mock import patch
+
+from ..models import delivery_carrier
+from .common import YunExpressCase
+
+
+class TestYunExpressPickup(YunExpressCase):
+    def test_pickup(self):
+        pickings = self._create_pickings(5)
+        self.carrier.yunexpress_send_shipping(pickings)
+        self.simulator.reset()
+        wizard = (
+            self.env["yunexpress.pickup.wizard"]
+            .with_context(active_model="stock.picking", active_ids=pickings.ids)
+            .create({"shipping_code": "WH-UNKNOWN"})
+        )
+        self.assertEqual(wizard.picking_ids, pickings)
+        self.assertEqual(wizard.carrier_id, self.carrier)
+        with patch.object(delivery_carrier, "YUNEXPRESS_TRACKING_NUMBER_CHUNK", 2):
+            wizard.create_pickup_request()
+        self.assertEqual(self.simulator.calls["GetTrackingNumber"], 3)
+        self.assertEqual(len(wizard.line_ids), 6)
+        self.assertEqual(wizard.failed_count, 1)
+        failed = wizard.line_ids.filtered(lambda x: x.state == "failed")
+        self.assertEqual(failed.shipping_code, "WH-UNKNOWN")
+        for picking in pickings:
+            line = wizard.line_ids.filtered(lambda x: x.picking_id == picking)
+            self.assertEqual(line.state, "done")
+            self.assertEqual(line.waybill_number, picking.carrier_tracking_ref)
+            self.assertTrue(line.tracking_number)
+            self.assertIn(line.tracking_number, wizard.code)
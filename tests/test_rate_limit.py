@@ -0,0 +1,72 @@
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+import time
+from unittest.mock import Mock, patch
+
+from odoo.sql_db import db_connect
+from odoo.tests import TransactionCase
+
+from ..models import yunexpress_rate_limit
+from ..models.yunexpress_rate_limit import YUNEXPRESS_RATE_DEFAULTS, PgTokenBucket
+from ..models.yunexpress_request import YUNExpressUnavailable
+
+
+class TestYunExpressRateLimit(TransactionCase):
+    """The budgets are taken in transactions of their own, so they're removed
+    afterwards
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.bucket = PgTokenBucket(self.env.cr.dbname, "BUCKET")
+        self.addCleanup(self._execute, "DELETE FROM yunexpress_rate_limit")
+        clock = Mock(wraps=time)
+        clock.sleep = Mock(side_effect=self._rewind)
+        self.startPatcher(patch.object(yunexpress_rate_limit, "time", clock))
+        self.sleep = clock.sleep
+
+    def _execute(self, query, params=()):
+        with db_connect(self.env.cr.dbname).cursor() as cr:
+            cr.execute(query + " WHERE api_cid = %s", params + ("BUCKET",))
+
+    def _rewind(self, seconds):
+        """Pretend the given seconds went by"""
+        self._execute(
+            "UPDATE yunexpress_rate_limit "
+            "SET refilled_at = refilled_at - %s * interval '1 second'",
+            (seconds,),
+        )
+
+    def _drain(self, group):
+        rate, capacity = YUNEXPRESS_RATE_DEFAULTS[group]
+        for _i in range(int(capacity)):
+            self.assertEqual(self.bucket._take(group), 0)
+        return rate
+
+    def test_take(self):
+        rate = self._drain("label")
+        wait = self.bucket._take("label")
+        self.assertGreater(wait, 0)
+        self.assertLessEqual(wait, 1 / rate)
+        # Every group has its own budget
+        self.assertEqual(self.bucket._take("tracking"), 0)
+
+    def test_refill(self):
+        rate = self._drain("label")
+        self._rewind(2 / rate)
+        self.assertEqual(self.bucket._take("label"), 0)
+        self.assertEqual(self.bucket._take("label"), 0)
+
+    def test_acquire_waits(self):
+        self._drain("create_order")
+        self.bucket.acquire("GetOrder")
+        self.sleep.assert_called_once()
+        # Downloads aren't throttled
+        self.bucket.acquire("download")
+        self.sleep.assert_called_once()
+
+    def test_acquire_timeout(self):
+        self._drain("create_order")
+        with patch.object(yunexpress_rate_limit, "YUNEXPRESS_RATE_MAX_WAIT", 0):
+            with self.assertRaises(YUNExpressUnavailable):
+                self.bucket.acquire("CreateOrder")
+        self.sleep.assert_not_called()
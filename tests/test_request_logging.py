@@ -0,0 +1,90 @@
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+from unittest.mock import Mock
+
+from ..models.yunexpress_request import (
+    YUNEXPRESS_LOG_BODY_SIZE,
+    YUNEXPRESS_REDACTED,
+    Exchange,
+    YUNExpressRequest,
+    redact,
+)
+from .common import YunExpressCase
+
+
+class TestYunExpressRequestLogging(YunExpressCase):
+    def setUp(self):
+        super().setUp()
+        self.client = YUNExpressRequest(
+            "LOGGING",
+            "top-secret",
+            record_exchanges=True,
+            api_url=self.simulator.url,
+        )
+
+    def test_redact(self):
+        self.assertEqual(
+            redact(
+                {
+                    "icID": "LOGGING",
+                    "MD5": "abc",
+                    "headers": {"Authorization": "Basic xyz"},
+                    "items": [{"Signature": "def", "Code": "YT1"}],
+                }
+            ),
+            {
+                "icID": "LOGGING",
+                "MD5": YUNEXPRESS_REDACTED,
+                "headers": {"Authorization": YUNEXPRESS_REDACTED},
+                "items": [{"Signature": YUNEXPRESS_REDACTED, "Code": "YT1"}],
+            },
+        )
+
+    def test_exchanges(self):
+        self.assertTrue(self.client.emskindlist().ok)
+        exchange = self.client.pop_exchanges()[0]
+        self.assertEqual(exchange.endpoint, "EmsKindList")
+        # Formatted only when written, with the signature masked
+        signature = exchange.request["json"]["MD5"]
+        request = exchange.format_request()
+        self.assertIn('"MD5": "{}"'.format(YUNEXPRESS_REDACTED), request)
+        self.assertNotIn(signature, request)
+        self.assertFalse(self.client.pop_exchanges())
+
+    def test_echoed_secrets(self):
+        """Secrets echoed back in a body don't leak either"""
+        response = Mock(status_code=500)
+        response.text = "Wrong credentials {} / {}".format(
+            self.client.api_secret, self.client.api_token
+        )
+        self.client._log_exchange("GetOrder", "POST", "/", {}, 0, response)
+        body = self.client.pop_exchanges()[0].format_response()
+        self.assertNotIn(self.client.api_secret, body)
+        self.assertNotIn(self.client.api_token, body)
+
+    def test_sampling(self):
+        """Successful calls are sampled, failed ones are always kept"""
+        self.client.log_sample_rate = 0
+        self.client.get_order_details("WH-OUT-1")
+        self.assertFalse(self.client.pop_exchanges())
+        self.simulator.script("GetOrder", error_rate=1.0, error_status=400)
+        self.client.get_order_details("WH-OUT-1")
+        self.assertEqual(self.client.pop_exchanges()[0].status, 400)
+
+    def test_body_size(self):
+        exchange = Exchange("GetOrder", "POST", "/", {}, 200, 0.1, "x" * 10**5)
+        self.assertLess(
+            len(exchange.format_response()), YUNEXPRESS_LOG_BODY_SIZE + 100
+        )
+
+    def test_carrier_logs(self):
+        """The carrier records the redacted exchanges when debugging"""
+        self.carrier.debug_logging = True
+        client = self.carrier._yun_request()
+        client.emskindlist()
+        self.carrier._yun_log_request(client)
+        logs = self.env["ir.logging"].search(
+            [("path", "=", "yunexpress"), ("func", "=", "EmsKindList")]
+        )
+        self.assertTrue(logs)
+        self.assertIn(YUNEXPRESS_REDACTED, logs[0].message)
+        self.assertNotIn(client.api_token, logs[0].message)
@@ -0,0 +1,131 @@
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+import time
+from unittest.mock import Mock, patch
+
+import requests
+
+from ..models import yunexpress_request
+from ..models.yunexpress_request import (
+    YUNEXPRESS_BREAKER_COOLDOWN,
+    YUNEXPRESS_BREAKER_THRESHOLD,
+    YUNExpressRequest,
+    YUNExpressUnavailable,
+)
+from .common import YunExpressCase
+
+
+class TestYunExpressResilience(YunExpressCase):
+    def setUp(self):
+        super().setUp()
+        # The backoff waits are recorded instead of slept
+        clock = Mock(wraps=time)
+        clock.sleep = Mock()
+        self.startPatcher(patch.object(yunexpress_request, "time", clock))
+        self.sleep = clock.sleep
+        self.client = YUNExpressRequest(
+            "RESILIENCE", "secret", api_url=self.simulator.url
+        )
+        self.breaker = self.client.breaker
+        self.tracking_url = self.simulator.url + "/api/Tracking/GetTrackAllInfo"
+
+    def _track(self):
+        return self.client._call(
+            "GetTrackAllInfo", "POST", self.tracking_url, json={"OrderNumber": "YT1"}
+        )
+
+    def _cooldown(self):
+        """Pretend the cooldown is over"""
+        self.breaker.opened_at -= YUNEXPRESS_BREAKER_COOLDOWN
+
+    def test_retry_backoff(self):
+        self.simulator.script("GetTrackAllInfo", error_rate=1.0, error_status=503)
+        response = self._track()
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(self.simulator.calls["GetTrackAllInfo"], 3)
+        # Full jitter under the exponential cap of every retry
+        waits = [call.args[0] for call in self.sleep.call_args_list]
+        self.assertEqual(len(waits), 2)
+        self.assertLessEqual(waits[0], 1.0)
+        self.assertLessEqual(waits[1], 2.0)
+        self.assertEqual(self.breaker.retries, 2)
+        self.assertEqual(self.breaker.failures, 1)
+
+    def test_retry_recovers(self):
+        self.simulator.script("GetTrackAllInfo", error_rate=1.0, error_status=503)
+        # The API is back by the time the client retries
+        self.sleep.side_effect = lambda seconds: self.simulator.reset()
+        response = self._track()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.breaker.retries, 1)
+        self.assertEqual(self.breaker.failures, 0)
+        self.assertEqual(self.breaker.state, "closed")
+
+    def test_create_order_not_retried(self):
+        self.simulator.script("CreateOrder", error_rate=1.0)
+        url = self.simulator.url + "/api/WayBill/CreateOrder"
+        response = self.client._call("CreateOrder", "POST", url, json=[])
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(self.simulator.calls["CreateOrder"], 1)
+        self.sleep.assert_not_called()
+
+    def test_breaker(self):
+        self.simulator.script("GetTrackAllInfo", error_rate=1.0)
+        for _i in range(YUNEXPRESS_BREAKER_THRESHOLD):
+            self._track()
+        self.assertEqual(self.breaker.state, "open")
+        calls = self.simulator.calls["GetTrackAllInfo"]
+        # Open: the calls fail fast
+        with self.assertRaises(YUNExpressUnavailable):
+            self._track()
+        self.assertEqual(self.simulator.calls["GetTrackAllInfo"], calls)
+        # Half open: a failing probe opens it again
+        self._cooldown()
+        self._track()
+        self.assertEqual(self.breaker.state, "open")
+        self.assertGreater(self.simulator.calls["GetTrackAllInfo"], calls)
+        # A single probe is let through
+        self._cooldown()
+        self.breaker.before_call()
+        self.assertEqual(self.breaker.state, "half_open")
+        with self.assertRaises(YUNExpressUnavailable):
+            self._track()
+        self.breaker.release()
+        # A working probe closes it
+        self.simulator.reset()
+        self.assertEqual(self._track().status_code, 200)
+        self.assertEqual(self.breaker.state, "closed")
+        self.assertEqual(self.breaker.failures, 0)
+
+    def _open(self):
+        for _i in range(YUNEXPRESS_BREAKER_THRESHOLD):
+            self.breaker.failure("Simulated error")
+        self._cooldown()
+
+    def test_probe_released(self):
+        """A probe ending on our side doesn't leave the breaker half open"""
+        self._open()
+        self.client.rate_limiter = Mock()
+        self.client.rate_limiter.acquire.side_effect = YUNExpressUnavailable("Budget")
+        with self.assertRaises(YUNExpressUnavailable):
+            self._track()
+        self.assertEqual(self.breaker.state, "open")
+        self.assertNotIn("GetTrackAllInfo", self.simulator.calls)
+        # The next call probes again
+        self.client.rate_limiter = None
+        self.assertEqual(self._track().status_code, 200)
+        self.assertEqual(self.breaker.state, "closed")
+
+    def test_probe_request_error(self):
+        """Other request errors count as failures"""
+        self._open()
+        with patch.object(
+            self.client.session,
+            "request",
+            side_effect=requests.exceptions.ChunkedEncodingError("Broken body"),
+        ):
+            with self.assertRaises(requests.exceptions.ChunkedEncodingError):
+                self._track()
+        self.assertEqual(self.breaker.state, "open")
+        self._cooldown()
+        self.assertEqual(self._track().status_code, 200)
+        self.assertEqual(self.breaker.state, "closed")
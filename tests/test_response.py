@@ -0,0 +1,94 @@
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+import json
+from unittest.mock import Mock
+
+from odoo.tests import TransactionCase
+
+from ..models.yunexpress_response import (
+    ApiResponse,
+    LabelResult,
+    OrderResult,
+    TrackingInfo,
+)
+
+
+class TestYunExpressResponse(TransactionCase):
+    def _response(self, status, body):
+        return ApiResponse.from_response(
+            Mock(status_code=status, content=body.encode() if body else b"")
+        )
+
+    def test_rest(self):
+        response = self._response(200, '{"Code": "0000", "Message": "提交成功"}')
+        self.assertTrue(response.ok)
+        self.assertEqual(response.errors(), [])
+        response = self._response(200, '{"Code": "1011", "Message": "订单不存在"}')
+        self.assertFalse(response.ok)
+        self.assertEqual(response.errors(), [("1011", "订单不存在")])
+        # Bodies which aren't JSON give an empty payload
+        response = self._response(502, "<html>Bad gateway</html>")
+        self.assertFalse(response.ok)
+        self.assertEqual(response.errors(), [("HTTP 502", "")])
+        response = self._response(200, "")
+        self.assertEqual(response.errors(), [("-", "")])
+
+    def test_ems_data(self):
+        for value, ok in ((3, True), ("3", True), (0, False), (-1, False)):
+            response = ApiResponse(200, {"ReturnValue": value, "cMess": "Kinds"})
+            self.assertEqual(response.ok, ok, value)
+            self.assertEqual(response.code, str(value))
+            self.assertEqual(response.message, "Kinds")
+        # Values which aren't numbers are errors, not crashes
+        for value in ("abc", None, [1]):
+            response = ApiResponse(200, {"ReturnValue": value, "cMess": "Error"})
+            self.assertFalse(response.ok)
+            self.assertEqual(response.errors(), [(str(value), "Error")])
+
+    def test_duplicate(self):
+        duplicate = OrderResult.from_item(
+            {
+                "CustomerOrderNumber": "WH-OUT-1",
+                "Success": 0,
+                "Remark": "订单号重复",
+            }
+        )
+        self.assertTrue(duplicate.is_duplicate)
+        self.assertFalse(duplicate.success)
+        created = OrderResult.from_item(
+            {"Success": 1, "WayBillNumber": "YT1", "Remark": "订单号重复"},
+            order_number="WH-OUT-2",
+        )
+        self.assertFalse(created.is_duplicate)
+        self.assertTrue(created.success)
+        self.assertEqual(created.order_number, "WH-OUT-2")
+
+    def test_label_infos(self):
+        label = LabelResult.from_item(
+            json.loads(
+                """{
+                    "Url": "http://labels/1.pdf",
+                    "LabelPrintInfos": [
+                        {"WayBillNumber": "YT1", "CustomerOrderNumber": "WH-OUT-1"},
+                        {"WayBillNumber": "YT2", "ErrorBody": "Not found"}
+                    ]
+                }"""
+            )
+        )
+        self.assertEqual(label.url, "http://labels/1.pdf")
+        self.assertEqual(
+            [(i.waybill_number, i.order_number, i.error) for i in label.infos],
+            [("YT1", "WH-OUT-1", False), ("YT2", False, "Not found")],
+        )
+        self.assertEqual(LabelResult.from_item({}).infos, [])
+
+    def test_tracking(self):
+        info = TrackingInfo.from_item(
+            {
+                "WayBillNumber": "YT1",
+                "PackageState": 3,
+                "OrderTrackingDetails": [{"ProcessContent": "Delivered"}],
+            }
+        )
+        self.assertEqual(info.waybill_number, "YT1")
+        self.assertEqual([event.content for event in info.events], ["Delivered"])
+        self.assertFalse(TrackingInfo.from_item(None).waybill_number)
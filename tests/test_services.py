@@ -0,0 +1,22 @@
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+from unittest.mock import patch
+
+from odoo.tools.config import config
+
+from .common import YunExpressCase
+
+
+class TestYunExpressServices(YunExpressCase):
+    def test_refresh_config_account(self):
+        """Accounts set in the server configuration get their services"""
+        self.carrier.write(
+            {"yunexpress_api_cid": False, "yunexpress_api_secret": False}
+        )
+        with patch.dict(
+            config.options, {"yun_api_cid": "CONFIG", "yun_api_secret": "secret"}
+        ):
+            self.carrier._yunexpress_refresh_services()
+            services = self.carrier._yunexpress_services()
+        self.assertEqual(len(services), 3)
+        self.assertEqual(set(services.mapped("api_cid")), {"CONFIG"})
+        self.assertIn("EmsKindList", self.simulator.calls)
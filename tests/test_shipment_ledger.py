@@ -0,0 +1,61 @@
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+from unittest.mock import patch
+
+from ..models import yunexpress_request
+from .common import YunExpressCase
+
+
+class TestYunExpressShipmentLedger(YunExpressCase):
+    def setUp(self):
+        super().setUp()
+        # No backoff waits
+        self.startPatcher(
+            patch.object(yunexpress_request, "YUNEXPRESS_BACKOFF_BASE", 0)
+        )
+        self.Shipment = self.env["yunexpress.shipment"]
+        self.pickings = self._create_pickings(2)
+
+    def _send_failing(self, endpoint):
+        """Send the pickings while the endpoint is down. The ledger outlives
+        the failed transaction, the pickings don't.
+        """
+        self.simulator.script(endpoint, error_rate=1.0, error_status=503)
+        # Not `assertRaises`, its savepoint would undo the ledger in test mode
+        with self.assertRaisesRegex(Exception, "Error in request"):
+            self.carrier.yunexpress_send_shipping(self.pickings)
+        names = self.pickings.mapped("yunexpress_order_number")
+        self.pickings.write(
+            {"carrier_tracking_ref": False, "yunexpress_order_number": False}
+        )
+        self.simulator.reset()
+        return names
+
+    def test_resume_created(self):
+        names = self._send_failing("Label/Print")
+        ledger = self.Shipment._get_ledger(names)
+        self.assertEqual({shipment.stage for shipment in ledger.values()}, {"created"})
+        waybills = {name: shipment.waybill_number for name, shipment in ledger.items()}
+        self.carrier.yunexpress_send_shipping(self.pickings)
+        # The orders aren't created twice
+        self.assertNotIn("CreateOrder", self.simulator.calls)
+        self.assertIn("Label/Print", self.simulator.calls)
+        for picking in self.pickings:
+            self.assertEqual(
+                picking.carrier_tracking_ref, waybills[picking.yunexpress_order_number]
+            )
+        shipments = self.Shipment.search([("name", "in", names)])
+        self.assertEqual(set(shipments.mapped("stage")), {"stored"})
+        self.assertEqual(shipments.picking_id, self.pickings)
+
+    def test_resume_labeled(self):
+        names = self._send_failing("download")
+        ledger = self.Shipment._get_ledger(names)
+        self.assertEqual({shipment.stage for shipment in ledger.values()}, {"labeled"})
+        self.carrier.yunexpress_send_shipping(self.pickings)
+        # The label urls we got are downloaded again
+        self.assertNotIn("CreateOrder", self.simulator.calls)
+        self.assertNotIn("Label/Print", self.simulator.calls)
+        self.assertEqual(
+            set(self.Shipment.search([("name", "in", names)]).mapped("stage")),
+            {"stored"},
+        )
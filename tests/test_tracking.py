@@ -0,0 +1,113 @@
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+from odoo import fields
+
+from ..models import delivery_carrier
+from .common import YunExpressCase
+from .yunexpress_simulator import TRACKING_STEP
+
+NOW = datetime(2024, 5, 10, 12, 0, 0)
+
+
+class TestYunExpressTracking(YunExpressCase):
+    def setUp(self):
+        super().setUp()
+        self.pickings = self._create_pickings(3)
+        self.carrier.yunexpress_send_shipping(self.pickings)
+        self.pickings.write({"state": "done", "date_done": fields.Datetime.now()})
+        self.simulator.reset()
+
+    def _progress(self, steps, pickings=None):
+        """Move the tracking of the pickings the given steps forward"""
+        for picking in pickings or self.pickings:
+            number = self.simulator.waybills[picking.carrier_tracking_ref]
+            self.simulator.orders[number]["created"] -= steps * TRACKING_STEP
+
+    def _hours_to_check(self, picking):
+        return (
+            picking.yunexpress_next_check - fields.Datetime.now()
+        ).total_seconds() / 3600
+
+    def test_sync(self):
+        updated = self.carrier.yunexpress_sync_trackings(self.pickings)
+        self.assertEqual(updated, self.pickings)
+        self.assertEqual(self.simulator.calls["GetTrackAllInfo"], 3)
+        for picking in self.pickings:
+            self.assertIn("Shipment information received", picking.tracking_state)
+            self.assertEqual(picking.delivery_state, "shipping_recorded_in_carrier")
+            self.assertEqual(picking.yunexpress_package_state, 1)
+            self.assertAlmostEqual(self._hours_to_check(picking), 6, delta=0.1)
+        # Nothing new: rescheduled, but not written
+        history = self.pickings.mapped("tracking_state_history")
+        self.pickings.write({"yunexpress_next_check": False})
+        self.assertFalse(self.carrier.yunexpress_sync_trackings(self.pickings))
+        self.assertEqual(self.pickings.mapped("tracking_state_history"), history)
+        self.assertTrue(all(self.pickings.mapped("yunexpress_next_check")))
+        # Only the ones which moved are written
+        self._progress(2, self.pickings[0])
+        updated = self.carrier.yunexpress_sync_trackings(self.pickings)
+        self.assertEqual(updated, self.pickings[0])
+        self.assertEqual(self.pickings[0].delivery_state, "in_transit")
+        self.assertEqual(
+            len(self.pickings[0].tracking_state_history.splitlines()), 3
+        )
+        self.assertEqual(self.pickings[1].tracking_state_history, history[1])
+        # Delivered: no more checks
+        self._progress(4)
+        self.carrier.yunexpress_sync_trackings(self.pickings)
+        self.assertEqual(
+            set(self.pickings.mapped("delivery_state")), {"customer_delivered"}
+        )
+        self.assertFalse(any(self.pickings.mapped("yunexpress_next_check")))
+
+    def test_cron(self):
+        """Due pickings are synchronized and committed in chunks"""
+        self.carrier.yunexpress_sync_trackings(self.pickings)
+        self._progress(1)
+        self.pickings[:2].write({"yunexpress_next_check": fields.Datetime.now()})
+        self.simulator.reset()
+        with patch.object(
+            self.registry, "in_test_mode", return_value=False
+        ), patch.object(self.env.cr, "commit") as commit, patch.object(
+            delivery_carrier, "YUNEXPRESS_TRACKING_CHUNK", 1
+        ):
+            self.env["delivery.carrier"]._cron_yunexpress_tracking_sync()
+        # The third one isn't due
+        self.assertEqual(self.simulator.calls["GetTrackAllInfo"], 2)
+        self.assertEqual(commit.call_count, 2)
+        self.assertEqual(
+            self.pickings.mapped("yunexpress_package_state"), [2, 2, 1]
+        )
+
+    def test_next_check(self):
+        picking = self.pickings[0]
+        picking.date_done = NOW - timedelta(days=2)
+        self.carrier.yunexpress_transit_days = 10
+
+        def hours(package_state, idle_hours=0):
+            last_event_date = NOW - timedelta(hours=idle_hours)
+            next_check = self.carrier._yunexpress_next_check(
+                picking, package_state, last_event_date
+            )
+            return next_check and (next_check - NOW).total_seconds() / 3600
+
+        with patch.object(fields.Datetime, "now", return_value=NOW):
+            # Waiting to be collected and incidences
+            self.assertEqual(hours(None), 6)
+            self.assertEqual(hours(1), 6)
+            self.assertEqual(hours(6), 4)
+            # In transit: a quarter of the quiet time, within bounds
+            self.assertEqual(hours(2, 40), 10)
+            self.assertEqual(hours(2, 1), 2)
+            self.assertEqual(hours(2, 400), 48)
+            # Approaching the expected delivery
+            picking.date_done = NOW - timedelta(days=8)
+            self.assertEqual(hours(2, 40), 6)
+            # Done
+            self.assertFalse(hours(3))
+            self.assertFalse(hours(5))
+            # The pushes keep it updated
+            self.carrier.yunexpress_tracking_push = True
+            self.assertEqual(hours(6), 48)
@@ -0,0 +1,88 @@
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+import json
+
+from odoo.tests import HttpCase, tagged
+
+from ..models.yunexpress_request import push_signature, verify_push_signature
+from .common import YunExpressCase
+
+
+@tagged("post_install", "-at_install")
+class TestYunExpressTrackingPush(YunExpressCase, HttpCase):
+    def setUp(self):
+        super().setUp()
+        self.carrier.yunexpress_tracking_push = True
+        self.picking = self._create_pickings(1)
+        self.picking.carrier_tracking_ref = "YT0000000001"
+        self.url = "/yunexpress/tracking/{}".format(self.carrier.id)
+        self.items = [
+            {
+                "WaybillNumber": "YT0000000001",
+                "PackageState": 2,
+                "OrderTrackingDetails": [
+                    {
+                        "ProcessDate": "2024-05-01T10:00:00",
+                        "ProcessContent": "Shipment information received",
+                        "ProcessLocation": "Shenzhen",
+                    }
+                ],
+            },
+            {
+                "WaybillNumber": "YT0000000001",
+                "PackageState": 3,
+                "OrderTrackingDetails": [
+                    {
+                        "ProcessDate": "2024-05-01T10:00:00",
+                        "ProcessContent": "Shipment information received",
+                        "ProcessLocation": "Shenzhen",
+                    },
+                    {
+                        "ProcessDate": "2024-05-08T12:00:00",
+                        "ProcessContent": "Delivered",
+                        "ProcessLocation": "Madrid",
+                    },
+                ],
+            },
+        ]
+
+    def _push(self, body, signature=None):
+        if signature is None:
+            signature = push_signature(self.carrier.yunexpress_api_secret, body)
+        return self.url_open(
+            self.url, data=body, headers={"X-YunExpress-Signature": signature}
+        )
+
+    def test_verify_push_signature(self):
+        body = b'{"WaybillNumber": "YT0000000001"}'
+        signature = push_signature("secret", body)
+        self.assertTrue(verify_push_signature("secret", body, signature))
+        self.assertFalse(verify_push_signature("other", body, signature))
+        self.assertFalse(verify_push_signature("secret", body, "é" * 64))
+        self.assertFalse(verify_push_signature("secret", body, ""))
+        self.assertFalse(verify_push_signature(False, body, signature))
+
+    def test_push_queued_and_applied(self):
+        response = self._push(json.dumps(self.items).encode("utf-8"))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["Count"], 2)
+        Event = self.env["yunexpress.tracking.event"]
+        events = Event.search([("carrier_id", "=", self.carrier.id)])
+        self.assertEqual(len(events), 2)
+        self.assertEqual(set(events.mapped("tracking_ref")), {"YT0000000001"})
+        Event._cron_apply_events()
+        self.assertFalse(Event.search([]))
+        self.picking.invalidate_recordset()
+        # The last event has the whole history
+        self.assertEqual(self.picking.yunexpress_package_state, 3)
+        self.assertEqual(self.picking.delivery_state, "customer_delivered")
+        self.assertEqual(len(self.picking.tracking_state_history.splitlines()), 2)
+
+    def test_push_rejected(self):
+        body = json.dumps(self.items).encode("utf-8")
+        self.assertEqual(self._push(body, "0" * 64).status_code, 403)
+        self.assertEqual(self._push(body, "é" * 64).status_code, 403)
+        self.assertEqual(self._push(body, "").status_code, 403)
+        self.assertEqual(self._push(b"{", None).status_code, 400)
+        self.assertFalse(self.env["yunexpress.tracking.event"].search([]))
+        self.carrier.yunexpress_tracking_push = False
+        self.assertEqual(self._push(body).status_code, 404)
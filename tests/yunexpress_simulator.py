@@ -0,0 +1,618 @@
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+"""Local simulator of the Yun Express API. It keeps the created orders in
+memory and answers with the shapes of the real API. Latencies, errors,
+throttling and outages can be scripted per endpoint, so the concurrency, retry
+and batching behaviour can be checked without touching a real account.
+
+Point the delivery methods at it with the `yunexpress_api_url` server option.
+It only needs the standard library, so it can run on its own:
+
+    python tests/yunexpress_simulator.py --port 8089 --scenario scenario.json
+
+A scenario is a JSON file like:
+
+    {
+        "default": {"latency": 0.05, "distribution": "lognormal", "spread": 0.5},
+        "endpoints": {
+            "CreateOrder": {"latency": 0.3, "error_rate": 0.02},
+            "GetTrackAllInfo": {"rate_limit": 20}
+        },
+        "outages": [{"start": 60, "duration": 30, "endpoints": ["Label/Print"]}]
+    }
+
+Endpoint names are the ones of the client retry policies: CreateOrder,
+GetOrder, Label/Print, download, GetTrackAllInfo, GetTrackingNumber,
+GetShippingMethods, Delete, Intercept, EmsKindList and CnePrint.
+"""
+import argparse
+import json
+import math
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+SUCCESS_MESSAGE = "提交成功"
+# Seconds between tracking progress steps of every order
+TRACKING_STEP = 60
+# Tracking progress: (PackageState, event description, location)
+TRACKING_STEPS = [
+    (1, "Shipment information received", "Shenzhen"),
+    (2, "Departed from the origin facility", "Shenzhen"),
+    (2, "Arrived at the destination country", "Madrid"),
+    (4, "Out for delivery", "Madrid"),
+    (3, "Delivered", "Madrid"),
+]
+# Labels printed in every sheet of the Label/Print document models
+LABELS_PER_SHEET = {"MULTI3": 3, "MULTI4": 4}
+SHIPPING_METHODS = [
+    ("THPHR", "云途全球专线挂号（特惠普货）", "Global Line Registered (General)"),
+    ("THZXR", "云途全球专线挂号（特惠带电）", "Global Line Registered (Battery)"),
+    ("FZZXR", "云途全球服装专线挂号", "Global Apparel Line Registered"),
+]
+
+
+def make_pdf(pages):
+    """Minimal PDF document with a page per label
+
+    :param list pages: Text of every page
+    :return bytes: PDF content
+    """
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        None,
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    kids = []
+    for text in pages:
+        text = text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+        stream = "BT /F1 24 Tf 20 200 Td ({}) Tj ET".format(text).encode("latin-1")
+        objects.append(
+            b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream)
+        )
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 283 425] "
+            b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>"
+            % len(objects)
+        )
+        kids.append(b"%d 0 R" % len(objects))
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (
+        b" ".join(kids),
+        len(kids),
+    )
+    content = b"%PDF-1.4\n"
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(content))
+        content += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+    xref = len(content)
+    content += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    content += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    content += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (
+        len(objects) + 1,
+        xref,
+    )
+    return content
+
+
+class EndpointScript:
+    """Behaviour of an endpoint
+
+    :param float latency: Mean seconds before answering
+    :param str distribution: (fixed|uniform|normal|lognormal|exponential)
+    :param float spread: Half width for uniform, standard deviation for normal
+        and sigma for lognormal
+    :param float error_rate: Share of calls answered with `error_status`
+    :param int error_status: HTTP status of the injected errors
+    :param float drop_rate: Share of calls which connection is dropped without
+        an answer
+    :param float rate_limit: Calls per second allowed, the rest get a 429
+    """
+
+    def __init__(
+        self,
+        latency=0.0,
+        distribution="fixed",
+        spread=0.0,
+        error_rate=0.0,
+        error_status=500,
+        drop_rate=0.0,
+        rate_limit=None,
+    ):
+        self.latency = latency
+        self.distribution = distribution
+        self.spread = spread
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.drop_rate = drop_rate
+        self.rate_limit = rate_limit
+        self._tokens = rate_limit or 0.0
+        self._refilled_at = time.time()
+        self._lock = threading.Lock()
+
+    def delay(self):
+        """Seconds to wait before answering"""
+        if self.latency <= 0:
+            return 0.0
+        if self.distribution == "uniform":
+            delay = random.uniform(self.latency - self.spread, self.latency + self.spread)
+        elif self.distribution == "normal":
+            delay = random.gauss(self.latency, self.spread)
+        elif self.distribution == "lognormal":
+            # Lognormal with the given mean
+            sigma = self.spread or 0.5
+            delay = random.lognormvariate(math.log(self.latency) - sigma**2 / 2, sigma)
+        elif self.distribution == "exponential":
+            delay = random.expovariate(1 / self.latency)
+        else:
+            delay = self.latency
+        return max(delay, 0.0)
+
+    def throttled(self):
+        """Take a token of the endpoint rate limit
+
+        :return bool: The call goes over the limit
+        """
+        if not self.rate_limit:
+            return False
+        with self._lock:
+            now = time.time()
+            self._tokens = min(
+                self.rate_limit,
+                self._tokens + (now - self._refilled_at) * self.rate_limit,
+            )
+            self._refilled_at = now
+            if self._tokens < 1:
+                return True
+            self._tokens -= 1
+            return False
+
+
+class YunExpressSimulator:
+    """Yun Express API simulator running in a thread
+
+    :param str host: Address to listen on
+    :param int port: Port to listen on, a free one by default
+    :param float latency: Mean seconds before every answer
+    :param float jitter: Maximum seconds added or removed to the latency
+    :param dict scenario: Scripted behaviour, see the module description
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, jitter=0.0, scenario=None):
+        self.default = EndpointScript(latency, "uniform", jitter)
+        self.scripts = {}
+        self.outages = []
+        self.orders = {}
+        self.waybills = {}
+        self.documents = {}
+        self.calls = {}
+        self.started_at = time.time()
+        self._lock = threading.RLock()
+        self._sequence = 0
+        if scenario:
+            self.load_scenario(scenario)
+        self.server = ThreadingHTTPServer((host, port), self._handler_class())
+        self.server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return "http://{}:{}".format(host, port)
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self.server.serve_forever, name="yunexpress_simulator", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    # Scripting
+
+    def load_scenario(self, scenario):
+        """Apply a scenario
+
+        :param dict scenario: default, endpoints and outages scripts
+        """
+        if scenario.get("default"):
+            self.default = EndpointScript(**scenario["default"])
+        for endpoint, script in (scenario.get("endpoints") or {}).items():
+            self.script(endpoint, **script)
+        for outage in scenario.get("outages") or []:
+            outage = dict(outage)
+            start = self.started_at + outage.pop("start", 0)
+            self.outage(outage.pop("duration"), start=start, **outage)
+
+    def script(self, endpoint, **options):
+        """Set the behaviour of an endpoint. See `EndpointScript` options."""
+        self.scripts[endpoint] = EndpointScript(**options)
+
+    def outage(self, duration, start=None, endpoints=None, status=503, drop=False):
+        """Make the API (or some endpoints) unavailable for a while
+
+        :param float duration: Seconds of outage
+        :param float start: Epoch when it starts, right now by default
+        :param list endpoints: Affected endpoints, all of them by default
+        :param int status: HTTP status returned meanwhile
+        :param bool drop: Drop the connections instead of answering
+        """
+        start = time.time() if start is None else start
+        with self._lock:
+            self.outages.append(
+                (start, start + duration, set(endpoints or []), status, drop)
+            )
+
+    def reset(self):
+        """Forget the scripts, outages and counters. Orders are kept."""
+        with self._lock:
+            self.default = EndpointScript()
+            self.scripts = {}
+            self.outages = []
+            self.calls = {}
+
+    def _fault(self, endpoint):
+        """Fault to inject for this call
+
+        :return tuple: (HTTP status, drop connection) or None
+        """
+        now = time.time()
+        for start, end, endpoints, status, drop in self.outages:
+            if start <= now < end and (not endpoints or endpoint in endpoints):
+                return status, drop
+        script = self.scripts.get(endpoint, self.default)
+        if script.throttled():
+            return 429, False
+        if script.drop_rate and random.random() < script.drop_rate:
+            return None, True
+        if script.error_rate and random.random() < script.error_rate:
+            return script.error_status, False
+        return None
+
+    def _next(self, prefix):
+        with self._lock:
+            self._sequence += 1
+            return "{}{:010d}".format(prefix, self._sequence)
+
+    def _order(self, code):
+        """Order by customer order number or waybill number"""
+        number = self.waybills.get(code, code)
+        return number, self.orders.get(number)
+
+    # Endpoints: they get the decoded body and the query string and return
+    # (status, payload) or (status, content, content type)
+
+    def create_order(self, orders, query):
+        items = []
+        for order in orders or []:
+            number = order.get("CustomerOrderNumber")
+            with self._lock:
+                exists = number in self.orders
+                if not exists:
+                    waybill = self._next("YT")
+                    self.orders[number] = {
+                        "WayBillNumber": waybill,
+                        "TrackingNumber": "",
+                        "Status": 3,
+                        "ShippingMethodCode": order.get("ShippingMethodCode"),
+                        "created": time.time(),
+                    }
+                    self.waybills[waybill] = number
+            if exists:
+                items.append(
+                    {
+                        "CustomerOrderNumber": number,
+                        "Success": 0,
+                        "TrackType": "",
+                        "Remark": "订单号重复",
+                        "WayBillNumber": "",
+                        "TrackingNumber": "",
+                    }
+                )
+                continue
+            items.append(
+                {
+                    "CustomerOrderNumber": number,
+                    "Success": 1,
+                    "TrackType": "1",
+                    "Remark": "",
+                    "WayBillNumber": waybill,
+                    "TrackingNumber": "",
+                }
+            )
+        code = "0000" if all(item["Success"] for item in items) else "1001"
+        return 200, {"Item": items, "Code": code, "Message": SUCCESS_MESSAGE}
+
+    def get_order(self, body, query):
+        number, order = self._order((body or {}).get("OrderNumber"))
+        if not order:
+            return 200, {"Item": None, "Code": "1011", "Message": "订单不存在"}
+        return 200, {
+            "Item": {
+                "CustomerOrderNumber": number,
+                "WayBillNumber": order["WayBillNumber"],
+                "TrackingNumber": order["TrackingNumber"],
+                "Status": order["Status"],
+                "ShippingMethodCode": order["ShippingMethodCode"],
+            },
+            "Code": "0000",
+            "Message": SUCCESS_MESSAGE,
+        }
+
+    def label_print(self, codes, query):
+        infos, pages = [], []
+        for code in codes or []:
+            number, order = self._order(code)
+            if not order:
+                infos.append(
+                    {
+                        "CustomerOrderNumber": code,
+                        "WayBillNumber": "",
+                        "ErrorBody": "订单不存在",
+                        "ErrorCode": 1011,
+                    }
+                )
+                continue
+            infos.append(
+                {
+                    "CustomerOrderNumber": number,
+                    "WayBillNumber": order["WayBillNumber"],
+                    "ErrorBody": None,
+                    "ErrorCode": 0,
+                }
+            )
+            pages.append(order["WayBillNumber"])
+        per_sheet = LABELS_PER_SHEET.get((query.get("ModelCode") or [""])[0], 1)
+        # The offset leaves the first slots of the first sheet blank
+        if per_sheet > 1:
+            offset = int((query.get("Offset") or ["0"])[0] or 0) % per_sheet
+            pages = ["-"] * offset + pages
+        pages = [
+            " / ".join(pages[index : index + per_sheet])
+            for index in range(0, len(pages), per_sheet)
+        ]
+        return 200, {
+            "Item": [{"Url": self._document_url(pages), "LabelPrintInfos": infos}],
+            "Code": "0000",
+            "Message": SUCCESS_MESSAGE,
+        }
+
+    def _document_url(self, pages):
+        document = self._next("L")
+        with self._lock:
+            self.documents[document] = pages
+        return "{}/labels/{}.pdf".format(self.url, document)
+
+    def download(self, document):
+        pages = self.documents.get(document)
+        if pages is None:
+            return 404, b"", "text/plain"
+        return 200, make_pdf(pages), "application/pdf"
+
+    def track_all_info(self, body, query):
+        waybill = (body or {}).get("OrderNumber")
+        _number, order = self._order(waybill)
+        if not order:
+            return 200, {"Item": None, "Code": "1011", "Message": "无跟踪信息"}
+        steps = TRACKING_STEPS[
+            : min(
+                len(TRACKING_STEPS),
+                1 + int((time.time() - order["created"]) // TRACKING_STEP),
+            )
+        ]
+        events = [
+            {
+                "ProcessDate": time.strftime(
+                    "%Y-%m-%dT%H:%M:%S",
+                    time.gmtime(order["created"] + index * TRACKING_STEP),
+                ),
+                "ProcessContent": content,
+                "ProcessLocation": location,
+            }
+            for index, (_state, content, location) in enumerate(steps)
+        ]
+        return 200, {
+            "Item": {
+                "WaybillNumber": order["WayBillNumber"],
+                "TrackingNumber": order["TrackingNumber"],
+                "PackageState": steps[-1][0],
+                "OrderTrackingDetails": events,
+            },
+            "Code": "0000",
+            "Message": SUCCESS_MESSAGE,
+        }
+
+    def get_tracking_number(self, body, query):
+        codes = (body or {}).get("CustomerOrderNumber") or ",".join(
+            query.get("CustomerOrderNumber") or []
+        )
+        items = []
+        for code in filter(None, codes.split(",")):
+            number, order = self._order(code.strip())
+            if not order:
+                continue
+            with self._lock:
+                if not order["TrackingNumber"]:
+                    order["TrackingNumber"] = self._next("LP")
+            items.append(
+                {
+                    "CustomerOrderNumber": number,
+                    "WayBillNumber": order["WayBillNumber"],
+                    "TrackingNumber": order["TrackingNumber"],
+                }
+            )
+        return 200, {"Item": items, "Code": "0000", "Message": SUCCESS_MESSAGE}
+
+    def delete_order(self, body, query):
+        number, order = self._order((body or {}).get("OrderNumber"))
+        if not order:
+            return 200, {"Item": None, "Code": "1011", "Message": "订单不存在"}
+        # Orders are received once their tracking starts moving
+        if time.time() - order["created"] >= TRACKING_STEP:
+            return 200, {"Item": None, "Code": "1001", "Message": "订单已收货，不能删除"}
+        with self._lock:
+            self.orders.pop(number, None)
+            self.waybills.pop(order["WayBillNumber"], None)
+        return 200, {
+            "Item": {"OrderNumber": order["WayBillNumber"], "Result": True},
+            "Code": "0000",
+            "Message": SUCCESS_MESSAGE,
+        }
+
+    def intercept_order(self, body, query):
+        _number, order = self._order((body or {}).get("OrderNumber"))
+        if not order:
+            return 200, {"Item": None, "Code": "1011", "Message": "订单不存在"}
+        with self._lock:
+            order["Intercepted"] = True
+        return 200, {
+            "Item": {"OrderNumber": order["WayBillNumber"], "Result": True},
+            "Code": "0000",
+            "Message": SUCCESS_MESSAGE,
+        }
+
+    def get_shipping_methods(self, body, query):
+        return 200, {
+            "Items": [
+                {"Code": code, "CName": cname, "EName": ename, "HaveTrackingNum": True}
+                for code, cname, ename in SHIPPING_METHODS
+            ],
+            "Code": "0000",
+            "Message": SUCCESS_MESSAGE,
+        }
+
+    def ems_data(self, body, query):
+        if (body or {}).get("RequestName") != "EmsKindList":
+            return 200, {"ReturnValue": -1, "cMess": "Unknown request"}
+        return 200, {
+            "ReturnValue": len(SHIPPING_METHODS),
+            "cMess": "",
+            "List": [{"oName": code, "cName": cname} for code, cname, _e in SHIPPING_METHODS],
+        }
+
+    def cne_print(self, body, query):
+        codes = (query.get("cNos") or [""])[0]
+        pages = [code for code in codes.split(",") if code]
+        if not pages:
+            return 200, {"ErrorCode": 1, "Data": None}
+        return 200, {"ErrorCode": 0, "Data": self._document_url(pages)}
+
+    def _handler_class(self):
+        simulator = self
+        routes = {
+            ("POST", "/api/WayBill/CreateOrder"): ("CreateOrder", self.create_order),
+            ("POST", "/api/WayBill/GetOrder"): ("GetOrder", self.get_order),
+            ("POST", "/api/Label/Print"): ("Label/Print", self.label_print),
+            ("POST", "/api/Tracking/GetTrackAllInfo"): (
+                "GetTrackAllInfo",
+                self.track_all_info,
+            ),
+            ("GET", "/api/Waybill/GetTrackingNumber"): (
+                "GetTrackingNumber",
+                self.get_tracking_number,
+            ),
+            ("POST", "/api/WayBill/Delete"): ("Delete", self.delete_order),
+            ("POST", "/api/WayBill/Intercept"): ("Intercept", self.intercept_order),
+            ("GET", "/api/Common/GetShippingMethods"): (
+                "GetShippingMethods",
+                self.get_shipping_methods,
+            ),
+            ("POST", "/cgi-bin/EmsData.dll"): ("EmsKindList", self.ems_data),
+            ("GET", "/CnePrint"): ("CnePrint", self.cne_print),
+        }
+        label_path = re.compile(r"^/labels/(\w+)\.pdf$")
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                return
+
+            def _send(self, status, content, content_type="application/json"):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+            def _dispatch(self, method):
+                url = urlsplit(self.path)
+                length = int(self.headers.get("Content-Length") or 0)
+                raw = self.rfile.read(length) if length else b""
+                match = label_path.match(url.path)
+                if method == "GET" and match:
+                    endpoint, handler = "download", None
+                else:
+                    endpoint, handler = routes.get((method, url.path), (None, None))
+                    if not handler:
+                        return self._send(404, b"")
+                with simulator._lock:
+                    simulator.calls[endpoint] = simulator.calls.get(endpoint, 0) + 1
+                script = simulator.scripts.get(endpoint, simulator.default)
+                time.sleep(script.delay())
+                fault = simulator._fault(endpoint)
+                if fault:
+                    status, drop = fault
+                    if drop:
+                        self.close_connection = True
+                        return
+                    return self._send(
+                        status,
+                        json.dumps({"Code": str(status), "Message": "Simulated error"})
+                        .encode("utf-8"),
+                    )
+                if not handler:
+                    return self._send(*simulator.download(match.group(1)))
+                try:
+                    body = json.loads(raw) if raw else None
+                except ValueError:
+                    return self._send(400, b"")
+                status, payload = handler(body, parse_qs(url.query))
+                self._send(status, json.dumps(payload).encode("utf-8"))
+
+            def do_GET(self):
+                self._dispatch("GET")
+
+            def do_POST(self):
+                self._dispatch("POST")
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Yun Express API simulator")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Seconds")
+    parser.add_argument("--scenario", help="JSON scenario file")
+    args = parser.parse_args()
+    scenario = None
+    if args.scenario:
+        with open(args.scenario) as scenario_file:
+            scenario = json.load(scenario_file)
+    simulator = YunExpressSimulator(
+        args.host, args.port, args.latency, args.jitter, scenario
+    )
+    print("Yun Express simulator listening on {}".format(simulator.url))
+    simulator.start()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        simulator.stop()
+
+
+if __name__ == "__main__":
+    main()
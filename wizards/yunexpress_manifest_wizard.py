@@ -1,8 +1,34 @@
 # Copyright 2022 Tecnativa - David Vidal
 # License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
-import base64
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, time, timedelta
 
-from odoo import fields, models
+import pytz
+import xlsxwriter
+from reportlab.lib.pagesizes import A4, landscape
+from reportlab.pdfgen import canvas
+
+from odoo import _, api, fields, models
+from odoo.tools.config import config
+
+# Accounts processed at once. Tunable with `yunexpress_manifest_workers`
+YUNEXPRESS_MANIFEST_WORKERS = 4
+YUNEXPRESS_MANIFEST_HEADER = [
+    "Ship date",
+    "Order number",
+    "Waybill number",
+    "Picking",
+    "Channel",
+    "Recipient",
+    "Country",
+    "Zip",
+    "City",
+    "Weight",
+]
+# PDF columns x position in points
+YUNEXPRESS_MANIFEST_PDF_COLUMNS = [30, 130, 250, 350, 440, 490, 640, 680, 730, 800]
 
 
 class CNEExpressManifestWizard(models.TransientModel):
@@ -32,53 +58,136 @@ class CNEExpressManifestWizard(models.TransientModel):
         comodel_name="ir.attachment", readonly=True, string="Manifests"
     )
 
+    def _date_range(self):
+        """The dates range in the user timezone as UTC datetimes"""
+        tz = pytz.timezone(self.env.user.tz or "UTC")
+        return tuple(
+            tz.localize(datetime.combine(date, time.min))
+            .astimezone(pytz.utc)
+            .replace(tzinfo=None)
+            for date in (self.from_date, self.to_date + timedelta(days=1))
+        )
+
+    @api.model
+    def _write_xlsx(self, path, rows):
+        """Write the manifest rows as they come. In constant memory mode only
+        the current row is kept in memory.
+        """
+        workbook = xlsxwriter.Workbook(path, {"constant_memory": True})
+        sheet = workbook.add_worksheet(_("Manifest"))
+        bold = workbook.add_format({"bold": True})
+        date_format = workbook.add_format({"num_format": "yyyy-mm-dd hh:mm"})
+        sheet.write_row(0, 0, YUNEXPRESS_MANIFEST_HEADER, bold)
+        for index, row in enumerate(rows, 1):
+            sheet.write_datetime(index, 0, row[0], date_format)
+            sheet.write_row(index, 1, row[1:])
+        workbook.close()
+
+    @api.model
+    def _write_pdf(self, path, rows, title):
+        """Draw the manifest rows as they come, page after page"""
+        width, height = landscape(A4)
+        pdf = canvas.Canvas(path, pagesize=(width, height), pageCompression=1)
+
+        def header():
+            pdf.setFont("Helvetica-Bold", 11)
+            pdf.drawString(30, height - 30, title)
+            pdf.setFont("Helvetica-Bold", 7)
+            for x, name in zip(
+                YUNEXPRESS_MANIFEST_PDF_COLUMNS, YUNEXPRESS_MANIFEST_HEADER
+            ):
+                pdf.drawString(x, height - 50, name)
+            pdf.setFont("Helvetica", 7)
+            return height - 62
+
+        y = header()
+        for row in rows:
+            if y < 30:
+                pdf.showPage()
+                y = header()
+            values = [fields.Datetime.to_string(row[0])] + [
+                "" if value is None else str(value) for value in row[1:]
+            ]
+            for x, value in zip(YUNEXPRESS_MANIFEST_PDF_COLUMNS, values):
+                pdf.drawString(x, y, value[:30])
+            y -= 10
+        pdf.save()
+
+    @api.model
+    def _write_manifest(self, api_cid, carrier_ids, date_range, document_type):
+        """Write the manifest of an account in a temporary file
+
+        :return str: File path
+        """
+        rows = self.env["yunexpress.shipment"]._manifest_rows(
+            api_cid, carrier_ids, *date_range
+        )
+        handle, path = tempfile.mkstemp(suffix="." + document_type.lower())
+        os.close(handle)
+        if document_type == "PDF":
+            self._write_pdf(path, rows, _("Yun Express manifest %s") % api_cid)
+        else:
+            self._write_xlsx(path, rows)
+        return path
+
     def get_manifest(self):
-        """List of shippings for the given dates as YUN provides them"""
+        """List of shippings for the given dates from our shipment records.
+        Every account manifest is written in parallel with its own cursor.
+        """
         carriers = self.carrier_ids or self.env["delivery.carrier"].search(
             [("delivery_type", "=", "yunexpress")]
         )
-        # Avoid getting repeated manifests. Carriers with different service
-        # configuration would produce the same manifest.
-        unique_accounts = {
-            (c.yunexpress_customer, c.yunexpress_contract, c.yunexpress_agency)
-            for c in carriers
-        }
-        filtered_carriers = self.env["delivery.carrier"]
-        for customer, contract, agency in unique_accounts:
-            filtered_carriers += fields.first(
-                carriers.filtered(
-                    lambda x: x.yunexpress_customer == customer
-                    and x.yunexpress_contract == contract
-                    and x.yunexpress_agency == agency
-                )
-            )
-        for carrier in filtered_carriers:
-            yun_request = carrier._yun_request()
-            from_date = fields.Date.to_string(self.from_date)
-            to_date = fields.Date.to_string(self.to_date)
-            error, manifest = yun_request.report_shipping(
-                "ODOO", self.document_type, from_date, to_date
-            )
-            carrier._yun_check_error(error)
-            carrier._yun_log_request(yun_request)
-            for _filename, file in manifest:
-                filename = "{}{}{}-{}-{}.{}".format(
-                    carrier.yunexpress_customer,
-                    carrier.yunexpress_contract,
-                    carrier.yunexpress_agency,
-                    from_date.replace("-", ""),
-                    to_date.replace("-", ""),
-                    self.document_type.lower(),
+        # Carriers with the same account share the manifest
+        accounts = {}
+        for carrier in carriers:
+            api_cid = carrier._yunexpress_api_cid()
+            if api_cid:
+                accounts.setdefault(api_cid, []).append(carrier.id)
+        date_range = self._date_range()
+        self.env["yunexpress.shipment"].flush_model()
+        registry, uid, context = self.env.registry, self.env.uid, self.env.context
+
+        def write(account):
+            api_cid, carrier_ids = account
+            with registry.cursor() as cr:
+                env = api.Environment(cr, uid, context)
+                return env[self._name]._write_manifest(
+                    api_cid, carrier_ids, date_range, self.document_type
                 )
-                self.attachment_ids += self.env["ir.attachment"].create(
-                    {
-                        "datas": base64.b64encode(file),
-                        "name": filename,
-                        "res_model": self._name,
-                        "res_id": self.id,
-                        "type": "binary",
-                    }
+
+        workers = int(
+            config.get("yunexpress_manifest_workers") or YUNEXPRESS_MANIFEST_WORKERS
+        )
+        if len(accounts) < 2 or workers < 2 or registry.in_test_mode():
+            paths = [
+                self._write_manifest(
+                    api_cid, carrier_ids, date_range, self.document_type
                 )
+                for api_cid, carrier_ids in accounts.items()
+            ]
+        else:
+            with ThreadPoolExecutor(
+                max_workers=min(len(accounts), workers)
+            ) as executor:
+                paths = list(executor.map(write, accounts.items()))
+        from_date = fields.Date.to_string(self.from_date).replace("-", "")
+        to_date = fields.Date.to_string(self.to_date).replace("-", "")
+        for api_cid, path in zip(accounts, paths):
+            try:
+                with open(path, "rb") as manifest:
+                    self.attachment_ids += self.env["ir.attachment"].create(
+                        {
+                            "raw": manifest.read(),
+                            "name": "{}-{}-{}.{}".format(
+                                api_cid, from_date, to_date, self.document_type.lower()
+                            ),
+                            "res_model": self._name,
+                            "res_id": self.id,
+                            "type": "binary",
+                        }
+                    )
+            finally:
+                os.unlink(path)
         self.state = "done"
         return dict(
             self.env["ir.actions.act_window"]._for_xml_id(
@@ -1,4 +1,7 @@
-from odoo import api, fields, models
+import re
+
+from odoo import _, api, fields, models
+from odoo.exceptions import UserError
 
 
 class CNEExpressPickupWizard(models.TransientModel):
@@ -11,46 +14,116 @@ class CNEExpressPickupWizard(models.TransientModel):
     )
     shipping_code = fields.Char(
         string="Shipping Code",
-        help="Shipping code to be used for the pickup request",
-        required=True,
+        help="Shipping codes to be used for the pickup request, separated by "
+        "commas or spaces",
+    )
+    picking_ids = fields.Many2many(
+        comodel_name="stock.picking",
+        string="Transfers",
+        domain=[
+            ("delivery_type", "=", "yunexpress"),
+            ("carrier_tracking_ref", "!=", False),
+        ],
+        help="Shipped transfers to be requested with their own delivery method",
     )
     # delivery_date = fields.Date(required=True, default=fields.Date.context_today)
     # min_hour = fields.Float(required=True)
     # max_hour = fields.Float(required=True, default=23.99)
     code = fields.Char(readonly=True)
+    line_ids = fields.One2many(
+        comodel_name="yunexpress.pickup.wizard.line",
+        inverse_name="wizard_id",
+        readonly=True,
+    )
+    failed_count = fields.Integer(compute="_compute_failed_count")
     state = fields.Selection(
         selection=[("new", "new"), ("done", "done")],
         default="new",
         readonly=True,
     )
 
-    @api.onchange("min_hour", "max_hour")
-    def _onchange_hours(self):
-        """Min and max hours UX"""
-        # Avoid negative or after midnight
-        self.min_hour = min(self.min_hour, 23.99)
-        self.min_hour = max(self.min_hour, 0.0)
-        self.max_hour = min(self.max_hour, 23.99)
-        self.max_hour = max(self.max_hour, 0.0)
-        # Avoid wrong order
-        self.max_hour = max(self.max_hour, self.min_hour)
+    @api.model
+    def default_get(self, fields_list):
+        """Pickings selected in the transfers list"""
+        res = super().default_get(fields_list)
+        if self.env.context.get("active_model") != "stock.picking":
+            return res
+        pickings = (
+            self.env["stock.picking"]
+            .browse(self.env.context.get("active_ids") or [])
+            .filtered(
+                lambda x: x.delivery_type == "yunexpress" and x.carrier_tracking_ref
+            )
+        )
+        res["picking_ids"] = [(6, 0, pickings.ids)]
+        if pickings and "carrier_id" in fields_list:
+            res["carrier_id"] = pickings[0].carrier_id.id
+        return res
 
-    def create_pickup_request(self):
-        """Get the pickup code"""
+    @api.depends("line_ids.state")
+    def _compute_failed_count(self):
+        for wizard in self:
+            wizard.failed_count = len(
+                wizard.line_ids.filtered(lambda x: x.state == "failed")
+            )
 
-        def convert_float_time_to_str(float_time):
-            """Helper to pass the times in the expexted format 'HH:MM'"""
-            return "{:02.0f}:{:02.0f}".format(*divmod(float_time * 60, 60))
+    def _pickup_codes(self):
+        """Codes to request grouped by delivery method. Pickings are requested
+        by their customer order number.
 
-        yun_request = self.carrier_id._yun_request()
-        # delivery_date = fields.Date.to_string(self.delivery_date)
-        shipping_code = self.shipping_code
-        error, code = yun_request.create_request(
-            shipping_code,
+        :return dict: {carrier: [(code, picking)]}
+        """
+        codes = {}
+        for picking in self.picking_ids:
+            codes.setdefault(picking.carrier_id, []).append(
+                (
+                    picking.yunexpress_order_number or picking.carrier_tracking_ref,
+                    picking,
+                )
+            )
+        shipping_codes = [
+            code for code in re.split(r"[\s,;]+", self.shipping_code or "") if code
+        ]
+        if shipping_codes and not self.carrier_id:
+            raise UserError(_("Select the delivery method of the shipping codes"))
+        picking = self.env["stock.picking"]
+        for code in shipping_codes:
+            codes.setdefault(self.carrier_id, []).append((code, picking))
+        return codes
+
+    def create_pickup_request(self):
+        """Get the pickup codes. Every code gets its result line, so the
+        failing ones can be checked and requested again.
+        """
+        codes = self._pickup_codes()
+        if not codes:
+            raise UserError(_("There are no shipping codes to request"))
+        lines = []
+        for carrier, carrier_codes in codes.items():
+            results = carrier.yunexpress_get_tracking_numbers(
+                [code for code, _picking in carrier_codes]
+            )
+            for code, picking in carrier_codes:
+                errors, result = results[code]
+                lines.append(
+                    {
+                        "wizard_id": self.id,
+                        "carrier_id": carrier.id,
+                        "picking_id": picking.id,
+                        "shipping_code": code,
+                        "waybill_number": result and result.waybill_number,
+                        "tracking_number": result and result.tracking_number,
+                        "state": "failed" if errors else "done",
+                        "error": "\n".join(
+                            "{} - {}".format(*error) for error in errors
+                        ),
+                    }
+                )
+        self.line_ids.unlink()
+        self.env["yunexpress.pickup.wizard.line"].create(lines)
+        self.code = ", ".join(
+            self.line_ids.filtered("tracking_number").mapped("tracking_number")
         )
-        self.carrier_id._yun_check_error(error)
-        self.carrier_id._yun_log_request(yun_request)
-        self.code = code
         self.state = "done"
         return dict(
             self.env["ir.actions.act_window"]._for_xml_id(
@@ -58,3 +131,19 @@ class CNEExpressPickupWizard(models.TransientModel):
             ),
             res_id=self.id,
         )
+
+
+class CNEExpressPickupWizardLine(models.TransientModel):
+    _name = "yunexpress.pickup.wizard.line"
+    _description = "Shipping pickup result"
+
+    wizard_id = fields.Many2one(
+        comodel_name="yunexpress.pickup.wizard", required=True, ondelete="cascade"
+    )
+    carrier_id = fields.Many2one(comodel_name="delivery.carrier")
+    picking_id = fields.Many2one(comodel_name="stock.picking")
+    shipping_code = fields.Char()
+    waybill_number = fields.Char()
+    tracking_number = fields.Char()
+    state = fields.Selection(selection=[("done", "Done"), ("failed", "Failed")])
+    error = fields.Text()